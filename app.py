@@ -1,55 +1,231 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, session, jsonify, send_file, abort
 from werkzeug.security import check_password_hash, generate_password_hash
-import sqlite3
+import database
+import metrics
+import profiling
+from database import get_db, execute_write, submit_write
 from datetime import date
-from werkzeug.utils import secure_filename
 import os
-import tensorflow as tf
-from PIL import Image
-import numpy as np
-from flask_sqlalchemy import SQLAlchemy
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+import json
+import multiprocessing
+import threading
+import time
+from inference import InferenceEngine
+from inference_pool import InferencePool
+from prediction_cache import PredictionCache
+from model_loader import LazyModel
+from model_registry import ModelRegistry, RegistryWatcher
+from backends import default_model_path
+from preprocess import preprocess_upload
+from listing import PATIENTS, RECOMMENDATIONS, page_from_request
+from streaming import render_listing, stream_response
+from slide_scan import (DEFAULT_MAX_CELL_BYTES, DEFAULT_MAX_CELLS, SlideTooLarge, iter_uploaded_cells, scan_slide,
+                        summary_text)
+from tta import DEFAULT_TTA_VARIANTS, check_variants, predict_tta, tta_summary
+from calibration import DEFAULT_THRESHOLD, Calibrations, prediction_result
+from job_queue import JOB_KIND, JobQueue
+from prediction_log import (ATTACH_PENDING_SQL, ATTACH_SQL, INSERT_SQL, LABEL_SQL, SCORE_COLUMNS, new_prediction_id,
+                            prediction_row, roc, sweep)
+from stats import StatsCache
+from reports import ReportJobs, ReportQueueFull, ReportStore, make_spooler, export_patients, iter_patients_pdf
 
 app = Flask(__name__)
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///malaria_management.db' 
 app.secret_key = 'secret123'
-db = SQLAlchemy(app)
 
-# SQLite database configuration
-DATABASE_NAME = 'malaria_management.db'
-
-# Function to get a database connection
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE_NAME)
-    conn.row_factory = sqlite3.Row
-    return conn
+# SQLite database configuration: one pooled connection per request, see database.py
+app.config['DATABASE'] = os.environ.get('MALARIA_DB', 'malaria_management.db')
+database.init_app(app)
+
+# Request counters and per-stage timings in the Prometheus text format on
+# /metrics (see metrics.py); cheap enough to leave on
+metrics.init_app(app)
+
+# Opt-in request profiling (see profiling.py): PROFILE_SAMPLE_RATE of all
+# requests, requests with X-Profile: <PROFILE_TOKEN>, or the next N
+# requests an admin asks for on /admin/profiles
+app.config.setdefault('PROFILE_SAMPLE_RATE', float(os.environ.get('PROFILE_SAMPLE_RATE', 0)))
+app.config.setdefault('PROFILE_TOKEN', os.environ.get('PROFILE_TOKEN'))
+app.config.setdefault('PROFILE_HEADER', profiling.DEFAULT_PROFILE_HEADER)
+app.config.setdefault('PROFILER', os.environ.get('PROFILER', 'cprofile'))
+app.config.setdefault('PROFILE_DIR', os.environ.get('PROFILE_DIR', profiling.DEFAULT_PROFILE_DIR))
+app.config.setdefault('PROFILE_KEEP', profiling.DEFAULT_PROFILE_KEEP)
+profiles = profiling.ProfileStore(app.config['PROFILE_DIR'], keep=app.config['PROFILE_KEEP'])
+profiler = profiling.ProfilingMiddleware(app, profiles, sample_rate=app.config['PROFILE_SAMPLE_RATE'],
+                                         header=app.config['PROFILE_HEADER'], token=app.config['PROFILE_TOKEN'],
+                                         profiler=app.config['PROFILER'])
+app.wsgi_app = profiler
+
+# Dashboard counters: trigger-maintained in the DB (migration 4), with a
+# short-TTL snapshot in front. Requests that change what it counts drop
+# the snapshot.
+app.config.setdefault('STATS_TTL', 2.0)
+app.config.setdefault('STATS_DAYS', 7)
+dashboard_stats = StatsCache(ttl=app.config['STATS_TTL'], days=app.config['STATS_DAYS'])
+
+# Patient PDF reports are rendered (and printed) on a small worker pool and
+# cached per patient + row version under REPORT_DIR. REPORT_SPOOLER picks
+# the printer: lpr, or local (copies into REPORT_DIR/spool) for testing.
+app.config.setdefault('REPORT_DIR', os.environ.get('REPORT_DIR', 'reports'))
+app.config.setdefault('REPORT_SPOOLER', os.environ.get('REPORT_SPOOLER', 'lpr'))
+app.config.setdefault('REPORT_WORKERS', 2)
+app.config.setdefault('REPORT_MAX_PENDING', 64)
+report_jobs = ReportJobs(ReportStore(app.config['REPORT_DIR']),
+                         make_spooler(app.config['REPORT_SPOOLER'], app.config['REPORT_DIR']),
+                         max_workers=app.config['REPORT_WORKERS'],
+                         max_pending=app.config['REPORT_MAX_PENDING'])
+
+# Endpoints writing patients, doctors, lab / office staff (and their
+# Users rows) or patient results; /predictslide invalidates itself when it
+# saves a result. The add* pages only write on POST, deletes also on GET.
+STATS_WRITE_ENDPOINTS = {
+    'addpatient', 'addpatientnew1', 'addpatient3', 'adddoctor', 'addoffice', 'addlab',
+    'delete_patient', 'delete_patientnew', 'delete_patientnew1', 'delete_patientnew3',
+    'delete_doctor', 'delete_office', 'delete_lab',
+}
+
+@app.after_request
+def invalidate_stats(response):
+    endpoint = request.endpoint or ''
+    if endpoint in STATS_WRITE_ENDPOINTS and (request.method == 'POST' or endpoint.startswith('delete')):
+        dashboard_stats.invalidate()
+    return response
 
 # Check if the provided username and password are valid
 def is_valid_user(username, password):
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
     # Retrieve the user from the database based on the provided username
-    cursor.execute('SELECT * FROM Users WHERE LOWER(Username) = LOWER(?)', (username,))
+    # (case-insensitive, served by idx_users_username_nocase)
+    cursor.execute('SELECT * FROM Users WHERE Username = ? COLLATE NOCASE', (username,))
     user = cursor.fetchone()
 
     # Check if the user exists and the password is correct
     if user and user['Password'] == password.strip():
         user_type = user['UserType']
         session['username'] = username
+        session['user_type'] = user_type
         return True, user_type
     else:
-        return False
+        return False, None
 
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-# Load the TensorFlow model
-MODEL_PATH = 'models/my_model.h5'  
-model = tf.keras.models.load_model(MODEL_PATH)
+# CNN, imported and loaded on first inference (or warm-up). MODEL_BACKEND
+# picks the runtime: keras, tflite, onnx or numpy (see convert_model.py);
+# MODEL_VARIANT picks float32, float16 or int8 (tflite, see quantize_model.py).
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'keras')
+MODEL_VARIANT = os.environ.get('MODEL_VARIANT', 'float32')
+MODEL_PATH = os.environ.get('MODEL_PATH', default_model_path(MODEL_BACKEND, MODEL_VARIANT))
+MODEL_VERSION = None
+
+# With MODEL_REGISTRY=<dir> (see model_registry.py) the registry's active
+# version is served instead, and a new activation is picked up and
+# hot-swapped by every worker within MODEL_REGISTRY_POLL seconds
+app.config.setdefault('MODEL_REGISTRY', os.environ.get('MODEL_REGISTRY'))
+app.config.setdefault('MODEL_REGISTRY_POLL', float(os.environ.get('MODEL_REGISTRY_POLL', 5)))
+model_registry = ModelRegistry(app.config['MODEL_REGISTRY']) if app.config['MODEL_REGISTRY'] else None
+if model_registry is not None and model_registry.current():
+    MODEL_VERSION = model_registry.current()
+    MODEL_PATH, MODEL_BACKEND = model_registry.artefact(MODEL_VERSION)
+
+# Prediction cache keyed by pixel hash + model version. Set
+# PREDICTION_CACHE_DB to a file path to keep entries across restarts.
+app.config.setdefault('PREDICTION_CACHE_SIZE', 4096)
+app.config.setdefault('PREDICTION_CACHE_DB', None)
+prediction_cache = PredictionCache(max_entries=app.config['PREDICTION_CACHE_SIZE'],
+                                   db_path=app.config['PREDICTION_CACHE_DB'])
+
+# Probability calibration per model version (see calibration.py): the
+# registry version's calibration.json, else CALIBRATION_PATH if it was
+# fitted for the serving model. Results are Infected when the calibrated
+# infected probability is above PREDICT_THRESHOLD, set per deployment.
+app.config.setdefault('CALIBRATION_PATH', os.environ.get('CALIBRATION_PATH', 'models/calibration.json'))
+app.config.setdefault('PREDICT_THRESHOLD', float(os.environ.get('PREDICT_THRESHOLD', DEFAULT_THRESHOLD)))
+calibrations = Calibrations(app.config['CALIBRATION_PATH'], app.config['MODEL_REGISTRY'])
+
+def on_model_load(m):
+    # Every (re)load gets a new version, which drops the old model's cache
+    # entries, and calibration files are read again
+    prediction_cache.set_model_version(m.version)
+    calibrations.clear()
+
+model = LazyModel(MODEL_PATH, backend=MODEL_BACKEND, version=MODEL_VERSION, on_load=on_model_load)
+
+def on_pool_version(version):
+    # The pool switched to another model version (a rollout or rollback)
+    prediction_cache.set_model_version(version)
+    calibrations.clear()
+
+# INFERENCE_POOL_WORKERS=n runs the model in n inference server processes
+# (see inference_pool.py), one replica per core, instead of in this
+# process; the model is then never loaded here
+app.config.setdefault('INFERENCE_MAX_BATCH_SIZE', 32)
+app.config.setdefault('INFERENCE_MAX_WAIT_MS', 5)
+app.config.setdefault('SLIDE_CHUNK_SIZE', 64)
+# Per upload: most cell images (ZIP members) and largest image, see slide_scan.py
+app.config.setdefault('SLIDE_MAX_CELLS', DEFAULT_MAX_CELLS)
+app.config.setdefault('SLIDE_MAX_CELL_BYTES', DEFAULT_MAX_CELL_BYTES)
+app.config.setdefault('INFERENCE_POOL_WORKERS', int(os.environ.get('INFERENCE_POOL_WORKERS', 0)))
+# Only the serving process runs the pool and the warm-up, never a
+# multiprocessing child that happens to import this module
+SERVING_PROCESS = multiprocessing.parent_process() is None
+inference_pool = None
+if app.config['INFERENCE_POOL_WORKERS'] and SERVING_PROCESS:
+    inference_pool = InferencePool(MODEL_PATH, backend=MODEL_BACKEND, version=MODEL_VERSION,
+                                   workers=app.config['INFERENCE_POOL_WORKERS'],
+                                   registry_root=app.config['MODEL_REGISTRY'],
+                                   poll=app.config['MODEL_REGISTRY_POLL'],
+                                   capacity=max(app.config['INFERENCE_MAX_BATCH_SIZE'], app.config['SLIDE_CHUNK_SIZE']),
+                                   on_version=on_pool_version)
+
+# Shared micro-batching engine used by every prediction route
+engine = InferenceEngine(inference_pool.predict_versioned if inference_pool else model.predict_versioned,
+                         max_batch_size=app.config['INFERENCE_MAX_BATCH_SIZE'],
+                         max_wait_ms=app.config['INFERENCE_MAX_WAIT_MS'],
+                         cache=prediction_cache,
+                         versioned=True,
+                         concurrency=app.config['INFERENCE_POOL_WORKERS'] or 1)
+metrics.REGISTRY.add_collector(metrics.engine_collector(engine))
+
+# Test-time augmentation: PREDICT_TTA=n scores the first n flips / rotations
+# of every cell (up to 8, see tta.py) in one forward pass and reports their
+# mean and variance. 0 = off; a request's tta field overrides it.
+app.config.setdefault('PREDICT_TTA', int(os.environ.get('PREDICT_TTA', 0)))
+
+# Async predictions: with PREDICT_ASYNC=1 (or an async=on field) uploads
+# are queued in PREDICTION_QUEUE_DB and scored by prediction_worker.py's
+# process pool; the page follows the job over server-sent events and API
+# clients poll /predictions/jobs/<id>
+app.config.setdefault('PREDICT_ASYNC', os.environ.get('PREDICT_ASYNC') == '1')
+app.config.setdefault('PREDICTION_QUEUE_DB', os.environ.get('PREDICTION_QUEUE_DB', 'prediction_jobs.db'))
+app.config.setdefault('PREDICTION_EVENTS_TIMEOUT', 300)
+prediction_jobs = JobQueue(app.config['PREDICTION_QUEUE_DB'])
+
+registry_watcher = None
+if model_registry is not None and inference_pool is None and SERVING_PROCESS:
+    registry_watcher = RegistryWatcher(model_registry, model, interval=app.config['MODEL_REGISTRY_POLL']).start()
+
+def reload_model():
+    # Reload the current artefact in place (load + warm up, then swap)
+    if inference_pool is not None:
+        inference_pool.reload()
+    else:
+        model.reload()
+
+def warm_up_model():
+    # Explicit warm-up hook, e.g. from a gunicorn post_fork hook
+    if inference_pool is not None:
+        inference_pool.start()
+    else:
+        model.warm_up()
+
+# MODEL_WARMUP=1 loads the model in the background right after startup
+if os.environ.get('MODEL_WARMUP') == '1' and SERVING_PROCESS:
+    threading.Thread(target=warm_up_model, name='model-warmup', daemon=True).start()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -69,24 +245,17 @@ def predict():
         return jsonify({'error': 'No selected file'})
 
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-
-        # Preprocess the image for the model
-        img = Image.open(filepath)
-        img = img.resize((50, 50))  
-        img_array = np.array(img) / 255.0
-        img_array = np.expand_dims(img_array, axis=0)
+        if requested_async():
+            return enqueue_prediction(file, 'addpatient.html')
 
-        # Make predictions
-        predictions = model.predict(img_array)
-        result = 'Infected' if predictions[0][0] > 0.5 else 'Uninfected'
+        # Decode and preprocess the image in memory
+        img_array = preprocess_upload(file)
 
-        # Remove the uploaded file
-        os.remove(filepath)
+        # Make predictions through the shared batching engine and keep the scores
+        prediction = score_cell(img_array)
+        record_prediction(prediction)
 
-        return render_template('addpatient.html', result=result)
+        return prediction_response('addpatient.html', prediction)
 
     return jsonify({'error': 'Invalid file format'})
 
@@ -101,27 +270,240 @@ def predictnew():
         return jsonify({'error': 'No selected file'})
 
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-
-        # Preprocess the image for the model
-        img = Image.open(filepath)
-        img = img.resize((50, 50))  
-        img_array = np.array(img) / 255.0
-        img_array = np.expand_dims(img_array, axis=0)
+        if requested_async():
+            return enqueue_prediction(file, 'addpatient1.html')
 
-        # Make predictions
-        predictions = model.predict(img_array)
-        result = 'Infected' if predictions[0][0] > 0.5 else 'Uninfected'
+        # Decode and preprocess the image in memory
+        img_array = preprocess_upload(file)
 
-        # Remove the uploaded file
-        os.remove(filepath)
+        # Make predictions through the shared batching engine and keep the scores
+        prediction = score_cell(img_array)
+        record_prediction(prediction)
 
-        return render_template('addpatient1.html', result=result)
+        return prediction_response('addpatient1.html', prediction)
 
     return jsonify({'error': 'Invalid file format'})
 
+def requested_tta():
+    # TTA variants for this request: the tta form / query field (on, off or
+    # a number of variants), else PREDICT_TTA
+    value = request.values.get('tta')
+    if value is None:
+        return app.config['PREDICT_TTA']
+    value = value.strip().lower()
+    if value in ('', '0', 'off', 'false', 'no'):
+        return 0
+    if value in ('1', 'on', 'true', 'yes'):
+        return DEFAULT_TTA_VARIANTS
+    try:
+        return check_variants(int(value))
+    except ValueError:
+        abort(400)
+
+def score_cell(img_array):
+    # Raw per-class probabilities, calibrated infected score and result for
+    # one cell. With TTA every variant of the cell is scored in a single
+    # forward pass and the mean probabilities are calibrated.
+    variants = requested_tta()
+    tta = None
+    with metrics.stage('predict'):
+        if variants:
+            mean, variance, versions = predict_tta(engine.predict_batch_versioned, img_array, variants)
+            probabilities, model_version = mean[0], versions[0]
+            tta = tta_summary(mean[0], variance[0], variants)
+        else:
+            probabilities, model_version = engine.predict_versioned(img_array)
+    return prediction_result(probabilities, model_version, calibrations.get(model_version),
+                             app.config['PREDICT_THRESHOLD'], tta)
+
+def record_prediction(prediction):
+    # Store the scores without waiting for the commit (prediction_log.py).
+    # The id goes into the patient form, so saving the result links the two.
+    prediction['prediction_id'] = new_prediction_id()
+    metrics.PREDICTIONS.inc(request.endpoint, prediction['result'])
+    submit_write(INSERT_SQL, prediction_row(prediction['prediction_id'], request.endpoint, prediction))
+
+def attach_prediction(insurance, prediction_id):
+    # Only a queued prediction may still be missing its row; any other id
+    # is a plain UPDATE, so an unknown id from the form inserts nothing
+    job = prediction_jobs.get(prediction_id)
+    sql = ATTACH_PENDING_SQL if job is not None and job['kind'] == JOB_KIND else ATTACH_SQL
+    execute_write(sql, (insurance, prediction_id))
+
+def prediction_response(template_name, prediction):
+    # JSON for API clients, otherwise the form page pre-filled with the result
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(prediction)
+    return render_template(template_name, result=prediction['result'], model_version=prediction['model_version'],
+                           tta=prediction['tta'], prediction=prediction)
+
+def requested_async():
+    value = request.values.get('async')
+    if value is None:
+        return app.config['PREDICT_ASYNC']
+    return value.strip().lower() in ('1', 'on', 'true', 'yes')
+
+def enqueue_prediction(file, template_name):
+    # Hand the raw upload to the worker pool. The job id doubles as the
+    # prediction id, so the patient form can be saved before it finishes.
+    job_id = new_prediction_id()
+    prediction_jobs.enqueue(JOB_KIND, {'route': request.endpoint, 'tta': requested_tta(), 'filename': file.filename},
+                            file.stream.read(), job_id=job_id)
+    metrics.PREDICTIONS.inc(request.endpoint, 'queued')
+    job = {'id': job_id, 'status': 'queued',
+           'status_url': url_for('prediction_job', job_id=job_id),
+           'events_url': url_for('prediction_job_events', job_id=job_id)}
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(job), 202
+    return render_template(template_name, result='', job=job)
+
+@app.route('/predictions/jobs')
+def prediction_jobs_stats():
+    # Queue depth per status and the age of the oldest queued upload
+    return jsonify(prediction_jobs.stats())
+
+@app.route('/predictions/jobs/<job_id>')
+def prediction_job(job_id):
+    job = prediction_jobs.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job)
+
+@app.route('/predictions/jobs/<job_id>/events')
+def prediction_job_events(job_id):
+    # Server-sent "status" events until the job is done or failed. Reads
+    # only the queue file, so no pooled DB connection is held meanwhile.
+    if prediction_jobs.get(job_id) is None:
+        abort(404)
+    timeout = app.config['PREDICTION_EVENTS_TIMEOUT']
+
+    def events():
+        deadline = time.time() + timeout
+        last = None
+        while time.time() < deadline:
+            job = prediction_jobs.get(job_id)
+            if job is None:
+                return
+            state = (job['status'], job.get('position'))
+            if state != last:
+                yield 'event: status\ndata: %s\n\n' % json.dumps(job)
+                last = state
+            if job['status'] in ('done', 'failed'):
+                return
+            time.sleep(0.25)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/predictions/roc')
+def predictions_roc():
+    # ROC curve and threshold sweep over the stored predictions with a known
+    # outcome, e.g. ?model_version=...&column=p_infected&thresholds=0.3,0.5,0.7
+    column = request.args.get('column', 'score')
+    if column not in SCORE_COLUMNS:
+        abort(400)
+    try:
+        thresholds = [float(t) for t in request.args.get('thresholds', '').split(',') if t.strip()]
+    except ValueError:
+        abort(400)
+    model_version = request.args.get('model_version')
+    conn = get_db()
+    return jsonify({'model_version': model_version, 'column': column,
+                    'threshold': app.config['PREDICT_THRESHOLD'],
+                    'roc': roc(conn, model_version, column),
+                    'sweep': sweep(conn, thresholds or [app.config['PREDICT_THRESHOLD']], model_version, column)})
+
+@app.route('/predictions/<prediction_id>/label', methods=['POST'])
+def label_prediction(prediction_id):
+    # Record the confirmed diagnosis for a stored prediction: label=1 / 0,
+    # or Infected / Uninfected
+    value = (request.values.get('label') or '').strip().lower()
+    labels = {'1': 1, 'infected': 1, '0': 0, 'uninfected': 0}
+    if value not in labels:
+        abort(400)
+    if not execute_write(LABEL_SQL, (labels[value], prediction_id)):
+        abort(404)
+    return jsonify({'prediction_id': prediction_id, 'label': labels[value]})
+
+@app.route('/model')
+def model_info():
+    # Active model version, any swap in progress and the registry contents
+    info = {'version': model.version, 'backend': model.backend, 'path': model.path,
+            'loaded': model.loaded, 'swapping': model.swapping,
+            'threshold': app.config['PREDICT_THRESHOLD']}
+    if model.loaded:
+        info['calibration'] = calibrations.get(model.version).to_dict()
+        info['calibration_error'] = calibrations.errors.get(model.version)
+    if inference_pool is not None:
+        # The pool's workers serve (and hot-swap) the model, not this process
+        versions = [w['version'] for w in inference_pool.stats()['workers']]
+        info.update(version=versions[0] if len(set(versions)) == 1 else None,
+                    loaded=bool(versions) and None not in versions, pool_versions=versions)
+        if info['version'] is not None:
+            info['calibration'] = calibrations.get(info['version']).to_dict()
+            info['calibration_error'] = calibrations.errors.get(info['version'])
+    if model_registry is not None:
+        info['registry'] = {'root': model_registry.root, 'current': model_registry.current(),
+                            'versions': model_registry.versions(),
+                            'last_error': registry_watcher.last_error if registry_watcher else None}
+    return jsonify(info)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return metrics.metrics_response()
+
+@app.route('/inference/stats')
+def inference_stats():
+    # Batch-size and queue-wait histograms for tuning the engine settings
+    stats = engine.stats()
+    if inference_pool is not None:
+        stats['pool'] = inference_pool.stats()
+    return jsonify(stats)
+
+def require_admin():
+    # Admin-only pages: the UserType saved in the session at login
+    if session.get('user_type') != 'admin':
+        abort(403)
+
+@app.route('/admin/profiles', methods=['GET', 'POST'])
+def admin_profiles():
+    # Slowest captured requests, and the profiling switches for this process
+    require_admin()
+    if request.method == 'POST':
+        try:
+            if request.form.get('sample_rate', '') != '':
+                rate = float(request.form['sample_rate'])
+                if not 0 <= rate <= 1:
+                    raise ValueError(rate)
+                profiler.sample_rate = rate
+            if request.form.get('next', '') != '':
+                profiler.profile_next(int(request.form['next']))
+        except ValueError:
+            abort(400)
+        flash('Profiling settings updated', 'success')
+        return redirect(url_for('admin_profiles'))
+    route = request.args.get('route') or None
+    captured = profiles.slowest(limit=request.args.get('limit', 50, type=int), route=route)
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'profiling': profiler.stats(), 'profiles': captured})
+    return render_template('profiles.html', profiles=captured, profiling=profiler.stats(), route=route)
+
+@app.route('/admin/profiles/<profile_id>')
+def admin_profile(profile_id):
+    # The stored profile: pstats / speedscope file, or ?format=text for the
+    # top of a pstats profile by cumulative time
+    require_admin()
+    meta = profiles.get(profile_id)
+    if meta is None:
+        abort(404)
+    path = profiles.path(meta)
+    if request.args.get('format') == 'text' and meta['profiler'] == 'cprofile':
+        sort = request.args.get('sort', 'cumulative')
+        if sort not in profiling.PSTATS_SORTS:
+            abort(400)
+        return Response(profiling.pstats_text(path, sort=sort), mimetype='text/plain')
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=meta['file'])
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -154,48 +536,28 @@ def login():
 
 @app.route('/dashboard')
 def dashboard(): 
-    # Connect to the SQLite database
-    conn = sqlite3.connect('malaria_management.db')
-    cursor = conn.cursor()
-    cursor1 = conn.cursor()
-    cursor2 = conn.cursor()
-    cursor3 = conn.cursor()
-
-    # Retrieve patient records from the database
-    cursor.execute("SELECT COUNT(*) FROM patients")
-    p_count = cursor.fetchone()[0]
+    # Counts come from the cached counter snapshot, not COUNT(*) scans
+    stats = dashboard_stats.get(get_db())
 
-    # Retrieve doctors records from the database
-    cursor1.execute("SELECT COUNT(*) FROM Doctors")
-    d_count = cursor1.fetchone()[0]
+    return render_template('dashboard.html',p_count=stats['patients'],d_count=stats['doctors'],
+                           l_count=stats['lab'],o_count=stats['office'],stats=stats)
 
-    cursor2.execute("SELECT COUNT(*) FROM lab")
-    l_count = cursor2.fetchone()[0]
-    
-    cursor3.execute("SELECT COUNT(*) FROM office")
-    o_count = cursor3.fetchone()[0]
-
-
-    # Close the database connection
-    conn.close()
-    return render_template('dashboard.html',p_count=p_count,d_count=d_count,l_count=l_count,o_count=o_count)
+@app.route('/dashboard/stats')
+def dashboard_stats_json():
+    # Same snapshot as the dashboards, including the per-day breakdown
+    return jsonify(dashboard_stats.get(get_db()))
 
 @app.route('/patient')
 def patient():
     # Logic to render the patient page goes here
     # Connect to the SQLite database
-    conn = sqlite3.connect('malaria_management.db')
-    cursor = conn.cursor()
+    conn = get_db()
 
-    # Retrieve patient records from the database
-    cursor.execute("SELECT * FROM patients")
-    patients = cursor.fetchall()
-
-    # Close the database connection
-    conn.close()
+    # Retrieve one page of patient records from the database
+    patients = page_from_request(conn, PATIENTS)
 
     # Render the HTML template and pass the patient records 
-    return render_template('patient.html',patients=patients)
+    return render_listing('patient.html', 'patients', patients, page=patients)
 
 @app.route('/addpatient', methods=['GET', 'POST'])
 def addpatient():
@@ -207,17 +569,12 @@ def addpatient():
         phone = request.form.get('phone')
         result = request.form.get('result')
         
-        # Get a database connection
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Execute the insert query
-        cursor.execute("INSERT INTO patients (fname, lname, insurance, phone, result) VALUES (?, ?, ?, ?, ?)",
-                       (fname, lname, insurance, phone, result))
-        
-        # Commit the transaction and close the connection
-        conn.commit()
-        conn.close()
+        # Execute the insert query through the write-behind queue
+        execute_write("INSERT INTO patients (fname, lname, insurance, phone, result) VALUES (?, ?, ?, ?, ?)",
+                      (fname, lname, insurance, phone, result))
+        # Link the stored prediction scores to the patient (see prediction_log.py)
+        if request.form.get('prediction_id'):
+            attach_prediction(insurance, request.form.get('prediction_id'))
 
         flash('Patient added successfully!', 'success') 
     
@@ -227,18 +584,14 @@ def addpatient():
 def doctor():
     # Logic to render the doctor page goes here
     # Connect to the SQLite database
-    conn = sqlite3.connect('malaria_management.db')
+    conn = get_db()
     cursor = conn.cursor()
 
-    # Retrieve patient records from the database
+    # Retrieve records from the database; the cursor is read lazily
     cursor.execute("SELECT * FROM Doctors")
-    doctors = cursor.fetchall()
 
-    # Close the database connection
-    conn.close()
-
-    # Render the HTML template and pass the patient records 
-    return render_template('doctor.html',doctors=doctors) 
+    # Render the HTML template, streaming rows straight from the cursor
+    return render_listing('doctor.html', 'doctors', cursor)
 
 @app.route('/adddoctor', methods=['GET', 'POST'])
 def adddoctor():
@@ -250,7 +603,7 @@ def adddoctor():
         phone = request.form.get('phone') 
         
         # Get a database connection
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
 
         # Execute the insert query
@@ -261,9 +614,8 @@ def adddoctor():
         cursor.execute("INSERT INTO Users (Username, Password, UserType) VALUES (?, ?, ?)",
                        (fname, "abc@123", "doctor"))
         
-        # Commit the transaction and close the connection
+        # Commit the transaction
         conn.commit()
-        conn.close()
 
         flash('Doctor added successfully!', 'success') 
     
@@ -272,16 +624,13 @@ def adddoctor():
 @app.route('/delete/<int:patient_id>', methods=['POST', 'GET'])
 def delete_patient(patient_id):
     # Get a database connection
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
     # Execute the SQL delete statement with parameterized query
     cursor.execute("DELETE FROM patients WHERE patientid = ?", (patient_id,))
     conn.commit()
 
-    # Close the database connection
-    conn.close()
-
     # Flash a success message
     flash('Patient deleted successfully!', 'success')
 
@@ -291,16 +640,13 @@ def delete_patient(patient_id):
 @app.route('/deletedoctor/<int:doctors_id>', methods=['POST'])
 def delete_doctor(doctors_id):
     # Get a database connection
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
     # Execute the SQL delete statement with parameterized query
     cursor.execute("DELETE FROM Doctors WHERE DoctorID = ?", (doctors_id,))
     conn.commit()
 
-    # Close the database connection
-    conn.close()
-
     # Flash a success message
     flash('Doctor deleted successfully!', 'success')
 
@@ -309,38 +655,24 @@ def delete_doctor(doctors_id):
     
 @app.route('/dashboard1')
 def dashboard1():
-    # Connect to the SQLite database
-    conn = sqlite3.connect('malaria_management.db')
-    cursor = conn.cursor() 
-
-    # Retrieve patient records from the database
-    cursor.execute("SELECT COUNT(*) FROM patients")
-    p1_count = cursor.fetchone()[0]
+    # Patient count from the cached counter snapshot
+    stats = dashboard_stats.get(get_db())
 
-    # Close the database connection
-    conn.close()
-    return render_template('dashboard1.html',p1_count=p1_count)
+    return render_template('dashboard1.html',p1_count=stats['patients'],stats=stats)
 
 @app.route('/patient1')
 def patient1():
     # Logic to render the patient page goes here
     # Connect to the SQLite database
-    conn = sqlite3.connect('malaria_management.db')
-    cursor = conn.cursor()
+    conn = get_db()
 
-    # Retrieve patient records from the database
-    cursor.execute("""
-                   SELECT * FROM patients
-                   RIGHT JOIN reco ON patients.insurance = reco.insurance
-                   """)
-    
-    patients1 = cursor.fetchall()
-
-    # Close the database connection
-    conn.close()
+    # Retrieve one page of patients with their recommendations. Same rows and
+    # columns as patients RIGHT JOIN reco, but driven from reco so each row
+    # is an index lookup on patients.insurance
+    patients1 = page_from_request(conn, RECOMMENDATIONS)
 
     # Render the HTML template and pass the patient records 
-    return render_template('patient1.html',patients1=patients1)
+    return render_listing('patient1.html', 'patients1', patients1, page=patients1)
 
 @app.route('/addpatientnew', methods=['GET', 'POST'])
 def addpatientnew():
@@ -349,17 +681,9 @@ def addpatientnew():
         insurance1 = request.form.get('insurance')
         reco = request.form.get('reco') 
         
-        # Get a database connection
-        conn1 = get_db_connection()
-        cursor1 = conn1.cursor()
-
-        # Execute the insert query
-        cursor1.execute("INSERT INTO reco (insurance, reco) VALUES (?, ?)",
-                       (insurance1, reco))
-        
-        # Commit the transaction and close the connection
-        conn1.commit()
-        conn1.close()
+        # Execute the insert query through the write-behind queue
+        execute_write("INSERT INTO reco (insurance, reco) VALUES (?, ?)",
+                      (insurance1, reco))
 
         flash('Patient added successfully!', 'success') 
     
@@ -368,23 +692,20 @@ def addpatientnew():
 @app.route('/deletenew/<int:patient1_id>', methods=['POST', 'GET'])
 def delete_patientnew(patient1_id):
     # Get a database connection
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
     # Execute the SQL delete statement with parameterized query
     cursor.execute("DELETE FROM patients WHERE patientid = ?", (patient1_id,))
     conn.commit()
 
-    # Close the database connection
-    conn.close()
-
     # Redirect to the patient page
     return redirect(url_for('patient1'))
 
 @app.route('/profile/<int:doctors_id>', methods=['POST'])
 def profile(doctors_id):
     # Logic to render the profile page goes here 
-    conn = sqlite3.connect('malaria_management.db')
+    conn = get_db()
     cursor = conn.cursor()
  
 
@@ -392,145 +713,119 @@ def profile(doctors_id):
     cursor.execute("SELECT * FROM Doctors WHERE fname = ?", (doctors_id,)) 
     doc = cursor.fetchall()
 
-    # Close the database connection
-    conn.close()
     return render_template('profile.html',doc = doc)
 
 @app.route('/print/<int:patient_id>', methods=['POST'])
 def print_patient(patient_id):
     # Connect to the SQLite database
-    conn = sqlite3.connect('malaria_management.db')
+    conn = get_db()
     cursor = conn.cursor()
 
     # Retrieve patient records from the database
     cursor.execute("SELECT * FROM patients WHERE patientid = ?", (patient_id,))
-    patient_tuple = cursor.fetchone()  # Fetch as a tuple
-    patient = dict(zip([c[0] for c in cursor.description], patient_tuple))  # Convert tuple to dictionary
+    patient = cursor.fetchone()
 
-    # Close the database connection
-    conn.close()
-
-    if patient:
-        # Generate PDF
-        pdf_path = generate_patient_pdf(patient)
-
-        # Send the PDF to the printer
-        send_to_printer(pdf_path)
-
-        flash('Patient details printed successfully!', 'success')
-    else:
-        flash('Patient not found!', 'error')
+    # Render and print in the background
+    queue_patient_report(patient)
 
     return redirect(url_for('patient'))
 
 @app.route('/printnew/<int:patient1_id>', methods=['POST'])
 def print_patient1(patient1_id):
     # Connect to the SQLite database
-    conn = sqlite3.connect('malaria_management.db')
+    conn = get_db()
     cursor = conn.cursor()
 
     # Retrieve patient records from the database
-    cursor.execute("""SELECT * FROM patients
-                   RIGHT JOIN reco ON patients.insurance = reco.insurance 
+    # WHERE patientid = ? already drops reco-only rows, so an inner join
+    # returns the same row via the primary key and idx_reco_insurance
+    cursor.execute("""SELECT patients.*, reco.* FROM patients
+                   JOIN reco ON patients.insurance = reco.insurance
                    WHERE patientid = ?""", (patient1_id,))
-    patient_tuple = cursor.fetchone()  # Fetch as a tuple
-    patientdoc = dict(zip([c[0] for c in cursor.description], patient_tuple))
-
-    # Close the database connection
-    conn.close()
+    patientdoc = cursor.fetchone()
 
-    if patientdoc:
-        # Generate PDF
-        pdf_path = generate_patient_pdfdoc(patientdoc)
-
-        # Send the PDF to the printer
-        send_to_printer(pdf_path)
-
-        flash('Patient details printed successfully!', 'success')
-    else:
-        flash('Patient not found!', 'error')
+    # Render (with the recommendation) and print in the background
+    queue_patient_report(patientdoc)
 
     return redirect(url_for('patient1'))
 
 @app.route('/printnew1/<int:patient1_id>', methods=['POST'])
 def print_patient2(patient1_id):
     # Connect to the SQLite database
-    conn = sqlite3.connect('malaria_management.db')
+    conn = get_db()
     cursor = conn.cursor()
 
     # Retrieve patient records from the database
     cursor.execute("SELECT * FROM patients WHERE patientid = ?", (patient1_id,))
-    patient_tuple = cursor.fetchone()  # Fetch as a tuple
-    patient = dict(zip([c[0] for c in cursor.description], patient_tuple))  # Convert tuple to dictionary
+    patient = cursor.fetchone()
 
-    # Close the database connection
-    conn.close()
-
-    if patient:
-        # Generate PDF
-        pdf_path = generate_patient_pdf(patient)
-
-        # Send the PDF to the printer
-        send_to_printer(pdf_path)
-
-        flash('Patient details printed successfully!', 'success')
-    else:
-        flash('Patient not found!', 'error')
+    # Render and print in the background
+    queue_patient_report(patient)
 
     return redirect(url_for('patient2'))
 
-def generate_patient_pdf(patient):
-    pdf_path = f"patient_{patient['patientid']}.pdf"
-    c = canvas.Canvas(pdf_path, pagesize=letter)
-    c.drawString(100, 750, f"Patient ID: {patient['patientid']}")
-    c.drawString(100, 730, f"First Name: {patient['fname']}")
-    c.drawString(100, 710, f"Last Name: {patient['lname']}")
-    c.drawString(100, 690, f"Insurance: {patient['insurance']}")
-    c.drawString(100, 670, f"Contact Number: {patient['phone']}")
-    c.drawString(100, 650, f"Result: {patient['Result']}")
-    c.save()
-    return pdf_path
-
-def generate_patient_pdfdoc(patientdoc):
-    pdf_path = f"patient_{patientdoc['patientid']}.pdf"
-    c = canvas.Canvas(pdf_path, pagesize=letter)
-    c.drawString(100, 750, f"Patient ID: {patientdoc['patientid']}")
-    c.drawString(100, 730, f"First Name: {patientdoc['fname']}")
-    c.drawString(100, 710, f"Last Name: {patientdoc['lname']}")
-    c.drawString(100, 690, f"Insurance: {patientdoc['insurance']}")
-    c.drawString(100, 670, f"Contact Number: {patientdoc['phone']}")
-    c.drawString(100, 650, f"Result: {patientdoc['Result']}")
-    c.drawString(100, 630, f"Recommendation: {patientdoc['reco']}")
-    c.save()
-    return pdf_path
-
-def send_to_printer(pdf_path):
-    # Code to send the PDF to the printer goes here
+def queue_patient_report(patient):
+    # Queue a report job for a patient row (None if the lookup missed)
+    if patient is None:
+        flash('Patient not found!', 'error')
+        return None
     try:
-        # Use lpr command to print the document
-        subprocess.run(['lpr', pdf_path])
-        return True
-    except Exception as e:
-        print(f"Error printing document: {e}")
-        return False
-    pass
+        job = report_jobs.submit(dict(patient))
+    except ReportQueueFull:
+        flash('Too many reports are being printed, please try again shortly.', 'error')
+        return None
+    flash('Patient report sent to the printer (job %s).' % job.id, 'success')
+    return job
+
+@app.route('/reports/<job_id>')
+def report_status(job_id):
+    job = report_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown report job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/reports/<job_id>/pdf')
+def report_pdf(job_id):
+    job = report_jobs.get(job_id)
+    # The PDF is gone once a newer version of the patient's report was rendered
+    if job is None or job.status not in ('printing', 'done') or not os.path.exists(job.path):
+        abort(404)
+    return send_file(os.path.abspath(job.path), mimetype='application/pdf')
+
+@app.route('/export/patients.pdf')
+def export_patients_pdf():
+    # Bulk export: one multi-page PDF of every patient matching the filter,
+    # streamed page by page straight from the DB cursor.
+    # ?from=YYYY-MM-DD&to=YYYY-MM-DD&result=Infected&insurance=A,B
+    date_from = request.args.get('from', '').strip() or None
+    date_to = request.args.get('to', '').strip() or None
+    for value in (date_from, date_to):
+        if value is not None:
+            try:
+                date.fromisoformat(value)
+            except ValueError:
+                return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+    insurances = [i.strip() for value in request.args.getlist('insurance') for i in value.split(',') if i.strip()]
+
+    rows = export_patients(get_db(), date_from=date_from, date_to=date_to,
+                           result=request.args.get('result', '').strip() or None,
+                           insurances=insurances)
+    filename = 'patients_%s_%s.pdf' % (date_from or 'start', date_to or 'today')
+    return stream_response(iter_patients_pdf(rows), mimetype='application/pdf',
+                           headers={'Content-Disposition': 'attachment; filename=%s' % filename})
 
 @app.route('/office')
 def office():
     # Logic to render the doctor page goes here
     # Connect to the SQLite database
-    conn = sqlite3.connect('malaria_management.db')
+    conn = get_db()
     cursor = conn.cursor()
 
-    # Retrieve patient records from the database
+    # Retrieve records from the database; the cursor is read lazily
     cursor.execute("SELECT * FROM office")
-    office = cursor.fetchall()
-
-    # Close the database connection
-    conn.close()
 
-    # Render the HTML template and pass the patient records 
-    return render_template('office.html',office=office) 
+    # Render the HTML template, streaming rows straight from the cursor
+    return render_listing('office.html', 'office', cursor)
 
 @app.route('/addoffice', methods=['GET', 'POST'])
 def addoffice():
@@ -542,7 +837,7 @@ def addoffice():
         phone = request.form.get('phone') 
         
         # Get a database connection
-        conn = get_db_connection() 
+        conn = get_db() 
         cursor = conn.cursor()
         cursor1 = conn.cursor()
 
@@ -554,25 +849,21 @@ def addoffice():
         cursor1.execute("INSERT INTO Users (Username, Password, UserType) VALUES (?, ?, ?)",
                        (fname, "office@123", "office"))
         
-        # Commit the transaction and close the connection
+        # Commit the transaction
         conn.commit()
-        conn.close()
     
     return render_template('addoffice.html') 
 
 @app.route('/deleteoffice/<int:office_id>', methods=['POST'])
 def delete_office(office_id):
     # Get a database connection
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
     # Execute the SQL delete statement with parameterized query
     cursor.execute("DELETE FROM office WHERE UserID = ?", (office_id,))
     conn.commit()
 
-    # Close the database connection
-    conn.close()
-
     # Flash a success message
     flash('office deleted successfully!', 'success')
 
@@ -583,18 +874,14 @@ def delete_office(office_id):
 def lab():
     # Logic to render the doctor page goes here
     # Connect to the SQLite database
-    conn = sqlite3.connect('malaria_management.db')
+    conn = get_db()
     cursor = conn.cursor()
 
-    # Retrieve patient records from the database
+    # Retrieve records from the database; the cursor is read lazily
     cursor.execute("SELECT * FROM lab")
-    lab = cursor.fetchall()
 
-    # Close the database connection
-    conn.close()
-
-    # Render the HTML template and pass the patient records 
-    return render_template('lab.html',lab=lab) 
+    # Render the HTML template, streaming rows straight from the cursor
+    return render_listing('lab.html', 'lab', cursor)
 
 @app.route('/addlab', methods=['GET', 'POST'])
 def addlab():
@@ -606,7 +893,7 @@ def addlab():
         phone = request.form.get('phone') 
         
         # Get a database connection
-        conn = get_db_connection() 
+        conn = get_db() 
         cursor = conn.cursor()
         cursor1 = conn.cursor()
 
@@ -618,25 +905,21 @@ def addlab():
         cursor1.execute("INSERT INTO Users (Username, Password, UserType) VALUES (?, ?, ?)",
                        (fname, "lab@123", "lab"))
         
-        # Commit the transaction and close the connection
+        # Commit the transaction
         conn.commit()
-        conn.close()
     
     return render_template('addlab.html') 
 
 @app.route('/deletelab/<int:lab_id>', methods=['POST'])
 def delete_lab(lab_id):
     # Get a database connection
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
     # Execute the SQL delete statement with parameterized query
     cursor.execute("DELETE FROM lab WHERE UserID = ?", (lab_id,))
     conn.commit()
 
-    # Close the database connection
-    conn.close()
-
     # Flash a success message
     flash('lab deleted successfully!', 'success')
 
@@ -645,48 +928,33 @@ def delete_lab(lab_id):
 
 @app.route('/dashboard2')
 def dashboard2():
-    # Connect to the SQLite database
-    conn = sqlite3.connect('malaria_management.db')
-    cursor = conn.cursor() 
+    # Patient count from the cached counter snapshot
+    stats = dashboard_stats.get(get_db())
 
-    # Retrieve patient records from the database
-    cursor.execute("SELECT COUNT(*) FROM patients")
-    p1_count = cursor.fetchone()[0]
-
-    # Close the database connection
-    conn.close()
-    return render_template('dashboard2.html',p1_count=p1_count)
+    return render_template('dashboard2.html',p1_count=stats['patients'],stats=stats)
 
 @app.route('/patient2')
 def patient2():
     # Logic to render the patient page goes here
     # Connect to the SQLite database
-    conn = sqlite3.connect('malaria_management.db')
-    cursor = conn.cursor()
-
-    # Retrieve patient records from the database
-    cursor.execute("SELECT * FROM patients")
-    patients1 = cursor.fetchall()
+    conn = get_db()
 
-    # Close the database connection
-    conn.close()
+    # Retrieve one page of patient records from the database
+    patients1 = page_from_request(conn, PATIENTS)
 
     # Render the HTML template and pass the patient records 
-    return render_template('patient2.html',patients1=patients1)
+    return render_listing('patient2.html', 'patients1', patients1, page=patients1)
 
 @app.route('/deletenew1/<int:patient1_id>', methods=['POST', 'GET'])
 def delete_patientnew1(patient1_id):
     # Get a database connection
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
     # Execute the SQL delete statement with parameterized query
     cursor.execute("DELETE FROM patients WHERE patientid = ?", (patient1_id,))
     conn.commit()
 
-    # Close the database connection
-    conn.close()
-
     # Redirect to the patient page
     return redirect(url_for('patient2'))
 
@@ -700,17 +968,9 @@ def addpatientnew1():
         phone1 = request.form.get('phone')
         result1 = request.form.get('result')
         
-        # Get a database connection
-        conn1 = get_db_connection()
-        cursor1 = conn1.cursor()
-
-        # Execute the insert query
-        cursor1.execute("INSERT INTO patients (fname, lname, insurance, phone, result) VALUES (?, ?, ?, ?, ?)",
-                       (fname1, lname1, insurance1, phone1, 'No results'))
-        
-        # Commit the transaction and close the connection
-        conn1.commit()
-        conn1.close()
+        # Execute the insert query through the write-behind queue
+        execute_write("INSERT INTO patients (fname, lname, insurance, phone, result) VALUES (?, ?, ?, ?, ?)",
+                      (fname1, lname1, insurance1, phone1, 'No results'))
 
         flash('Patient added successfully!', 'success') 
     
@@ -718,34 +978,22 @@ def addpatientnew1():
 
 @app.route('/dashboard3')
 def dashboard3():
-    # Connect to the SQLite database
-    conn = sqlite3.connect('malaria_management.db')
-    cursor = conn.cursor() 
+    # Patient count from the cached counter snapshot
+    stats = dashboard_stats.get(get_db())
 
-    # Retrieve patient records from the database
-    cursor.execute("SELECT COUNT(*) FROM patients")
-    p1_count = cursor.fetchone()[0]
-
-    # Close the database connection
-    conn.close()
-    return render_template('dashboard3.html',p1_count=p1_count)
+    return render_template('dashboard3.html',p1_count=stats['patients'],stats=stats)
 
 @app.route('/patient3')
 def patient3():
     # Logic to render the patient page goes here
     # Connect to the SQLite database
-    conn = sqlite3.connect('malaria_management.db')
-    cursor = conn.cursor()
+    conn = get_db()
 
-    # Retrieve patient records from the database
-    cursor.execute("SELECT * FROM patients")
-    patients = cursor.fetchall()
-
-    # Close the database connection
-    conn.close()
+    # Retrieve one page of patient records from the database
+    patients = page_from_request(conn, PATIENTS)
 
     # Render the HTML template and pass the patient records 
-    return render_template('patient3.html',patients=patients)
+    return render_listing('patient3.html', 'patients', patients, page=patients)
 
 @app.route('/addpatient3', methods=['GET', 'POST'])
 def addpatient3():
@@ -754,16 +1002,11 @@ def addpatient3():
         insurance = request.form.get('insurance') 
         result = request.form.get('result')
 
-        # Get a database connection
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Execute the update query
-        cursor.execute("UPDATE patients SET Result = ? WHERE insurance = ?", (result, insurance))
-
-        # Commit the transaction and close the connection
-        conn.commit()
-        conn.close()
+        # Execute the update query through the write-behind queue
+        execute_write("UPDATE patients SET Result = ? WHERE insurance = ?", (result, insurance))
+        # Link the stored prediction scores to the patient (see prediction_log.py)
+        if request.form.get('prediction_id'):
+            attach_prediction(insurance, request.form.get('prediction_id'))
 
         flash('Patient added successfully!', 'success') 
     
@@ -780,67 +1023,80 @@ def predictnew3():
         return jsonify({'error': 'No selected file'})
 
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-
-        # Preprocess the image for the model
-        img = Image.open(filepath)
-        img = img.resize((50, 50))  
-        img_array = np.array(img) / 255.0
-        img_array = np.expand_dims(img_array, axis=0)
+        if requested_async():
+            return enqueue_prediction(file, 'addpatient3.html')
 
-        # Make predictions
-        predictions = model.predict(img_array)
-        result = 'Infected' if predictions[0][0] > 0.5 else 'Uninfected'
+        # Decode and preprocess the image in memory
+        img_array = preprocess_upload(file)
 
-        # Remove the uploaded file
-        os.remove(filepath)
+        # Make predictions through the shared batching engine and keep the scores
+        prediction = score_cell(img_array)
+        record_prediction(prediction)
 
-        return render_template('addpatient3.html', result=result)
+        return prediction_response('addpatient3.html', prediction)
 
     return jsonify({'error': 'Invalid file format'})
 
+@app.route('/predictslide', methods=['POST'])
+def predictslide():
+    # Score a whole slide: several cell images and/or ZIP archives of crops
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({'error': 'No file part'})
+
+    cells = iter_uploaded_cells(files, max_cells=app.config['SLIDE_MAX_CELLS'],
+                                max_cell_bytes=app.config['SLIDE_MAX_CELL_BYTES'])
+    try:
+        results, summary = scan_slide(cells, engine.predict_batch_versioned,
+                                      chunk_size=app.config['SLIDE_CHUNK_SIZE'], versioned=True,
+                                      tta=requested_tta(), threshold=app.config['PREDICT_THRESHOLD'],
+                                      calibrate=calibrations.infected)
+    except SlideTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    if not summary['cells']:
+        return jsonify({'error': 'No readable cell images', 'cells': results})
+    metrics.PREDICTIONS.inc(request.endpoint, 'Infected', amount=summary['infected'])
+    metrics.PREDICTIONS.inc(request.endpoint, 'Uninfected', amount=summary['uninfected'])
+
+    # Store the per-slide summary against the patient in a single transaction
+    insurance = request.form.get('insurance')
+    if insurance:
+        execute_write("UPDATE patients SET Result = ? WHERE insurance = ?",
+                      (summary_text(summary), insurance))
+        dashboard_stats.invalidate()
+        flash('Slide results saved!', 'success')
+
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'summary': summary, 'cells': results})
+
+    return render_template('addpatient3.html', result=summary_text(summary), slide=summary, cells=results,
+                           model_version=summary['model_version'])
+
 @app.route('/deletenew3/<int:patient1_id>', methods=['POST', 'GET'])
 def delete_patientnew3(patient1_id):
     # Get a database connection
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
     # Execute the SQL delete statement with parameterized query
     cursor.execute("DELETE FROM patients WHERE patientid = ?", (patient1_id,))
     conn.commit()
 
-    # Close the database connection
-    conn.close()
-
     # Redirect to the patient page
     return redirect(url_for('patient3'))
 
 @app.route('/printnew3/<int:patient1_id>', methods=['POST'])
 def print_patient3(patient1_id):
     # Connect to the SQLite database
-    conn = sqlite3.connect('malaria_management.db')
+    conn = get_db()
     cursor = conn.cursor()
 
     # Retrieve patient records from the database
     cursor.execute("SELECT * FROM patients WHERE patientid = ?", (patient1_id,))
-    patient_tuple = cursor.fetchone()  # Fetch as a tuple
-    patient = dict(zip([c[0] for c in cursor.description], patient_tuple))  # Convert tuple to dictionary
-
-    # Close the database connection
-    conn.close()
-
-    if patient:
-        # Generate PDF
-        pdf_path = generate_patient_pdf(patient)
+    patient = cursor.fetchone()
 
-        # Send the PDF to the printer
-        send_to_printer(pdf_path)
-
-        flash('Patient details printed successfully!', 'success')
-    else:
-        flash('Patient not found!', 'error')
+    # Render and print in the background
+    queue_patient_report(patient)
 
     return redirect(url_for('patient3'))
 
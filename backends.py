@@ -0,0 +1,177 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+# Default artefact for each backend, as written by convert_model.py
+DEFAULT_MODEL_PATHS = {
+    'keras': 'models/my_model.h5',
+    'tflite': 'models/my_model.tflite',
+    'onnx': 'models/my_model.onnx',
+    'numpy': 'models/my_model.npz',
+}
+
+# Quantized variants written by quantize_model.py (TFLite only)
+MODEL_VARIANTS = ('float32', 'float16', 'int8')
+
+
+def default_model_path(backend, variant='float32'):
+    # e.g. ('tflite', 'int8') -> models/my_model_int8.tflite
+    if variant not in MODEL_VARIANTS:
+        raise ValueError('Unknown model variant %r, expected one of %s' % (variant, ', '.join(MODEL_VARIANTS)))
+    path = DEFAULT_MODEL_PATHS[backend]
+    if variant == 'float32':
+        return path
+    if backend != 'tflite':
+        raise ValueError('The %s variant is only available for the tflite backend' % variant)
+    stem, ext = os.path.splitext(path)
+    return '%s_%s%s' % (stem, variant, ext)
+
+
+class KerasBackend:
+    name = 'keras'
+
+    def __init__(self, path):
+        import tensorflow as tf
+        self.model = tf.keras.models.load_model(path)
+
+    def predict(self, batch):
+        return self.model.predict(batch)
+
+
+class TFLiteBackend:
+    # Uses tflite-runtime when installed, otherwise TensorFlow's bundled interpreter
+    name = 'tflite'
+
+    def __init__(self, path):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=path)
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self._batch_size = None
+        self._lock = threading.Lock()
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=self.input['dtype'])
+        with self._lock:
+            # The exported graph has a fixed batch dimension; resize it on change
+            if batch.shape[0] != self._batch_size:
+                self.interpreter.resize_tensor_input(self.input['index'], batch.shape)
+                self.interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            self.interpreter.set_tensor(self.input['index'], batch)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.output['index']).copy()
+
+
+class OnnxBackend:
+    name = 'onnx'
+
+    def __init__(self, path):
+        import onnxruntime
+        self.session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+def _conv2d(x, kernel, bias, padding):
+    # NHWC convolution with stride 1 as a sum of kernel_h * kernel_w matmuls
+    kh, kw = kernel.shape[:2]
+    if padding == 'same':
+        # TensorFlow puts the odd padding pixel at the bottom/right
+        ph, pw = kh - 1, kw - 1
+        x = np.pad(x, ((0, 0), (ph // 2, ph - ph // 2), (pw // 2, pw - pw // 2), (0, 0)))
+    n, h, w, _ = x.shape
+    oh, ow = h - kh + 1, w - kw + 1
+    out = np.zeros((n, oh, ow, kernel.shape[3]), dtype=np.float32)
+    for i in range(kh):
+        for j in range(kw):
+            out += x[:, i:i + oh, j:j + ow, :] @ kernel[i, j]
+    return out + bias
+
+
+def _max_pool(x, pool, stride):
+    n, h, w, c = x.shape
+    ph, pw = pool
+    sh, sw = stride
+    if (ph, pw) == (sh, sw):
+        # Non-overlapping windows: crop and reshape instead of sliding
+        oh, ow = h // ph, w // pw
+        x = x[:, :oh * ph, :ow * pw, :].reshape(n, oh, ph, ow, pw, c)
+        return x.max(axis=(2, 4))
+    oh, ow = (h - ph) // sh + 1, (w - pw) // sw + 1
+    out = np.full((n, oh, ow, c), -np.inf, dtype=x.dtype)
+    for i in range(ph):
+        for j in range(pw):
+            out = np.maximum(out, x[:, i:i + sh * oh:sh, j:j + sw * ow:sw, :])
+    return out
+
+
+def _activation(x, name):
+    if name == 'relu':
+        return np.maximum(x, 0)
+    if name == 'softmax':
+        e = np.exp(x - x.max(axis=-1, keepdims=True))
+        return e / e.sum(axis=-1, keepdims=True)
+    if name == 'sigmoid':
+        return 1.0 / (1.0 + np.exp(-x))
+    if name == 'linear':
+        return x
+    raise ValueError('Unsupported activation: %s' % name)
+
+
+class NumpyBackend:
+    # Pure-NumPy reference implementation of the notebook's Sequential CNN
+    # (Conv2D / MaxPooling2D / Dropout / Flatten / Dense), reading the
+    # layer list and weights exported by convert_model.py.
+    name = 'numpy'
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            self.layers = json.loads(str(data['layers']))
+            self.weights = [[data['w%d_%d' % (i, j)].astype(np.float32)
+                             for j in range(layer['num_weights'])]
+                            for i, layer in enumerate(self.layers)]
+
+    def predict(self, batch):
+        x = np.asarray(batch, dtype=np.float32)
+        for layer, weights in zip(self.layers, self.weights):
+            kind = layer['class_name']
+            config = layer['config']
+            if kind == 'Conv2D':
+                if tuple(config['strides']) != (1, 1):
+                    raise ValueError('The NumPy backend only supports stride-1 convolutions')
+                x = _activation(_conv2d(x, weights[0], weights[1], config['padding']), config['activation'])
+            elif kind == 'MaxPooling2D':
+                x = _max_pool(x, config['pool_size'], config['strides'] or config['pool_size'])
+            elif kind == 'Flatten':
+                x = x.reshape(x.shape[0], -1)
+            elif kind == 'Dense':
+                x = _activation(x @ weights[0] + weights[1], config['activation'])
+            elif kind == 'Dropout':
+                continue
+            else:
+                raise ValueError('Unsupported layer for the NumPy backend: %s' % kind)
+        return x
+
+
+BACKENDS = {
+    'keras': KerasBackend,
+    'tflite': TFLiteBackend,
+    'onnx': OnnxBackend,
+    'numpy': NumpyBackend,
+}
+
+
+def load_backend(name, path=None):
+    if name not in BACKENDS:
+        raise ValueError('Unknown model backend %r, expected one of %s' % (name, ', '.join(sorted(BACKENDS))))
+    return BACKENDS[name](path or DEFAULT_MODEL_PATHS[name])
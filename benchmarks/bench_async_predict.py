@@ -0,0 +1,96 @@
+# Async predictions: how long the web request takes to enqueue an upload
+# vs scoring it inline, and how fast prediction_worker.py drains a backlog.
+#
+# Usage: python benchmarks/bench_async_predict.py [--jobs 400] [--workers 1 2]
+#
+# Uses a random-weight NumPy-backend model with the notebook's layer
+# shapes. Exits non-zero if any job is not done, or a queued result
+# differs from the inline prediction of the same image.
+import argparse
+import io
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+from bench_hot_swap import notebook_npz  # noqa: E402
+from calibration import Calibration, prediction_result  # noqa: E402
+from job_queue import JOB_KIND, JobQueue  # noqa: E402
+from migrations import migrate  # noqa: E402
+from model_loader import LazyModel  # noqa: E402
+from preprocess import preprocess_bytes  # noqa: E402
+
+
+def png(rng):
+    buf = io.BytesIO()
+    Image.fromarray((rng.random((120, 120, 3)) * 255).astype(np.uint8)).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=400)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2])
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    images = [png(rng) for _ in range(32)]
+    ok = True
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        model_path = notebook_npz(os.path.join(tmpdir, 'model.npz'), 1)
+        model = LazyModel(model_path, backend='numpy')
+        model.warm_up()
+        expected = []
+        start = time.perf_counter()
+        for data in images:
+            prediction, version = model.predict_versioned(preprocess_bytes(data)[np.newaxis])
+            expected.append(prediction_result(prediction[0], version, Calibration()))
+        inline_ms = (time.perf_counter() - start) * 1000.0 / len(images)
+
+        print('inline decode + predict per request: %.2f ms' % inline_ms)
+        for workers in args.workers:
+            db_path = os.path.join(tmpdir, 'app-%d.db' % workers)
+            conn = sqlite3.connect(db_path)
+            migrate(conn)
+            conn.close()
+            queue = JobQueue(os.path.join(tmpdir, 'queue-%d.db' % workers))
+            start = time.perf_counter()
+            ids = [queue.enqueue(JOB_KIND, {'route': 'predict'}, images[i % len(images)]) for i in range(args.jobs)]
+            enqueue_ms = (time.perf_counter() - start) * 1000.0 / args.jobs
+
+            env = dict(os.environ, MODEL_BACKEND='numpy', MODEL_PATH=model_path,
+                       CALIBRATION_PATH=os.path.join(tmpdir, 'none.json'))
+            start = time.perf_counter()
+            pool = subprocess.Popen([sys.executable, os.path.join(ROOT, 'prediction_worker.py'),
+                                     '--workers', str(workers), '--queue', queue.path, '--db', db_path],
+                                    env=env, stdout=subprocess.DEVNULL)
+            try:
+                while queue.stats()['done'] + queue.stats()['failed'] < args.jobs:
+                    time.sleep(0.02)
+                seconds = time.perf_counter() - start
+            finally:
+                pool.terminate()
+                pool.wait()
+            for i, job_id in enumerate(ids):
+                job = queue.get(job_id)
+                want = expected[i % len(images)]
+                ok = ok and job['status'] == 'done' and abs(job['result']['score'] - want['score']) < 1e-6
+            print('%d worker(s): enqueue %.2f ms per request, %d jobs drained in %.2fs (%.0f jobs/s, incl. startup)' % (
+                workers, enqueue_ms, args.jobs, seconds, args.jobs / seconds))
+
+    print('results match inline predictions: %s' % ('yes' if ok else 'NO'))
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
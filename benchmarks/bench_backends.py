@@ -0,0 +1,81 @@
+# Numerical parity against Keras plus latency/throughput for each backend.
+#
+# Usage:
+#   python convert_model.py
+#   python benchmarks/bench_backends.py [--backends tflite onnx numpy] [--cells Cells.npy]
+#
+# The fixed image set is either the first --count cells of a uint8
+# Cells.npy (as built by the notebook) or, without one, seeded noise.
+# Exits non-zero if any backend disagrees with Keras beyond --atol.
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backends import DEFAULT_MODEL_PATHS, load_backend  # noqa: E402
+from preprocess import CELL_SHAPE  # noqa: E402
+
+
+def fixed_images(cells_path, count):
+    if cells_path:
+        cells = np.load(cells_path, mmap_mode='r')[:count]
+        return np.asarray(cells, dtype=np.float32) / 255.0
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, size=(count,) + CELL_SHAPE).astype(np.float32) / 255.0
+
+
+def time_batches(backend, images, batch_size, repeats):
+    backend.predict(images[:batch_size])  # warm-up / tensor allocation
+    start = time.perf_counter()
+    done = 0
+    for _ in range(repeats):
+        for i in range(0, len(images) - batch_size + 1, batch_size):
+            backend.predict(images[i:i + batch_size])
+            done += batch_size
+    return (time.perf_counter() - start) / done
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backends', nargs='+', default=['keras', 'tflite', 'onnx', 'numpy'])
+    parser.add_argument('--cells', help='uint8 Cells.npy to draw the fixed image set from')
+    parser.add_argument('--count', type=int, default=256)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--atol', type=float, default=1e-4)
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    images = fixed_images(args.cells, args.count)
+    reference = load_backend('keras').predict(images)
+
+    failed = False
+    print('%-7s %10s %8s %14s %14s' % ('backend', 'max |diff|', 'argmax', 'batch=1 ms/img', 'batch=32 img/s'))
+    for name in args.backends:
+        if not os.path.exists(DEFAULT_MODEL_PATHS[name]):
+            print('%-7s skipped, %s not found (run convert_model.py)' % (name, DEFAULT_MODEL_PATHS[name]))
+            continue
+        try:
+            backend = load_backend(name)
+        except ImportError as e:
+            print('%-7s skipped, %s' % (name, e))
+            continue
+
+        output = backend.predict(images)
+        diff = float(np.abs(output - reference).max())
+        agree = float(np.mean(output.argmax(axis=1) == reference.argmax(axis=1)))
+        single = time_batches(backend, images[:32], 1, args.repeats)
+        batched = time_batches(backend, images, 32, args.repeats)
+        print('%-7s %10.2e %7.1f%% %14.3f %14.0f' % (name, diff, agree * 100, single * 1000, 1.0 / batched))
+        if diff > args.atol:
+            failed = True
+
+    if failed:
+        print('parity check FAILED (atol=%g)' % args.atol)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# Dashboard counter latency: the old four COUNT(*) queries vs the
+# trigger-maintained counters (migration 4), with and without the TTL
+# snapshot, plus what the triggers add to a single-row insert.
+#
+# Usage: python benchmarks/bench_dashboard.py [--sizes 1000 100000 1000000]
+#
+# Exits non-zero if the counters disagree with COUNT(*) after a round of
+# inserts, result updates and deletes.
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+from bench_query_plans import build  # noqa: E402
+from migrations import migrate  # noqa: E402
+from stats import StatsCache, read_stats  # noqa: E402
+
+COUNT_QUERIES = ["SELECT COUNT(*) FROM patients", "SELECT COUNT(*) FROM Doctors",
+                 "SELECT COUNT(*) FROM lab", "SELECT COUNT(*) FROM office"]
+
+
+def best_ms(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000.0
+
+
+def insert_us(conn, n=2000):
+    start = time.perf_counter()
+    for i in range(n):
+        conn.execute("INSERT INTO patients (fname, lname, insurance, phone, Result) VALUES (?, ?, ?, ?, ?)",
+                     ('F', 'L', 'BENCH-%d' % i, '0', 'Infected'))
+    elapsed = time.perf_counter() - start
+    conn.rollback()
+    return elapsed / n * 1e6
+
+
+def check(conn):
+    conn.execute("INSERT INTO patients (fname, lname, insurance, phone, Result) VALUES ('F', 'L', 'CHK', '0', 'Infected')")
+    conn.execute("UPDATE patients SET Result = 'Uninfected (0/5 cells infected, 0.00% parasitaemia)' WHERE insurance = 'CHK'")
+    conn.execute("DELETE FROM patients WHERE patientid IN (SELECT patientid FROM patients LIMIT 10)")
+    conn.execute("INSERT INTO Doctors (fname, lname, insurance, phone) VALUES ('F', 'L', 'D', '0')")
+    stats = read_stats(conn)
+    expected = {
+        'patients': conn.execute(COUNT_QUERIES[0]).fetchone()[0],
+        'doctors': conn.execute(COUNT_QUERIES[1]).fetchone()[0],
+        'infected': conn.execute("SELECT COUNT(*) FROM patients WHERE Result LIKE 'Infected%'").fetchone()[0],
+        'uninfected': conn.execute("SELECT COUNT(*) FROM patients WHERE Result LIKE 'Uninfected%'").fetchone()[0],
+    }
+    conn.rollback()
+    return [name for name, n in expected.items() if stats[name] != n]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    failed = False
+    print('%9s %12s %12s %12s %12s %12s' % ('patients', 'COUNT(*) ms', 'counters ms', 'cached ms',
+                                            'insert us', '+triggers us'))
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = build(os.path.join(tmpdir, 'synthetic.db'), size, recos=100, users=10)
+            migrate(conn, target=3)
+            before = insert_us(conn)
+            migrate(conn)
+            after = insert_us(conn)
+            cache = StatsCache(ttl=60)
+            timings = [
+                best_ms(lambda: [conn.execute(sql).fetchone() for sql in COUNT_QUERIES], args.repeats),
+                best_ms(lambda: read_stats(conn), args.repeats),
+                best_ms(lambda: cache.get(conn), args.repeats),
+            ]
+            mismatched = check(conn)
+            conn.close()
+        print('%9d %12.3f %12.3f %12.4f %12.1f %12.1f' % ((size,) + tuple(timings) + (before, after)))
+        if mismatched:
+            print('  counters disagree with COUNT(*): %s' % ', '.join(mismatched))
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
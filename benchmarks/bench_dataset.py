@@ -0,0 +1,121 @@
+# Dataset build throughput: the notebook's per-image loop (lists, then
+# np.array) vs build_dataset.py on a process pool, plus an incremental
+# run after adding images and a resume after an interrupted build.
+#
+# Usage: python benchmarks/bench_dataset.py [--images 4000] [--workers 4]
+#
+# Generates synthetic PNG cells of varying size. Exits non-zero if the
+# built arrays differ from the notebook loop (on the same RGB path), if an
+# unreadable file is not skipped, or if a resumed / incremental build
+# gives different arrays from a clean one.
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from build_dataset import CLASSES, build  # noqa: E402
+
+
+def make_images(root, n, start=0, seed=0):
+    rng = np.random.default_rng(seed + start)
+    for i in range(start, start + n):
+        folder = CLASSES[i % 2][0]
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+        h, w = rng.integers(100, 160, size=2)
+        Image.fromarray(rng.integers(0, 256, size=(h, w, 3), dtype=np.uint8)).save(
+            os.path.join(root, folder, 'cell_%06d.png' % i))
+
+
+def notebook_loop(root):
+    # The notebook's loop, reading with PIL in RGB instead of cv2 in BGR
+    data, labels = [], []
+    for folder, label in CLASSES:
+        for name in sorted(os.listdir(os.path.join(root, folder))):
+            try:
+                image = Image.open(os.path.join(root, folder, name)).convert('RGB')
+                data.append(np.array(image.resize((50, 50))))
+                labels.append(label)
+            except OSError:
+                pass
+    return np.array(data), np.array(labels)
+
+
+class Interrupt(Exception):
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=4000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    quiet = lambda *a: None  # noqa: E731
+    failed = []
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = os.path.join(tmpdir, 'cell_images')
+        make_images(root, args.images)
+        with open(os.path.join(root, 'Parasitized', 'Thumbs.db'), 'wb') as f:
+            f.write(b'not an image')
+
+        start = time.perf_counter()
+        expected_cells, expected_labels = notebook_loop(root)
+        loop_s = time.perf_counter() - start
+
+        out = os.path.join(tmpdir, 'clean')
+        os.makedirs(out)
+        start = time.perf_counter()
+        build(root, os.path.join(out, 'Cells.npy'), os.path.join(out, 'labels.npy'), workers=args.workers, log=quiet)
+        build_s = time.perf_counter() - start
+        cells = np.load(os.path.join(out, 'Cells.npy'), mmap_mode='r')
+        labels = np.load(os.path.join(out, 'labels.npy'), mmap_mode='r')
+        if not (np.array_equal(cells, expected_cells) and np.array_equal(labels, expected_labels)):
+            failed.append('build differs from the notebook loop')
+
+        # Interrupted after the first commit, then resumed
+        resumed = os.path.join(tmpdir, 'resumed')
+        os.makedirs(resumed)
+        paths = (os.path.join(resumed, 'Cells.npy'), os.path.join(resumed, 'labels.npy'))
+
+        def interrupt(message):
+            if message.startswith('  '):
+                raise Interrupt()
+        try:
+            build(root, *paths, workers=args.workers, commit_every=500, log=interrupt)
+        except Interrupt:
+            pass
+        partial = np.load(paths[0], mmap_mode='r').shape[0]
+        build(root, *paths, workers=args.workers, log=quiet)
+        if not np.array_equal(np.load(paths[0]), expected_cells):
+            failed.append('resumed build differs')
+
+        # Incremental: 10% more images, only those are decoded
+        extra = max(1, args.images // 10)
+        make_images(root, extra, start=args.images)
+        start = time.perf_counter()
+        build(root, os.path.join(out, 'Cells.npy'), os.path.join(out, 'labels.npy'), workers=args.workers, log=quiet)
+        incremental_s = time.perf_counter() - start
+        cells = np.load(os.path.join(out, 'Cells.npy'), mmap_mode='r')
+        if cells.shape[0] != args.images + extra or not np.array_equal(cells[:args.images], expected_cells):
+            failed.append('incremental build did not append the new images')
+        shutil.rmtree(root)
+
+    print('images: %d (+1 unreadable), workers: %d' % (args.images, args.workers))
+    print('notebook loop:       %7.2f s  %8.0f images/s' % (loop_s, args.images / loop_s))
+    print('build_dataset:       %7.2f s  %8.0f images/s' % (build_s, args.images / build_s))
+    print('resume:              interrupted at %d images, finished to %d' % (partial, args.images))
+    print('incremental (+%d):  %7.2f s' % (extra, incremental_s))
+    for message in failed:
+        print('FAILED: ' + message)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# Requests/sec for the database-backed listing pages under concurrent load.
+#
+# Usage: python benchmarks/bench_db.py [--threads 16] [--seconds 5] [--pool-size 8]
+#
+# Serves the app with werkzeug's threaded server and hammers /patient and
+# /dashboard from client threads, first with pooling disabled (a fresh
+# sqlite3 connection per request, as before database.py) and then with
+# the bounded pool. Run from the repository root.
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+import urllib.request
+
+from werkzeug.serving import make_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import app as malaria_app  # noqa: E402
+from database import ConnectionPool  # noqa: E402
+
+PATHS = ['/patient', '/dashboard']
+
+
+def hammer(base_url, path, threads, seconds):
+    counts = [0] * threads
+    stop = time.perf_counter() + seconds
+
+    def client(i):
+        while time.perf_counter() < stop:
+            with urllib.request.urlopen(base_url + path) as response:
+                response.read()
+            counts[i] += 1
+
+    workers = [threading.Thread(target=client, args=(i,)) for i in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return sum(counts) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--pool-size', type=int, default=8)
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    flask_app = malaria_app.app
+    server = make_server('127.0.0.1', 0, flask_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = 'http://127.0.0.1:%d' % server.server_port
+
+    for label, size in [('per-request connect', 0), ('pool of %d' % args.pool_size, args.pool_size)]:
+        flask_app.extensions['db_pool'] = ConnectionPool(flask_app.config['DATABASE'], max_size=size)
+        for path in PATHS:
+            rps = hammer(base_url, path, args.threads, args.seconds)
+            print('%-22s %-11s %8.1f req/s' % (label, path, rps))
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# Multi-threaded read/write contention on the patient database.
+#
+# Usage: python benchmarks/bench_db_contention.py [--writers 8] [--readers 8] [--seconds 5]
+#
+# Works on a throwaway copy of malaria_management.db. Writer threads mimic
+# addpatientnew1 / addpatient3 (INSERT a patient, UPDATE a Result) while
+# reader threads run the listing/dashboard queries. Three setups:
+#   rollback  - default rollback journal, commit per statement (old app)
+#   wal       - WAL + tuned pragmas, commit per statement
+#   wal+queue - WAL + pragmas, writes coalesced by WriteBehindQueue
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import DEFAULT_PRAGMAS, WriteBehindQueue, connect  # noqa: E402
+
+SOURCE_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'malaria_management.db')
+ROLLBACK_PRAGMAS = {'journal_mode': 'DELETE'}
+
+
+def run(setup, writers, readers, seconds, synchronous):
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'bench.db')
+    shutil.copy(SOURCE_DB, path)
+    pragmas = dict(ROLLBACK_PRAGMAS if setup == 'rollback' else DEFAULT_PRAGMAS)
+    if synchronous:
+        pragmas['synchronous'] = synchronous
+    connect(path, pragmas).close()
+    queue = WriteBehindQueue(path, pragmas=pragmas) if setup == 'wal+queue' else None
+
+    writes = [0] * writers
+    reads = [0] * readers
+    locked = [0]
+    stop = time.perf_counter() + seconds
+
+    def writer(i):
+        conn = None if queue else connect(path, pragmas)
+        n = 0
+        while time.perf_counter() < stop:
+            insurance = 'BENCH-%d-%d' % (i, n)
+            statements = [
+                ("INSERT INTO patients (fname, lname, insurance, phone, result) VALUES (?, ?, ?, ?, ?)",
+                 ('Bench', str(i), insurance, '000', 'No results')),
+                ("UPDATE patients SET Result = ? WHERE insurance = ?", ('Uninfected', insurance)),
+            ]
+            for sql, params in statements:
+                try:
+                    if queue:
+                        queue.execute(sql, params)
+                    else:
+                        conn.execute(sql, params)
+                        conn.commit()
+                    writes[i] += 1
+                except sqlite3.OperationalError:
+                    locked[0] += 1
+                    if conn is not None and conn.in_transaction:
+                        conn.rollback()
+            n += 1
+
+    def reader(i):
+        conn = connect(path, pragmas)
+        while time.perf_counter() < stop:
+            try:
+                conn.execute("SELECT COUNT(*) FROM patients").fetchone()
+                conn.execute("SELECT * FROM patients ORDER BY patientid DESC LIMIT 50").fetchall()
+                reads[i] += 1
+            except sqlite3.OperationalError:
+                locked[0] += 1
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    commits = queue.transactions if queue else sum(writes)
+    shutil.rmtree(tmpdir, ignore_errors=True)
+    return sum(writes) / seconds, sum(reads) / seconds, locked[0], commits
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--synchronous', help='override PRAGMA synchronous, e.g. FULL')
+    args = parser.parse_args()
+
+    print('%-10s %12s %12s %8s %9s' % ('setup', 'writes/s', 'reads/s', 'locked', 'commits'))
+    for setup in ['rollback', 'wal', 'wal+queue']:
+        writes, reads, locked, commits = run(setup, args.writers, args.readers, args.seconds, args.synchronous)
+        print('%-10s %12.1f %12.1f %8d %9d' % (setup, writes, reads, locked, commits))
+
+
+if __name__ == '__main__':
+    main()
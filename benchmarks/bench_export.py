@@ -0,0 +1,110 @@
+# Bulk PDF export throughput (patients/sec) and peak RSS: the streaming
+# writer over a DB cursor vs one reportlab document holding every page vs
+# the old one-canvas-per-patient loop (as in POST /print/<id>, minus lpr).
+#
+# Usage: python benchmarks/bench_export.py [--patients 100000]
+#
+# Each mode runs in a fresh interpreter so peak RSS is not shared. The
+# streamed document is also checked for a consistent xref table; exits
+# non-zero if it is not.
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+from bench_query_plans import build  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+CHILD = r'''
+import json, os, resource, sqlite3, sys, tempfile, time
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+from reports import draw_patient, export_patients, iter_patients_pdf, render_patient_pdf
+
+mode, path, out = sys.argv[1], sys.argv[2], sys.argv[3]
+limit = int(sys.argv[4])
+conn = sqlite3.connect(path)
+conn.row_factory = sqlite3.Row
+rows = export_patients(conn, date_from='2024-01-01', date_to='2024-12-31')
+start = time.perf_counter()
+n = 0
+if mode == 'stream':
+    with open(out, 'wb') as f:
+        for chunk in iter_patients_pdf(rows):
+            f.write(chunk)
+    n = conn.execute("SELECT COUNT(*) FROM patient_dates WHERE result_date BETWEEN '2024-01-01' AND '2024-12-31'").fetchone()[0]
+elif mode == 'reportlab':
+    c = canvas.Canvas(out, pagesize=letter)
+    for row in rows:
+        draw_patient(c, row)
+        c.showPage()
+        n += 1
+    c.save()
+else:
+    tmpdir = tempfile.mkdtemp()
+    for row in rows:
+        render_patient_pdf(dict(row), os.path.join(tmpdir, 'patient_%d.pdf' % row['patientid']))
+        n += 1
+        if n >= limit:
+            break
+elapsed = time.perf_counter() - start
+print(json.dumps({'patients': n, 'seconds': elapsed, 'mb': os.path.getsize(out) / 1e6 if os.path.exists(out) else 0,
+                  'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0}))
+'''
+
+
+def check_xref(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    xref = int(data.rsplit(b'startxref\n', 1)[1].split()[0])
+    lines = data[xref:].split(b'\n')
+    count = int(lines[1].split()[1])
+    for number in range(1, count):
+        offset = int(lines[2 + number][:10])
+        if not data.startswith(b'%d 0 obj' % number, offset):
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--patients', type=int, default=100000)
+    parser.add_argument('--per-patient-limit', type=int, default=2000,
+                        help='patients rendered in the one-file-per-patient mode')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'synthetic.db')
+        conn = build(path, args.patients, recos=100, users=10)
+        migrate(conn)
+        rng = random.Random(0)
+        conn.executemany("INSERT OR REPLACE INTO patient_dates VALUES (?, ?, ?)",
+                         ((i, '2024-01-01', '2024-%02d-%02d' % (rng.randint(1, 12), rng.randint(1, 28)))
+                          for i in range(1, args.patients + 1)))
+        conn.commit()
+        conn.close()
+
+        failed = False
+        print('%-12s %9s %10s %12s %9s %10s' % ('mode', 'patients', 'seconds', 'patients/s', 'MB', 'peak RSS'))
+        for mode in ['stream', 'reportlab', 'per-patient']:
+            out = os.path.join(tmpdir, mode + '.pdf')
+            result = subprocess.run([sys.executable, '-c', CHILD, mode, path, out, str(args.per_patient_limit)],
+                                    cwd=ROOT, capture_output=True, text=True, check=True)
+            r = json.loads(result.stdout.strip().splitlines()[-1])
+            print('%-12s %9d %10.2f %12.0f %9.1f %7.1f MB' % (
+                mode, r['patients'], r['seconds'], r['patients'] / r['seconds'], r['mb'], r['peak_rss_mb']))
+            if mode == 'stream' and not check_xref(out):
+                print('  streamed PDF has an inconsistent xref table')
+                failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# Prediction latency while the serving model is hot-swapped through the
+# registry, with request threads running the whole time.
+#
+# Usage: python benchmarks/bench_hot_swap.py [--threads 8] [--seconds 6]
+#
+# Publishes two random-weight NumPy-backend models with the notebook's
+# layer shapes to a temporary registry, serves v1, activates v2 halfway
+# through and lets RegistryWatcher swap it in. Exits non-zero if any
+# prediction fails, is not tagged with v1 or v2, or is tagged v1 after
+# the swap completed.
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from inference import InferenceEngine  # noqa: E402
+from model_loader import LazyModel  # noqa: E402
+from model_registry import ModelRegistry, RegistryWatcher  # noqa: E402
+from preprocess import CELL_SHAPE  # noqa: E402
+
+
+def notebook_npz(path, seed):
+    # Same layer list as convert_model.export_numpy writes for the notebook CNN
+    rng = np.random.default_rng(seed)
+    conv = {'padding': 'same', 'activation': 'relu', 'strides': [1, 1], 'pool_size': None}
+    pool = {'padding': 'valid', 'activation': None, 'strides': [2, 2], 'pool_size': [2, 2]}
+    drop = {'padding': None, 'activation': None, 'strides': None, 'pool_size': None}
+    layers, arrays, channels = [], {}, 3
+    for _ in range(3):
+        layers += [('Conv2D', conv, [(2, 2, channels, 32), (32,)]), ('MaxPooling2D', pool, []), ('Dropout', drop, [])]
+        channels = 32
+    layers += [('Flatten', drop, []), ('Dense', dict(drop, activation='relu'), [(6 * 6 * 32, 512), (512,)]),
+               ('Dropout', drop, []), ('Dense', dict(drop, activation='softmax'), [(512, 2), (2,)])]
+    for i, (_, _, shapes) in enumerate(layers):
+        for j, shape in enumerate(shapes):
+            arrays['w%d_%d' % (i, j)] = (rng.standard_normal(shape) * 0.05).astype(np.float32)
+    meta = [{'class_name': name, 'config': config, 'num_weights': len(shapes)} for name, config, shapes in layers]
+    np.savez(path, layers=np.array(json.dumps(meta)), **arrays)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=6.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        registry = ModelRegistry(os.path.join(tmpdir, 'registry'))
+        v1 = registry.publish(notebook_npz(os.path.join(tmpdir, 'a.npz'), 1), 'numpy', activate=True)
+        time.sleep(1.1)  # versions are timestamped to the second
+        v2 = registry.publish(notebook_npz(os.path.join(tmpdir, 'b.npz'), 2), 'numpy')
+        path, backend = registry.artefact(v1)
+        model = LazyModel(path, backend=backend, version=v1)
+        model.warm_up()
+        engine = InferenceEngine(model.predict_versioned, max_batch_size=32, max_wait_ms=2, versioned=True)
+        watcher = RegistryWatcher(registry, model, interval=0.05).start()
+
+        samples = []  # (finished, latency ms, version)
+        errors = []
+        stop = threading.Event()
+        rng = np.random.default_rng(0)
+        cells = rng.random((64,) + CELL_SHAPE, dtype=np.float32)
+
+        def client(k):
+            i = k
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    _, version = engine.predict_versioned(cells[i % len(cells)], timeout=30)
+                except Exception as e:
+                    errors.append(repr(e))
+                    continue
+                end = time.perf_counter()
+                samples.append((end, (end - start) * 1000.0, version))
+                i += args.threads
+
+        threads = [threading.Thread(target=client, args=(k,)) for k in range(args.threads)]
+        begin = time.perf_counter()
+        for t in threads:
+            t.start()
+        time.sleep(args.seconds / 2)
+        activated = time.perf_counter()
+        registry.activate(v2)
+        while model.version != v2:
+            time.sleep(0.001)
+        swapped = time.perf_counter()
+        time.sleep(args.seconds / 2)
+        stop.set()
+        for t in threads:
+            t.join()
+        watcher.stop()
+
+    def summary(rows):
+        latencies = np.array([r[1] for r in rows]) if rows else np.zeros(1)
+        return '%6d req  p50 %6.2f ms  p99 %7.2f ms  max %7.2f ms' % (
+            len(rows), np.percentile(latencies, 50), np.percentile(latencies, 99), latencies.max())
+
+    print('swap to %s took %.0f ms after activation (load + warm-up, off the request path)' % (
+        v2, (swapped - activated) * 1000.0))
+    print('before swap: ' + summary([r for r in samples if r[0] < activated]))
+    print('during swap: ' + summary([r for r in samples if activated <= r[0] < swapped]))
+    print('after swap:  ' + summary([r for r in samples if r[0] >= swapped]))
+    print('%.0f requests/s overall' % (len(samples) / (time.perf_counter() - begin)))
+
+    failed = list(errors[:3])
+    if any(r[2] not in (v1, v2) for r in samples):
+        failed.append('prediction tagged with an unknown version')
+    # A batch formed just before the swap may finish right after it
+    if any(r[2] == v1 for r in samples if r[0] > swapped + 0.5):
+        failed.append('v1 still served after the swap')
+    for message in failed:
+        print('FAILED: ' + message)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# Inference pool scaling: images/sec with the model in the web process vs
+# in 1..N inference server processes fed through shared memory.
+#
+# Usage: python benchmarks/bench_inference_pool.py [--workers 1 2 4] [--batches 64] [--batch-size 32]
+#
+# Each run drives the model from 2 client threads per worker, the way
+# InferenceEngine's batching threads would. Uses a random-weight
+# NumPy-backend model with the notebook's layer shapes, with
+# OMP_NUM_THREADS=1 so every replica stays on one core. Exits non-zero if
+# the pool's predictions differ from the in-process model's.
+import os
+
+os.environ.setdefault('OMP_NUM_THREADS', '1')
+os.environ.setdefault('OPENBLAS_NUM_THREADS', '1')
+
+import argparse  # noqa: E402
+import sys  # noqa: E402
+import tempfile  # noqa: E402
+import time  # noqa: E402
+from concurrent.futures import ThreadPoolExecutor  # noqa: E402
+
+import numpy as np  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+from bench_hot_swap import notebook_npz  # noqa: E402
+from inference_pool import InferencePool  # noqa: E402
+from model_loader import LazyModel  # noqa: E402
+from preprocess import CELL_SHAPE  # noqa: E402
+
+
+def drive(predict, batches, threads):
+    # images/sec pushing every batch through predict from `threads` threads
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(predict, batches))
+    return sum(len(b) for b in batches) / (time.perf_counter() - start), results
+
+
+def main():
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted(set([1, 2, max(2, cores // 2), max(2, cores)])))
+    parser.add_argument('--batches', type=int, default=64)
+    parser.add_argument('--batch-size', type=int, default=32)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    batches = [rng.random((args.batch_size,) + CELL_SHAPE, dtype=np.float32) for _ in range(args.batches)]
+    ok = True
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = notebook_npz(os.path.join(tmpdir, 'model.npz'), 1)
+        model = LazyModel(path, backend='numpy')
+        model.warm_up()
+        baseline, expected = drive(model.predict_versioned, batches, 2)
+        print('%d cores, %d batches of %d' % (cores, args.batches, args.batch_size))
+        print('in-process model:      %8.0f images/s' % baseline)
+
+        for workers in args.workers:
+            pool = InferencePool(path, backend='numpy', workers=workers, capacity=args.batch_size).start()
+            try:
+                # Wait for every replica to load and warm up
+                while None in [w['version'] for w in pool.stats()['workers']]:
+                    time.sleep(0.05)
+                rate, results = drive(pool.predict_versioned, batches, 2 * workers)
+            finally:
+                pool.close()
+            for (want, version), (got, got_version) in zip(expected, results):
+                ok = ok and got_version == version and np.allclose(got, want, atol=1e-6)
+            print('pool, %2d worker(s):    %8.0f images/s  (%.2fx in-process)' % (workers, rate, rate / baseline))
+
+    if cores < max(args.workers):
+        print('note: only %d core(s) here, so workers beyond that cannot add throughput' % cores)
+    print('pool matches in-process predictions: %s' % ('yes' if ok else 'NO'))
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
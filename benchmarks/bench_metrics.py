@@ -0,0 +1,104 @@
+# Cost of the /metrics instrumentation (metrics.py): one stage timing, one
+# timed SQLite statement vs a plain one, and a whole Flask request with the
+# request hooks installed vs without.
+#
+# Usage: python benchmarks/bench_metrics.py [--n 100000]
+#
+# Exits non-zero if the exposition is not valid Prometheus text (every
+# sample line is "name{labels} value") or the request hooks cost more than
+# 50 us per request.
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import time
+
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics  # noqa: E402
+
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_][a-zA-Z0-9_]*="[^"]*",?)*\})? \S+$')
+
+
+def per_call_us(fn, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def ping_app(instrumented):
+    app = Flask(__name__)
+    if instrumented:
+        metrics.init_app(app)
+
+    @app.route('/ping')
+    def ping():
+        return 'ok'
+
+    return app
+
+
+def request_us(instrumented, n):
+    client = ping_app(instrumented).test_client()
+    client.get('/ping')
+    return per_call_us(lambda: client.get('/ping'), n)
+
+
+def hooks_us(n):
+    # The before / after request hooks alone, inside one request context
+    app = ping_app(True)
+    before = app.before_request_funcs[None][0]
+    after = app.after_request_funcs[None][0]
+    response = app.response_class('ok')
+    with app.test_request_context('/ping'):
+        return per_call_us(lambda: after(before() or response), n)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=100000)
+    args = parser.parse_args()
+
+    def timed_block():
+        with metrics.stage('bench'):
+            pass
+
+    stage_us = per_call_us(timed_block, args.n)
+    counter_us = per_call_us(lambda: metrics.PREDICTIONS.inc('bench', 'Infected'), args.n)
+
+    plain = sqlite3.connect(':memory:')
+    timed = sqlite3.connect(':memory:', factory=metrics.TimedConnection)
+    for conn in (plain, timed):
+        conn.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT)')
+        conn.executemany('INSERT INTO t (v) VALUES (?)', [('x',)] * 1000)
+    plain_us = per_call_us(lambda: plain.execute('SELECT v FROM t WHERE id = ?', (7,)).fetchone(), args.n)
+    timed_us = per_call_us(lambda: timed.execute('SELECT v FROM t WHERE id = ?', (7,)).fetchone(), args.n)
+
+    # Best of three, alternating, so warm-up and noise don't decide it
+    requests = max(1000, args.n // 20)
+    runs = [(request_us(False, requests), request_us(True, requests)) for _ in range(3)]
+    bare_us = min(bare for bare, _ in runs)
+    hooked_us = min(hooked for _, hooked in runs)
+    hook_us = hooks_us(requests)
+
+    text = metrics.REGISTRY.render()
+    bad = [line for line in text.splitlines() if line and not line.startswith('#') and not SAMPLE.match(line)]
+
+    print('stage timing:               %6.2f us' % stage_us)
+    print('counter increment:          %6.2f us' % counter_us)
+    print('SQLite PK lookup:           %6.2f us plain, %.2f us timed (+%.2f us)' % (plain_us, timed_us,
+                                                                                timed_us - plain_us))
+    print('request hooks:              %6.2f us' % hook_us)
+    print('Flask request (test client): %5.1f us bare, %.1f us with hooks' % (bare_us, hooked_us))
+    print('exposition: %d lines, %d malformed' % (len(text.splitlines()), len(bad)))
+    if bad or hook_us > 50:
+        for line in bad[:5]:
+            print('  malformed: %s' % line)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# Per-page latency of the keyset patient listing from 1k to 1M patients.
+#
+# Usage: python benchmarks/bench_pagination.py [--sizes 1000 10000 100000 1000000]
+#
+# For each registry size, builds a synthetic database (fully migrated) and
+# times the first, middle and last page, a name search and a result
+# search, next to the old unpaginated SELECT * ... fetchall().
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+from bench_query_plans import build  # noqa: E402
+from listing import PATIENTS, fetch_page  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+
+def best_ms(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    print('%9s %9s %9s %9s %9s %9s %12s' % ('patients', 'first', 'middle', 'last', 'name', 'result', 'fetchall'))
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = build(os.path.join(tmpdir, 'synthetic.db'), size, recos=100, users=10)
+            migrate(conn)
+            conn.row_factory = sqlite3.Row
+            n = args.page_size
+            cases = [
+                lambda: fetch_page(conn, PATIENTS, page_size=n),
+                lambda: fetch_page(conn, PATIENTS, after=size // 2, page_size=n),
+                lambda: fetch_page(conn, PATIENTS, before=size + 1, page_size=n),
+                lambda: fetch_page(conn, PATIENTS, page_size=n, field='name', q='F12345'),
+                lambda: fetch_page(conn, PATIENTS, after=size // 2, page_size=n, field='result', q='Infected'),
+                lambda: conn.execute('SELECT * FROM patients').fetchall(),
+            ]
+            timings = [best_ms(case, args.repeats) for case in cases]
+            conn.close()
+        print('%9d %9.3f %9.3f %9.3f %9.3f %9.3f %12.1f  ms' % ((size,) + tuple(timings)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# Parity check and timing for the in-memory preprocessing pipeline.
+#
+# Usage: python benchmarks/bench_preprocess.py [--iterations N]
+#
+# Exits non-zero if preprocess.preprocess_bytes() does not produce exactly
+# the tensor of the old save -> Image.open -> resize -> /255.0 path.
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from preprocess import preprocess_bytes  # noqa: E402
+
+
+def legacy_preprocess(data, tmpdir):
+    # The pre-change route logic, temp file round trip included
+    filepath = os.path.join(tmpdir, 'cell.png')
+    with open(filepath, 'wb') as f:
+        f.write(data)
+    img = Image.open(filepath)
+    img = img.resize((50, 50))
+    img_array = np.array(img) / 255.0
+    os.remove(filepath)
+    return img_array
+
+
+def sample_images(rng):
+    # Cell-crop sized RGB images in the formats the upload form accepts
+    for size in [(50, 50), (64, 48), (120, 133), (160, 160), (31, 40)]:
+        pixels = rng.integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)
+        for fmt in ['PNG', 'JPEG']:
+            buf = io.BytesIO()
+            Image.fromarray(pixels, 'RGB').save(buf, format=fmt)
+            yield '%dx%d %s' % (size[0], size[1], fmt), buf.getvalue()
+
+
+def check_parity(images, tmpdir):
+    failures = 0
+    for name, data in images:
+        expected = legacy_preprocess(data, tmpdir).astype(np.float32)
+        actual = preprocess_bytes(data)
+        if actual.shape != expected.shape or not np.array_equal(actual, expected):
+            print('MISMATCH %s' % name)
+            failures += 1
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    images = list(sample_images(rng))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        failures = check_parity(images, tmpdir)
+        print('parity: %d/%d images identical' % (len(images) - failures, len(images)))
+        if failures:
+            sys.exit(1)
+
+        data = images[0][1]
+        out = np.empty((50, 50, 3), dtype=np.float32)
+
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            legacy_preprocess(data, tmpdir)
+        legacy = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            preprocess_bytes(data, out=out)
+        inmemory = time.perf_counter() - start
+
+    print('legacy (temp file): %8.1f us/image' % (legacy / args.iterations * 1e6))
+    print('in-memory:          %8.1f us/image' % (inmemory / args.iterations * 1e6))
+
+
+if __name__ == '__main__':
+    main()
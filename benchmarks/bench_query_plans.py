@@ -0,0 +1,93 @@
+# Query-plan check and timings for the hot insurance/username queries on a
+# synthetic database.
+#
+# Usage: python benchmarks/bench_query_plans.py [--patients 1000000]
+#
+# Builds a throwaway database at the baseline schema (migration 1), times
+# the hot queries, applies the remaining migrations and times them again.
+# Exits non-zero if EXPLAIN QUERY PLAN still shows a full scan of a table
+# the query should reach through an index.
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from migrations import migrate  # noqa: E402
+
+# (route, sql, params, tables the query may legitimately scan in full)
+HOT_QUERIES = [
+    ('patient1', """SELECT patients.*, reco.* FROM reco
+                    LEFT JOIN patients ON patients.insurance = reco.insurance""", (), {'reco'}),
+    ('print_patient1', """SELECT patients.*, reco.* FROM patients
+                          JOIN reco ON patients.insurance = reco.insurance
+                          WHERE patientid = ?""", (4242,), set()),
+    ('addpatient3', "UPDATE patients SET Result = ? WHERE insurance = ?", ('Infected', 'INS-0004242'), set()),
+    ('is_valid_user', "SELECT * FROM Users WHERE Username = ? COLLATE NOCASE", ('USER42',), set()),
+]
+
+
+def build(path, patients, recos, users):
+    conn = sqlite3.connect(path)
+    migrate(conn, target=1)
+    rng = random.Random(0)
+    conn.executemany("INSERT INTO patients (fname, lname, insurance, phone, Result) VALUES (?, ?, ?, ?, ?)",
+                     (('F%d' % i, 'L%d' % i, 'INS-%07d' % i, '07%08d' % i,
+                       rng.choice(['Infected', 'Uninfected', 'No results'])) for i in range(patients)))
+    conn.executemany("INSERT INTO reco (insurance, reco) VALUES (?, ?)",
+                     (('INS-%07d' % rng.randrange(patients), 'Rest and fluids') for _ in range(recos)))
+    conn.executemany("INSERT INTO Users (Username, Password, UserType) VALUES (?, ?, ?)",
+                     (('user%d' % i, 'pw', 'doctor') for i in range(users)))
+    conn.commit()
+    return conn
+
+
+def full_scans(conn, sql, params):
+    plan = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    return {row[3].split()[1] for row in plan if row[3].startswith('SCAN ')}
+
+
+def time_query(conn, sql, params, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        conn.execute(sql, params).fetchall()
+    conn.rollback()
+    return (time.perf_counter() - start) / repeats * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--patients', type=int, default=1000000)
+    parser.add_argument('--recos', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        start = time.perf_counter()
+        conn = build(os.path.join(tmpdir, 'synthetic.db'), args.patients, args.recos, args.users)
+        print('built %d patients in %.1fs' % (args.patients, time.perf_counter() - start))
+
+        before = {name: time_query(conn, sql, params, args.repeats) for name, sql, params, _ in HOT_QUERIES}
+        migrate(conn)
+        after = {name: time_query(conn, sql, params, args.repeats) for name, sql, params, _ in HOT_QUERIES}
+
+        failed = False
+        print('%-15s %12s %12s  %s' % ('query', 'before ms', 'after ms', 'full scans'))
+        for name, sql, params, allowed in HOT_QUERIES:
+            scans = full_scans(conn, sql, params)
+            bad = scans - allowed
+            failed = failed or bool(bad)
+            print('%-15s %12.2f %12.3f  %s%s' % (name, before[name], after[name], ', '.join(sorted(scans)) or '-',
+                                                 '  <-- FAIL' if bad else ''))
+        conn.close()
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# Cold-start time and memory for the non-inference routes.
+#
+# Usage: python benchmarks/bench_startup.py [--runs N]
+#
+# Each run is a fresh interpreter. "eager" loads the model right after
+# import, which is what app.py did before the model subsystem became lazy;
+# "lazy" is the current default. Run from the repository root so the
+# SQLite database and models/ are found.
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r'''
+import json, resource, sys, time
+start = time.perf_counter()
+import app
+if sys.argv[1] == 'eager':
+    app.model.get()
+imported = time.perf_counter()
+client = app.app.test_client()
+timings = {}
+for path in ['/login', '/dashboard', '/patient']:
+    t = time.perf_counter()
+    client.get(path)
+    timings[path] = time.perf_counter() - t
+print(json.dumps({
+    'import_s': imported - start,
+    'first_responses_s': timings,
+    'ready_s': time.perf_counter() - start,
+    'tensorflow_imported': 'tensorflow' in sys.modules,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+}))
+'''
+
+
+def run(mode):
+    out = subprocess.run([sys.executable, '-c', CHILD, mode], cwd=ROOT,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    for mode in ['eager', 'lazy']:
+        results = [run(mode) for _ in range(args.runs)]
+        best = min(results, key=lambda r: r['ready_s'])
+        print('%-5s import %.3fs  ready %.3fs  rss %.0f MB  tensorflow loaded: %s' % (
+            mode, best['import_s'], best['ready_s'], best['max_rss_mb'], best['tensorflow_imported']))
+        for path, seconds in best['first_responses_s'].items():
+            print('        %-10s %.1f ms' % (path, seconds * 1000.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# Time-to-first-byte, total time and peak RSS for an unpaginated patient
+# export, rendered in memory vs streamed from the cursor.
+#
+# Usage: python benchmarks/bench_streaming.py [--patients 200000]
+#
+# Builds a synthetic database, then runs GET /patient?all=1 in a fresh
+# interpreter per mode (STREAM_TEMPLATES off / on) so peak RSS is not
+# shared between them.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+from bench_query_plans import build  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+CHILD = r'''
+import json, resource, sys, time
+import app
+app.app.config['STREAM_TEMPLATES'] = sys.argv[1] == 'stream'
+client = app.app.test_client()
+client.get('/patient')  # warm up templates and the pool
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+response = client.get('/patient?all=1', buffered=False)
+first = None
+size = 0
+for chunk in response.response:
+    if first is None:
+        first = time.perf_counter()
+    size += len(chunk)
+response.close()
+end = time.perf_counter()
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({'ttfb_ms': (first - start) * 1000, 'total_ms': (end - start) * 1000,
+                  'mb': size / 1e6, 'baseline_rss_mb': baseline / 1024.0, 'peak_rss_mb': peak / 1024.0}))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--patients', type=int, default=200000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'synthetic.db')
+        conn = build(path, args.patients, recos=100, users=10)
+        migrate(conn)
+        conn.close()
+
+        env = dict(os.environ, MALARIA_DB=path)
+        print('%-9s %10s %10s %8s %14s %12s' % ('mode', 'ttfb ms', 'total ms', 'MB', 'baseline RSS', 'peak RSS'))
+        for mode in ['buffered', 'stream']:
+            out = subprocess.run([sys.executable, '-c', CHILD, mode], cwd=ROOT, env=env,
+                                 capture_output=True, text=True, check=True)
+            r = json.loads(out.stdout.strip().splitlines()[-1])
+            print('%-9s %10.1f %10.1f %8.1f %11.1f MB %9.1f MB' % (
+                mode, r['ttfb_ms'], r['total_ms'], r['mb'], r['baseline_rss_mb'], r['peak_rss_mb']))
+
+
+if __name__ == '__main__':
+    main()
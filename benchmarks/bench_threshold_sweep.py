@@ -0,0 +1,108 @@
+# Threshold sweep and ROC over stored prediction scores (migration 6) vs
+# re-scoring every image with the model.
+#
+# Usage: python benchmarks/bench_threshold_sweep.py [--rows 200000] [--thresholds 99]
+#
+# Fills a fresh database with random labelled predictions, half attached
+# to patients (label from patients.Result) and half with an explicit
+# label, then times prediction_log.roc / sweep. Re-scoring is estimated
+# from the NumPy-backend model's batched throughput. Exits non-zero if the
+# SQL AUC or confusion counts disagree with the same computed in NumPy.
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+from bench_hot_swap import notebook_npz  # noqa: E402
+from backends import load_backend  # noqa: E402
+from migrations import migrate  # noqa: E402
+from prediction_log import roc, sweep  # noqa: E402
+from preprocess import CELL_SHAPE  # noqa: E402
+
+
+def fill(conn, n, rng):
+    infected = rng.random(n) < 0.3
+    scores = np.clip(rng.normal(np.where(infected, 0.7, 0.35), 0.15), 0, 1).round(4)
+    attached = np.arange(n) % 2 == 0
+    conn.executemany("INSERT INTO patients (fname, lname, insurance, phone, Result) VALUES ('F', 'L', ?, '0', ?)",
+                     (('INS-%d' % i, 'Infected' if infected[i] else 'Uninfected')
+                      for i in np.flatnonzero(attached)))
+    conn.executemany("""INSERT INTO predictions (predictionid, route, model_version, p_infected, score,
+                                                 threshold, result, insurance, label)
+                        VALUES (?, 'predict', 'v1', ?, ?, 0.5, ?, ?, ?)""",
+                     (('%016x' % i, float(scores[i]), float(scores[i]),
+                       'Infected' if scores[i] > 0.5 else 'Uninfected',
+                       'INS-%d' % i if attached[i] else None,
+                       None if attached[i] else int(infected[i])) for i in range(n)))
+    conn.commit()
+    return scores, infected
+
+
+def numpy_auc(scores, infected):
+    # Probability a random infected cell outscores a random uninfected one
+    # (ties count half), i.e. the Mann-Whitney U statistic
+    order = np.argsort(scores, kind='mergesort')
+    ranks = np.empty(len(scores))
+    sorted_scores = scores[order]
+    _, first, counts = np.unique(sorted_scores, return_index=True, return_counts=True)
+    ranks[order] = np.repeat(first + (counts + 1) / 2.0, counts)
+    positives, negatives = infected.sum(), (~infected).sum()
+    return (ranks[infected].sum() - positives * (positives + 1) / 2.0) / (positives * negatives)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--thresholds', type=int, default=99)
+    args = parser.parse_args()
+    thresholds = np.linspace(0, 1, args.thresholds + 2)[1:-1].round(4).tolist()
+    rng = np.random.default_rng(0)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        conn = sqlite3.connect(os.path.join(tmpdir, 'bench.db'))
+        migrate(conn)
+        start = time.perf_counter()
+        scores, infected = fill(conn, args.rows, rng)
+        print('%d predictions stored in %.1fs' % (args.rows, time.perf_counter() - start))
+
+        start = time.perf_counter()
+        curve = roc(conn)
+        roc_s = time.perf_counter() - start
+        start = time.perf_counter()
+        rows = sweep(conn, thresholds)
+        sweep_s = time.perf_counter() - start
+        conn.close()
+
+        model = load_backend('numpy', notebook_npz(os.path.join(tmpdir, 'model.npz'), 1))
+        batch = rng.random((256,) + CELL_SHAPE, dtype=np.float32)
+        model.predict(batch)
+        start = time.perf_counter()
+        model.predict(batch)
+        per_image_s = (time.perf_counter() - start) / len(batch)
+
+    expected_auc = numpy_auc(scores, infected)
+    ok = abs(curve['auc'] - expected_auc) < 1e-9
+    for row in rows:
+        predicted = scores > row['threshold']
+        ok = ok and (row['tp'], row['fp'], row['tn'], row['fn']) == (
+            int((predicted & infected).sum()), int((predicted & ~infected).sum()),
+            int((~predicted & ~infected).sum()), int((~predicted & infected).sum()))
+
+    print('ROC (%d points, AUC %.4f):      %8.1f ms' % (len(curve['points']), curve['auc'], roc_s * 1000))
+    print('sweep over %d thresholds:       %8.1f ms' % (len(thresholds), sweep_s * 1000))
+    print('re-scoring %d images (est.):    %8.1f ms (%.3f ms/image, batched, excluding decode)' % (
+        args.rows, per_image_s * args.rows * 1000, per_image_s * 1000))
+    print('SQL matches NumPy: %s' % ('yes' if ok else 'NO'))
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# Training input pipeline: the notebook approach (np.load everything,
+# shuffle by fancy indexing, astype('float32') / 255 for train and test)
+# vs train_pipeline (mmap, index-only shuffle, per-batch normalisation,
+# prefetching generator). Reports setup time, epochs/sec over the batches
+# and peak memory.
+#
+# Usage: python benchmarks/bench_training_input.py [--cells 27558] [--epochs 3] [--with-model]
+#
+# Without --with-model only the input side is timed (no TensorFlow
+# needed); with it each batch also goes through model.train_on_batch.
+# Each mode runs in a fresh interpreter. Peak anon is memory the process
+# owns; peak RSS also counts pages of the mapped file, which the OS can
+# drop at any time.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+CHILD = r'''
+import json, sys, threading, time
+import numpy as np
+
+mode, cells_path, labels_path, epochs, with_model = sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4]), sys.argv[5] == '1'
+peak = {'anon': 0, 'rss': 0}
+
+def sample():
+    while True:
+        status = dict(line.split(':', 1) for line in open('/proc/self/status') if ':' in line)
+        peak['anon'] = max(peak['anon'], int(status['RssAnon'].split()[0]))
+        peak['rss'] = max(peak['rss'], int(status['VmRSS'].split()[0]))
+        time.sleep(0.005)
+
+threading.Thread(target=sample, daemon=True).start()
+step = lambda x, y: None
+if with_model:
+    from train import build_model
+    model = build_model()
+    step = model.train_on_batch
+
+start = time.perf_counter()
+if mode == 'notebook':
+    Cells = np.load(cells_path)
+    labels = np.load(labels_path)
+    s = np.arange(Cells.shape[0])
+    np.random.shuffle(s)
+    Cells = Cells[s]
+    labels = labels[s]
+    len_data = len(Cells)
+    x_train = Cells[int(0.1 * len_data):].astype('float32') / 255
+    x_test = Cells[:int(0.1 * len_data)].astype('float32') / 255
+    y_train = np.eye(2, dtype=np.float32)[labels[int(0.1 * len_data):]]
+
+    def epoch(e):
+        for i in range(0, len(x_train), 32):
+            step(x_train[i:i + 32], y_train[i:i + 32])
+else:
+    from train_pipeline import epoch_generator, open_dataset, split_indices
+    cells, labels = open_dataset(cells_path, labels_path)
+    train_idx, val_idx = split_indices(len(cells))
+    batches = epoch_generator(cells, labels, train_idx, 32)
+
+    def epoch(e):
+        for x, y in batches():
+            step(x, y)
+setup = time.perf_counter() - start
+start = time.perf_counter()
+for e in range(epochs):
+    epoch(e)
+elapsed = time.perf_counter() - start
+time.sleep(0.02)
+print(json.dumps({'setup_s': setup, 'epochs_per_s': epochs / elapsed,
+                  'peak_anon_mb': peak['anon'] / 1024.0, 'peak_rss_mb': peak['rss'] / 1024.0}))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cells', type=int, default=27558, help='dataset size (27558 = the NIH cell_images set)')
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--with-model', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cells_path = os.path.join(tmpdir, 'Cells.npy')
+        labels_path = os.path.join(tmpdir, 'labels.npy')
+        cells = np.lib.format.open_memmap(cells_path, mode='w+', dtype=np.uint8, shape=(args.cells, 50, 50, 3))
+        rng = np.random.default_rng(0)
+        for start in range(0, args.cells, 4096):
+            cells[start:start + 4096] = rng.integers(0, 256, size=cells[start:start + 4096].shape, dtype=np.uint8)
+        cells.flush()
+        del cells
+        np.save(labels_path, rng.integers(0, 2, size=args.cells).astype(np.uint8))
+
+        print('%d cells (%.0f MB uint8), %d epochs%s' % (args.cells, args.cells * 7500 / 1e6, args.epochs,
+                                                       ', with model' if args.with_model else ', input only'))
+        print('%-9s %9s %11s %11s %11s' % ('mode', 'setup s', 'epochs/s', 'peak anon', 'peak RSS'))
+        for mode in ['notebook', 'mmap']:
+            out = subprocess.run([sys.executable, '-c', CHILD, mode, cells_path, labels_path, str(args.epochs),
+                                  '1' if args.with_model else '0'], cwd=ROOT, capture_output=True, text=True, check=True)
+            r = json.loads(out.stdout.strip().splitlines()[-1])
+            print('%-9s %9.2f %11.2f %8.0f MB %8.0f MB' % (mode, r['setup_s'], r['epochs_per_s'],
+                                                       r['peak_anon_mb'], r['peak_rss_mb']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# Cost of test-time augmentation: TTA x8 scored as one batch vs 8 single
+# predictions, against the latency of one plain prediction.
+#
+# Usage:
+#   python benchmarks/bench_tta.py [--repeats 200] [--variants 8]
+#   python benchmarks/bench_tta.py --backend keras --model models/my_model.h5
+#
+# Measured twice: on the model alone (backend.predict) and on the path the
+# prediction routes take, where a plain prediction goes through the
+# micro-batching engine and a TTA prediction is one predict_batch call.
+# Without --model a random-weight NumPy-backend model with the notebook's
+# layer shapes is used (no TensorFlow needed). Exits non-zero if the
+# batched TTA mean / variance differ from the sequential predictions, or
+# if on the route path TTA costs more than half of `variants` plain
+# predictions.
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from bench_hot_swap import notebook_npz  # noqa: E402
+from inference import InferenceEngine  # noqa: E402
+from model_loader import LazyModel  # noqa: E402
+from preprocess import CELL_SHAPE  # noqa: E402
+from tta import augment, predict_tta  # noqa: E402
+
+
+def timed(fn, repeats):
+    # Median wall time of fn() in ms
+    fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000.0)
+    return float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type=int, default=200)
+    parser.add_argument('--variants', type=int, default=8)
+    parser.add_argument('--backend', default='numpy')
+    parser.add_argument('--model', default=None)
+    parser.add_argument('--max-wait-ms', type=float, default=5, help='engine batching window (app default 5)')
+    args = parser.parse_args()
+    n = args.variants
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        model = LazyModel(args.model or notebook_npz(os.path.join(tmpdir, 'model.npz'), 1), backend=args.backend)
+        model.warm_up()
+        engine = InferenceEngine(model.predict_versioned, max_wait_ms=args.max_wait_ms, versioned=True)
+        cell = np.random.default_rng(0).random(CELL_SHAPE, dtype=np.float32)
+        variants = augment(cell, n)
+
+        sequential = np.concatenate([model.predict(variants[i:i + 1]) for i in range(n)])
+        mean, variance, _ = predict_tta(engine.predict_batch_versioned, cell, n)
+        ok = np.allclose(mean[0], sequential.mean(axis=0), atol=1e-5) and \
+            np.isclose(variance[0], sequential[:, 0].var(), atol=1e-6)
+
+        augment_ms = timed(lambda: augment(cell, n), args.repeats)
+        model_single_ms = timed(lambda: model.predict(cell[np.newaxis]), args.repeats)
+        model_sequential_ms = timed(lambda: [model.predict(variants[i:i + 1]) for i in range(n)], args.repeats)
+        model_tta_ms = timed(lambda: model.predict(augment(cell, n)), args.repeats)
+        route_single_ms = timed(lambda: engine.predict_versioned(cell), args.repeats)
+        route_sequential_ms = timed(lambda: [engine.predict_versioned(v) for v in variants], args.repeats)
+        route_tta_ms = timed(lambda: predict_tta(engine.predict_batch_versioned, cell, n), args.repeats)
+
+    print('%s backend, TTA x%d (augment %.2f ms)' % (args.backend, n, augment_ms))
+    print('%-12s %10s %18s %18s' % ('', 'single', '%d sequential' % n, 'TTA x%d batched' % n))
+    for name, single, sequential, tta in (('model', model_single_ms, model_sequential_ms, model_tta_ms),
+                                          ('route path', route_single_ms, route_sequential_ms, route_tta_ms)):
+        print('%-12s %7.2f ms %9.2f ms %5.1fx %9.2f ms %5.1fx' % (
+            name, single, sequential, sequential / single, tta, tta / single))
+    print('TTA mean / variance match sequential: %s' % ('yes' if ok else 'NO'))
+    if not ok or route_tta_ms > route_single_ms * n / 2:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
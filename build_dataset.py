@@ -0,0 +1,206 @@
+# Build the training arrays from the cell_images folders.
+#
+# Usage:
+#   python build_dataset.py cell_images
+#   python build_dataset.py cell_images --workers 8 --cells Cells.npy --labels labels.npy
+#
+# Expects <root>/Parasitized and <root>/Uninfected, like the notebook
+# (labels: 0 = Parasitized, 1 = Uninfected). Images are decoded and
+# resized on a process pool and written straight into Cells.npy (uint8,
+# N x 50 x 50 x 3) and labels.npy (uint8, N), both memory-mapped. Every
+# file seen is recorded in a manifest next to Cells.npy, so an
+# interrupted build resumes where it stopped and a later run only decodes
+# images that are not in the manifest yet. Unreadable files are recorded
+# as skipped and not retried.
+#
+# Pixels go through preprocess.resize_cell, the same RGB path the app
+# serves with. (The notebook read images with cv2, i.e. in BGR order.)
+import argparse
+import ast
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from preprocess import CELL_SHAPE, decode_image, resize_cell
+
+CLASSES = (('Parasitized', 0), ('Uninfected', 1))
+
+# Bytes reserved for the .npy header so the shape can be rewritten in place
+# as the dataset grows (np.save writes 128 for arrays like these)
+HEADER_SIZE = 128
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+
+# Images written between manifest commits
+DEFAULT_COMMIT_EVERY = 1024
+
+
+class GrowableNpy:
+    # A .npy file whose leading dimension can grow in place: the header is
+    # padded to HEADER_SIZE bytes, the data region is extended with
+    # truncate() and mapped with np.memmap. np.load(path, mmap_mode='r')
+    # reads it like any other .npy file.
+    def __init__(self, path, item_shape, dtype):
+        self.path = path
+        self.item_shape = tuple(item_shape)
+        self.dtype = np.dtype(dtype)
+        self.item_size = int(np.prod(self.item_shape, dtype=np.int64)) * self.dtype.itemsize
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(self._header(0))
+
+    def _header(self, n):
+        header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (
+            self.dtype.str, (n,) + self.item_shape)
+        pad = HEADER_SIZE - len(NPY_MAGIC) - 2 - len(header) - 1
+        if pad < 0:
+            raise ValueError('shape %r does not fit in a %d byte header' % ((n,) + self.item_shape, HEADER_SIZE))
+        header = (header + ' ' * pad + '\n').encode('latin-1')
+        return NPY_MAGIC + len(header).to_bytes(2, 'little') + header
+
+    def check(self):
+        # Refuse files with a different layout (e.g. a notebook Cells.npy
+        # of another shape) instead of silently overwriting them
+        with open(self.path, 'rb') as f:
+            head = f.read(HEADER_SIZE)
+        if len(head) != HEADER_SIZE or not head.startswith(NPY_MAGIC):
+            raise ValueError('%s is not a %d byte header .npy file' % (self.path, HEADER_SIZE))
+        header = ast.literal_eval(head[len(NPY_MAGIC) + 2:].decode('latin-1'))
+        if np.dtype(header['descr']) != self.dtype or tuple(header['shape'][1:]) != self.item_shape:
+            raise ValueError('%s holds %s %r, expected %s %r' % (
+                self.path, header['descr'], header['shape'], self.dtype.str, (None,) + self.item_shape))
+
+    def reserve(self, n):
+        # Preallocate room for n items and map it read-write
+        with open(self.path, 'r+b') as f:
+            f.truncate(HEADER_SIZE + n * self.item_size)
+        return np.memmap(self.path, dtype=self.dtype, mode='r+', offset=HEADER_SIZE, shape=(n,) + self.item_shape)
+
+    def commit(self, n):
+        # Publish the first n items: rewrite the shape in the header
+        with open(self.path, 'r+b') as f:
+            f.write(self._header(n))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def finish(self, n):
+        with open(self.path, 'r+b') as f:
+            f.truncate(HEADER_SIZE + n * self.item_size)
+        self.commit(n)
+
+
+def list_images(root):
+    # (relative path, label) for every file in the class folders, sorted
+    # so indices are reproducible
+    images = []
+    for folder, label in CLASSES:
+        directory = os.path.join(root, folder)
+        for name in sorted(os.listdir(directory)):
+            if os.path.isfile(os.path.join(directory, name)):
+                images.append((folder + '/' + name, label))
+    return images
+
+
+def read_manifest(path):
+    # rel path -> (label, index); index -1 means skipped. A torn last line
+    # from an interrupted run is ignored and that file is redone.
+    entries = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) != 4:
+                continue
+            entries[parts[0]] = (int(parts[1]), int(parts[2]))
+    return entries
+
+
+def load_cell(path):
+    # Runs in the worker processes: (uint8 cell, None) or (None, reason)
+    try:
+        with open(path, 'rb') as f:
+            return resize_cell(decode_image(f.read())), None
+    except Exception as e:
+        return None, '%s: %s' % (type(e).__name__, e)
+
+
+def build(root, cells_path='Cells.npy', labels_path='labels.npy', manifest_path=None,
+          workers=None, commit_every=DEFAULT_COMMIT_EVERY, log=print):
+    manifest_path = manifest_path or os.path.splitext(cells_path)[0] + '.manifest.tsv'
+    entries = read_manifest(manifest_path)
+    count = sum(1 for _, index in entries.values() if index >= 0)
+    pending = [(rel, label) for rel, label in list_images(root) if rel not in entries]
+
+    cells_file = GrowableNpy(cells_path, CELL_SHAPE, np.uint8)
+    labels_file = GrowableNpy(labels_path, (), np.uint8)
+    cells_file.check()
+    labels_file.check()
+    if not pending:
+        cells_file.finish(count)
+        labels_file.finish(count)
+        log('%s: %d images, nothing new' % (cells_path, count))
+        return count
+
+    log('%s: %d images, %d new files to decode' % (cells_path, count, len(pending)))
+    cells = cells_file.reserve(count + len(pending))
+    labels = labels_file.reserve(count + len(pending))
+    skipped = 0
+    lines = []
+    start = time.perf_counter()
+
+    def commit():
+        # Data first, then the manifest, then the header: after a crash the
+        # manifest never points at pixels that were not written
+        cells.flush()
+        labels.flush()
+        with open(manifest_path, 'a', encoding='utf-8') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        del lines[:]
+        cells_file.commit(count)
+        labels_file.commit(count)
+
+    with Pool(workers) as pool:
+        paths = [os.path.join(root, rel) for rel, _ in pending]
+        for done, ((rel, label), (cell, error)) in enumerate(zip(pending, pool.imap(load_cell, paths, chunksize=32)), 1):
+            if cell is None:
+                skipped += 1
+                lines.append('%s\t%d\t-1\t%s\n' % (rel, label, error.replace('\t', ' ').replace('\n', ' ')))
+            else:
+                cells[count] = cell
+                labels[count] = label
+                lines.append('%s\t%d\t%d\t\n' % (rel, label, count))
+                count += 1
+            if done % commit_every == 0:
+                commit()
+                log('  %d/%d files, %d skipped, %.0f images/s' % (
+                    done, len(pending), skipped, done / (time.perf_counter() - start)))
+        commit()
+
+    # Unmap before truncating (Windows refuses to shrink a mapped file)
+    cells = labels = None
+    cells_file.finish(count)
+    labels_file.finish(count)
+    log('%s: %d images (%d skipped) in %.1fs' % (cells_path, count, skipped, time.perf_counter() - start))
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build Cells.npy / labels.npy from the cell_images folders')
+    parser.add_argument('root', help='folder containing Parasitized/ and Uninfected/')
+    parser.add_argument('--cells', default='Cells.npy')
+    parser.add_argument('--labels', default='labels.npy')
+    parser.add_argument('--manifest', default=None, help='defaults to <cells>.manifest.tsv')
+    parser.add_argument('--workers', type=int, default=None, help='decode processes (default: one per CPU)')
+    parser.add_argument('--commit-every', type=int, default=DEFAULT_COMMIT_EVERY)
+    args = parser.parse_args()
+    build(args.root, args.cells, args.labels, args.manifest, workers=args.workers, commit_every=args.commit_every)
+
+
+if __name__ == '__main__':
+    main()
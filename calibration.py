@@ -0,0 +1,287 @@
+# Probability calibration for the malaria CNN, fitted offline on held-out
+# cells, and the decision threshold applied to the calibrated score.
+#
+# Usage:
+#   python calibration.py fit --method temperature --out models/calibration.json
+#   python calibration.py fit --backend numpy --model models/my_model.npz --method platt \
+#       --out models/registry/<version>/calibration.json
+#
+# The network ends in a 2-class softmax over (Parasitized, Uninfected),
+# the notebook's label order, so index 0 is the infected probability. Both
+# methods rescale the log-odds m = log(p0 / p1) of the raw output:
+#
+#   temperature:  p0' = sigmoid(m / T)
+#   platt:        p0' = sigmoid(a * m + b)
+#
+# and are fitted by minimising the log loss on the validation split that
+# train.py holds out (same --val-fraction and --seed), read from the
+# memory-mapped Cells.npy / labels.npy. The fitted parameters are written
+# as JSON together with the model version they belong to; put the file
+# next to a registry version (<registry>/<version>/calibration.json) and
+# the app applies it whenever that version serves.
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+# Output columns of the model, in the notebook's label order
+CLASS_NAMES = ('Parasitized', 'Uninfected')
+INFECTED = 0
+
+METHODS = ('temperature', 'platt')
+DEFAULT_THRESHOLD = 0.5
+
+# Probabilities are clipped this far from 0 and 1 before taking logs
+EPSILON = 1e-7
+
+ECE_BINS = 15
+
+
+def classify(score, threshold=DEFAULT_THRESHOLD):
+    # Result for a calibrated infected probability
+    return 'Infected' if score > threshold else 'Uninfected'
+
+
+def prediction_result(probabilities, model_version, calibration, threshold=DEFAULT_THRESHOLD, tta=None):
+    # What the prediction routes report for one cell: the raw per-class
+    # probabilities, the calibrated infected score and the result
+    score = float(calibration.infected([probabilities])[0])
+    return {'result': classify(score, threshold), 'score': score, 'threshold': threshold,
+            'calibration': calibration.method,
+            'probabilities': dict(zip(CLASS_NAMES, (float(p) for p in probabilities))),
+            'model_version': model_version, 'tta': tta}
+
+
+def log_odds(probabilities):
+    # Raw (N x 2) softmax rows -> log(p_infected / p_uninfected)
+    p = np.clip(np.asarray(probabilities, dtype=np.float64), EPSILON, 1.0)
+    return np.log(p[:, INFECTED]) - np.log(p[:, 1 - INFECTED])
+
+
+def _sigmoid(x):
+    return 0.5 * (1.0 + np.tanh(0.5 * x))
+
+
+class Calibration:
+    # p0' = sigmoid(a * m + b); temperature scaling is a = 1 / T, b = 0 and
+    # the identity (no calibration file) is a = 1, b = 0
+    def __init__(self, method=None, a=1.0, b=0.0, model_version=None, metrics=None):
+        self.method = method
+        self.a = float(a)
+        self.b = float(b)
+        self.model_version = model_version
+        self.metrics = metrics or {}
+
+    @property
+    def temperature(self):
+        return 1.0 / self.a if self.method == 'temperature' else None
+
+    def infected(self, probabilities):
+        # (N x 2) raw rows -> calibrated infected probability, shape N
+        probabilities = np.asarray(probabilities)
+        if self.method is None:
+            return probabilities[:, INFECTED].astype(np.float64)
+        return _sigmoid(self.a * log_odds(probabilities) + self.b)
+
+    def apply(self, probabilities):
+        # (N x 2) raw rows -> calibrated (N x 2) rows
+        infected = self.infected(probabilities)
+        out = np.empty((len(infected), 2))
+        out[:, INFECTED] = infected
+        out[:, 1 - INFECTED] = 1.0 - infected
+        return out
+
+    def to_dict(self):
+        return {'method': self.method, 'a': self.a, 'b': self.b, 'temperature': self.temperature,
+                'model_version': self.model_version, 'metrics': self.metrics}
+
+    def save(self, path):
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('method') not in METHODS:
+            raise ValueError('%s: unknown calibration method %r' % (path, data.get('method')))
+        return cls(data['method'], data['a'], data['b'], data.get('model_version'), data.get('metrics'))
+
+
+class Calibrations:
+    # The calibration of each model version, loaded on first use:
+    # <registry_root>/<version>/calibration.json for registry versions,
+    # else the file at `path` if it was fitted for that version. Versions
+    # without one (or with an unreadable one, see errors) are served
+    # uncalibrated.
+    def __init__(self, path=None, registry_root=None):
+        self.path = path
+        self.registry_root = registry_root
+        self.errors = {}
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def _load(self, version):
+        candidates = []
+        if self.registry_root and version:
+            candidates.append((os.path.join(self.registry_root, version, 'calibration.json'), False))
+        if self.path:
+            candidates.append((self.path, True))
+        for path, check_version in candidates:
+            if not os.path.exists(path):
+                continue
+            try:
+                calibration = Calibration.load(path)
+            except (OSError, ValueError, KeyError) as e:
+                self.errors[version] = '%s: %s' % (path, e)
+                continue
+            if check_version and calibration.model_version and calibration.model_version != version:
+                continue
+            return calibration
+        return Calibration()
+
+    def get(self, version):
+        calibration = self._loaded.get(version)
+        if calibration is None:
+            with self._lock:
+                calibration = self._loaded.get(version)
+                if calibration is None:
+                    calibration = self._loaded[version] = self._load(version)
+        return calibration
+
+    def clear(self):
+        # Re-read the files, e.g. after the model was reloaded
+        with self._lock:
+            self._loaded.clear()
+            self.errors.clear()
+
+    def infected(self, predictions, versions):
+        # Calibrated infected probability of each row, each with the
+        # calibration of the model version that produced it
+        predictions = np.asarray(predictions)
+        scores = np.empty(len(predictions))
+        versions = np.asarray(versions, dtype=object)
+        for version in set(versions):
+            rows = versions == version
+            scores[rows] = self.get(version).infected(predictions[rows])
+        return scores
+
+
+def fit(probabilities, infected, method='temperature', iterations=100):
+    # Minimise the log loss of sigmoid(a * m + b) against the 0/1 labels
+    # `infected` by damped Newton steps; temperature keeps b = 0. Platt's
+    # target smoothing stops a perfectly separated split from sending
+    # a to infinity.
+    if method not in METHODS:
+        raise ValueError('Unknown calibration method %r, expected one of %s' % (method, ', '.join(METHODS)))
+    m = log_odds(probabilities)
+    y = np.asarray(infected, dtype=np.float64)
+    if method == 'platt':
+        positives = y.sum()
+        negatives = len(y) - positives
+        y = np.where(y > 0, (positives + 1) / (positives + 2), 1 / (negatives + 2))
+    features = np.stack([m, np.ones_like(m)], axis=1) if method == 'platt' else m[:, np.newaxis]
+
+    def loss(params):
+        z = features @ params
+        return np.mean(np.logaddexp(0, z) - y * z)
+
+    params = np.zeros(features.shape[1])
+    params[0] = 1.0
+    current = loss(params)
+    for _ in range(iterations):
+        p = _sigmoid(features @ params)
+        gradient = features.T @ (p - y)
+        hessian = (features * (p * (1 - p))[:, np.newaxis]).T @ features + 1e-9 * np.eye(len(params))
+        step = np.linalg.solve(hessian, gradient)
+        # Halve the step until the loss goes down
+        for _ in range(50):
+            candidate = loss(params - step)
+            if candidate <= current:
+                break
+            step = step / 2
+        else:
+            break
+        params -= step
+        current = candidate
+        if np.abs(step).max() < 1e-10:
+            break
+    return Calibration(method, params[0], params[1] if method == 'platt' else 0.0)
+
+
+def metrics(scores, infected):
+    # Log loss, Brier score and expected calibration error of infected
+    # probabilities against 0/1 labels
+    scores = np.clip(np.asarray(scores, dtype=np.float64), EPSILON, 1 - EPSILON)
+    y = np.asarray(infected, dtype=np.float64)
+    bins = np.minimum((scores * ECE_BINS).astype(int), ECE_BINS - 1)
+    ece = 0.0
+    for k in range(ECE_BINS):
+        in_bin = bins == k
+        if in_bin.any():
+            ece += in_bin.mean() * abs(scores[in_bin].mean() - y[in_bin].mean())
+    return {
+        'log_loss': float(-np.mean(y * np.log(scores) + (1 - y) * np.log(1 - scores))),
+        'brier': float(np.mean((scores - y) ** 2)),
+        'ece': float(ece),
+        'accuracy': float(np.mean((scores > DEFAULT_THRESHOLD) == (y > 0))),
+    }
+
+
+def predict_split(model, cells, labels, indices, batch_size):
+    # Raw predictions and 0/1 infected labels for `indices`, in batches
+    from train_pipeline import iter_batches
+    predictions, infected = [], []
+    for x, y in iter_batches(cells, labels, indices, batch_size):
+        predictions.append(np.asarray(model.predict(x)))
+        infected.append(y[:, INFECTED])
+    return np.concatenate(predictions), np.concatenate(infected)
+
+
+def main():
+    from backends import BACKENDS, DEFAULT_MODEL_PATHS, load_backend
+    from model_loader import model_version_for
+    from train_pipeline import DEFAULT_VAL_FRACTION, open_dataset, split_indices
+
+    parser = argparse.ArgumentParser(description='Fit a probability calibration on held-out cells')
+    commands = parser.add_subparsers(dest='command', required=True)
+    fit_parser = commands.add_parser('fit')
+    fit_parser.add_argument('--method', choices=METHODS, default='temperature')
+    fit_parser.add_argument('--backend', choices=sorted(BACKENDS), default='keras')
+    fit_parser.add_argument('--model', default=None, help='model artefact (default: the backend\'s default path)')
+    fit_parser.add_argument('--cells', default='Cells.npy')
+    fit_parser.add_argument('--labels', default='labels.npy')
+    fit_parser.add_argument('--val-fraction', type=float, default=DEFAULT_VAL_FRACTION)
+    fit_parser.add_argument('--seed', type=int, default=0, help='the split seed train.py was run with')
+    fit_parser.add_argument('--batch-size', type=int, default=256)
+    fit_parser.add_argument('--out', default='models/calibration.json')
+    args = parser.parse_args()
+
+    path = args.model or DEFAULT_MODEL_PATHS[args.backend]
+    model = load_backend(args.backend, path)
+    cells, labels = open_dataset(args.cells, args.labels)
+    _, val_idx = split_indices(len(cells), args.val_fraction, args.seed)
+    start = time.perf_counter()
+    predictions, infected = predict_split(model, cells, labels, val_idx, args.batch_size)
+    print('scored %d held-out cells in %.1fs' % (len(val_idx), time.perf_counter() - start))
+
+    calibration = fit(predictions, infected, args.method)
+    before = metrics(predictions[:, INFECTED], infected)
+    after = metrics(calibration.infected(predictions), infected)
+    calibration.model_version = model_version_for(path)
+    calibration.metrics = {'cells': int(len(val_idx)), 'before': before, 'after': after}
+    calibration.save(args.out)
+    print('%s: a=%.4f b=%.4f%s' % (args.method, calibration.a, calibration.b,
+                                   ' (T=%.4f)' % calibration.temperature if calibration.temperature else ''))
+    for name in ('log_loss', 'brier', 'ece', 'accuracy'):
+        print('  %-9s %.4f -> %.4f' % (name, before[name], after[name]))
+    print('calibration -> %s' % args.out)
+
+
+if __name__ == '__main__':
+    main()
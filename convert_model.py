@@ -0,0 +1,95 @@
+# Export the trained Keras CNN to lighter runtimes.
+#
+# Usage:
+#   python convert_model.py                        # all formats
+#   python convert_model.py --formats tflite numpy
+#   python convert_model.py --model models/my_model.h5 --out-dir models
+#
+# Writes models/my_model.tflite (tflite-runtime / tf.lite), my_model.onnx
+# (onnxruntime, needs tf2onnx) and my_model.npz (backends.NumpyBackend).
+import argparse
+import json
+import os
+
+import numpy as np
+
+from preprocess import CELL_SHAPE
+
+FORMATS = ['tflite', 'onnx', 'numpy']
+
+
+def load_keras_model(path):
+    import tensorflow as tf
+    return tf.keras.models.load_model(path)
+
+
+def export_tflite(model, out_path, quantization=None, representative_dataset=None):
+    # quantization: None (float32), 'float16', or 'int8' (full integer
+    # kernels, calibrated on representative_dataset; inputs and outputs
+    # stay float32 so the serving code needs no changes)
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        if representative_dataset is None:
+            raise ValueError('int8 quantization needs a representative dataset')
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    elif quantization is not None:
+        raise ValueError('Unknown quantization %r' % quantization)
+    with open(out_path, 'wb') as f:
+        f.write(converter.convert())
+    return out_path
+
+
+def export_onnx(model, out_path):
+    import tensorflow as tf
+    import tf2onnx
+    # Leave the batch dimension dynamic so the server can send micro-batches
+    signature = [tf.TensorSpec((None,) + CELL_SHAPE, tf.float32, name='input')]
+    tf2onnx.convert.from_keras(model, input_signature=signature, opset=13, output_path=out_path)
+    return out_path
+
+
+def export_numpy(model, out_path):
+    # Layer list plus weights, read back by backends.NumpyBackend
+    layers = []
+    arrays = {}
+    for i, layer in enumerate(model.layers):
+        config = layer.get_config()
+        weights = layer.get_weights()
+        layers.append({
+            'class_name': layer.__class__.__name__,
+            'config': {key: config.get(key) for key in ['padding', 'activation', 'strides', 'pool_size']},
+            'num_weights': len(weights),
+        })
+        for j, w in enumerate(weights):
+            arrays['w%d_%d' % (i, j)] = w
+    np.savez(out_path, layers=np.array(json.dumps(layers)), **arrays)
+    return out_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the malaria CNN to TFLite / ONNX / NumPy')
+    parser.add_argument('--model', default='models/my_model.h5')
+    parser.add_argument('--out-dir', default='models')
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=FORMATS)
+    args = parser.parse_args()
+
+    model = load_keras_model(args.model)
+    stem = os.path.splitext(os.path.basename(args.model))[0]
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    exporters = {'tflite': export_tflite, 'onnx': export_onnx, 'numpy': export_numpy}
+    extensions = {'tflite': '.tflite', 'onnx': '.onnx', 'numpy': '.npz'}
+    for fmt in args.formats:
+        out_path = os.path.join(args.out_dir, stem + extensions[fmt])
+        exporters[fmt](model, out_path)
+        print('%-6s -> %s (%.1f KB)' % (fmt, out_path, os.path.getsize(out_path) / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
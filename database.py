@@ -0,0 +1,281 @@
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from flask import current_app, g
+
+from metrics import TimedConnection, stage
+from migrations import migrate
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_POOL_TIMEOUT = 30
+
+# Applied to every connection. WAL lets readers run alongside the single
+# writer; synchronous=NORMAL is durable across application crashes in WAL
+# mode and only risks the last commits on power loss.
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,        # KiB, i.e. 16 MB of page cache
+    'mmap_size': 268435456,      # 256 MB
+    'busy_timeout': 5000,        # ms
+    'temp_store': 'MEMORY',
+}
+
+# Write-behind queue: how many statements / how long to gather per commit
+DEFAULT_WRITE_BATCH_SIZE = 64
+DEFAULT_WRITE_MAX_DELAY_MS = 0
+# Seconds execute() waits for a queued write to commit
+DEFAULT_WRITE_TIMEOUT = 30
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class WriteTimeout(Exception):
+    pass
+
+
+def connect(path, pragmas=None):
+    # Every statement run on the connection is timed on /metrics
+    conn = sqlite3.connect(path, check_same_thread=False, factory=TimedConnection)
+    conn.row_factory = sqlite3.Row
+    for name, value in (DEFAULT_PRAGMAS if pragmas is None else pragmas).items():
+        conn.execute('PRAGMA %s = %s' % (name, value))
+    return conn
+
+
+class ConnectionPool:
+    # Bounded pool of SQLite connections shared by the server's threads.
+    # max_size=0 disables pooling: every acquire opens a fresh connection
+    # and release closes it, which is how the app used to behave.
+    def __init__(self, path, max_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_POOL_TIMEOUT, pragmas=None):
+        self.path = path
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        return connect(self.path, self.pragmas)
+
+    def acquire(self):
+        if self.max_size == 0:
+            return self._connect()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.max_size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout('No database connection free after %ss' % self.timeout)
+
+    def release(self, conn):
+        if self.max_size == 0:
+            conn.close()
+            return
+        # Never hand an open transaction to the next request
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+class WriteBehindQueue:
+    # Single writer thread that coalesces bursts of INSERT/UPDATE statements
+    # from many request threads into one transaction (group commit). submit()
+    # returns a Future resolved with the statement's rowcount once committed.
+    # If the writer thread dies, every write it still holds fails and the
+    # next submit() starts a new one.
+    def __init__(self, path, pragmas=None, batch_size=DEFAULT_WRITE_BATCH_SIZE,
+                 max_delay_ms=DEFAULT_WRITE_MAX_DELAY_MS, timeout=DEFAULT_WRITE_TIMEOUT):
+        self.path = path
+        self.pragmas = pragmas
+        self.batch_size = batch_size
+        self.max_delay = max_delay_ms / 1000.0
+        self.timeout = timeout
+        self.transactions = 0
+        self.statements = 0
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def submit(self, sql, params=()):
+        future = Future()
+        # Queued under the lock so an exiting writer either fails it or is
+        # replaced by a new one, never leaves it behind
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._worker.start()
+            self._queue.put((sql, params, future))
+        return future
+
+    def execute(self, sql, params=()):
+        # Blocking helper: returns once the write is committed. On timeout
+        # the write stays queued and may still commit later.
+        try:
+            return self.submit(sql, params).result(self.timeout)
+        except FutureTimeout:
+            raise WriteTimeout('Write not committed after %ss' % self.timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        conn = None
+        try:
+            while True:
+                if conn is None:
+                    conn = connect(self.path, self.pragmas)
+                    conn.isolation_level = None
+                batch = self._collect()
+                try:
+                    self._write(conn, batch)
+                except Exception as e:
+                    # The connection itself failed (e.g. a ROLLBACK raised):
+                    # fail what is left of the batch and start over on a new one
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                    conn = None
+        except BaseException as e:
+            # Could not connect: fail everything still queued
+            with self._lock:
+                self._worker = None
+                while True:
+                    try:
+                        _, _, future = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    future.set_exception(e)
+            raise
+
+    def _write(self, conn, batch):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            rowcounts = [conn.execute(sql, params).rowcount for sql, params, _ in batch]
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            # Replay one by one so a single bad statement only fails its own caller
+            for sql, params, future in batch:
+                try:
+                    conn.execute('BEGIN IMMEDIATE')
+                    rowcount = conn.execute(sql, params).rowcount
+                    conn.execute('COMMIT')
+                except Exception as e:
+                    if conn.in_transaction:
+                        conn.execute('ROLLBACK')
+                    future.set_exception(e)
+                else:
+                    future.set_result(rowcount)
+                self.transactions += 1
+                self.statements += 1
+            return
+        self.transactions += 1
+        self.statements += len(batch)
+        for (_, _, future), rowcount in zip(batch, rowcounts):
+            future.set_result(rowcount)
+
+def get_pool(app):
+    return app.extensions['db_pool']
+
+
+def get_db():
+    # Connection for the current request, taken from the pool on first use
+    # and returned by close_db() when the app context ends
+    if 'db' not in g:
+        g.db = get_pool(current_app).acquire()
+    return g.db
+
+
+def close_db(e=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool(current_app).release(conn)
+
+
+def detach_db():
+    # Hand the request's connection to the caller instead of returning it to
+    # the pool at teardown, e.g. while a streamed response is still reading
+    # from one of its cursors. Give it back with get_pool(app).release(conn).
+    return g.pop('db', None)
+
+
+def execute_write(sql, params=()):
+    # Queue a write through the app's write-behind queue and wait for its commit
+    with stage('db_write'):
+        return current_app.extensions['db_writer'].execute(sql, params)
+
+
+def submit_write(sql, params=()):
+    # Queue a write without waiting for it; returns the Future of its rowcount
+    return current_app.extensions['db_writer'].submit(sql, params)
+
+
+def init_app(app):
+    app.config.setdefault('DATABASE', 'malaria_management.db')
+    app.config.setdefault('DB_POOL_SIZE', DEFAULT_POOL_SIZE)
+    app.config.setdefault('DB_POOL_TIMEOUT', DEFAULT_POOL_TIMEOUT)
+    app.config.setdefault('DB_PRAGMAS', DEFAULT_PRAGMAS)
+    app.config.setdefault('DB_WRITE_BATCH_SIZE', DEFAULT_WRITE_BATCH_SIZE)
+    app.config.setdefault('DB_WRITE_MAX_DELAY_MS', DEFAULT_WRITE_MAX_DELAY_MS)
+    app.config.setdefault('DB_WRITE_TIMEOUT', DEFAULT_WRITE_TIMEOUT)
+    # Bring the schema up to date before serving anything
+    conn = connect(app.config['DATABASE'], app.config['DB_PRAGMAS'])
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
+    app.extensions['db_pool'] = ConnectionPool(app.config['DATABASE'],
+                                               max_size=app.config['DB_POOL_SIZE'],
+                                               timeout=app.config['DB_POOL_TIMEOUT'],
+                                               pragmas=app.config['DB_PRAGMAS'])
+    app.extensions['db_writer'] = WriteBehindQueue(app.config['DATABASE'],
+                                                   pragmas=app.config['DB_PRAGMAS'],
+                                                   batch_size=app.config['DB_WRITE_BATCH_SIZE'],
+                                                   max_delay_ms=app.config['DB_WRITE_MAX_DELAY_MS'],
+                                                   timeout=app.config['DB_WRITE_TIMEOUT'])
+    app.teardown_appcontext(close_db)
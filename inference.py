@@ -0,0 +1,199 @@
+import threading
+import time
+import queue
+from concurrent.futures import Future
+
+import numpy as np
+
+# Default micro-batching settings, overridable through app.config
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT_MS = 5
+
+# Histogram bucket upper bounds
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+WAIT_MS_BUCKETS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250)
+
+
+class Histogram:
+    # Simple cumulative-bucket histogram, safe to update from several threads
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            else:
+                self.counts[-1] += 1
+            self.total += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            labels = [str(b) for b in self.buckets] + ['+Inf']
+            return {
+                'buckets': dict(zip(labels, self.counts)),
+                'count': self.total,
+                'sum': self.sum,
+                'mean': self.sum / self.total if self.total else 0.0,
+            }
+
+
+class InferenceEngine:
+    # Collects single preprocessed cells from many request threads into
+    # micro-batches and runs one forward pass per batch.
+    #
+    # With versioned=True, predict_fn returns (predictions, model_version)
+    # (e.g. LazyModel.predict_versioned), where model_version may also be a
+    # list with one version per row, and the *_versioned methods report
+    # which model version produced each row, even across a hot swap.
+    #
+    # `concurrency` batching threads each collect and run their own batch;
+    # more than one only helps when predict_fn runs outside this process's
+    # GIL, e.g. on an inference_pool.InferencePool.
+    def __init__(self, predict_fn, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS,
+                 cache=None, versioned=False, concurrency=1):
+        self.predict_fn = predict_fn
+        self.versioned = versioned
+        self.cache = cache
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.concurrency = concurrency
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_wait_ms = Histogram(WAIT_MS_BUCKETS)
+        self._queue = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._collect_lock = threading.Lock()
+
+    def _ensure_worker(self):
+        # Start the batching threads on first use
+        with self._lock:
+            self._workers = [w for w in self._workers if w.is_alive()]
+            while len(self._workers) < self.concurrency:
+                worker = threading.Thread(target=self._run, name='inference-engine', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, cell):
+        # Queue one preprocessed cell (50x50x3) and get a Future for its
+        # (prediction row, model version)
+        future = Future()
+        cell = np.asarray(cell, dtype=np.float32)
+        if self.cache is not None:
+            cached = self.cache.lookup(cell)
+            if cached is not None:
+                future.set_result(cached)
+                return future
+        self._ensure_worker()
+        self._queue.put((cell, future, time.perf_counter()))
+        return future
+
+    def predict(self, cell, timeout=None):
+        # Blocking helper used by the Flask routes
+        return self.submit(cell).result(timeout=timeout)[0]
+
+    def predict_versioned(self, cell, timeout=None):
+        # (prediction row, model version)
+        return self.submit(cell).result(timeout=timeout)
+
+    def predict_many(self, cells):
+        # Submit a whole list at once so it is spread over as few batches as possible
+        futures = [self.submit(cell) for cell in cells]
+        return [f.result()[0] for f in futures]
+
+    def predict_batch(self, cells):
+        # Run an already-formed batch (N x 50 x 50 x 3) in one forward pass,
+        # bypassing the queue. Used by bulk callers such as the slide scan.
+        return self.predict_batch_versioned(cells)[0]
+
+    def predict_batch_versioned(self, cells):
+        # predict_batch plus the model version of every row
+        cells = np.asarray(cells, dtype=np.float32)
+        if self.cache is None:
+            self.batch_sizes.observe(len(cells))
+            return self._call(cells)
+
+        # Only run the cells the cache has not seen
+        cached = [self.cache.lookup(cell) for cell in cells]
+        missing = [i for i, found in enumerate(cached) if found is None]
+        if missing:
+            self.batch_sizes.observe(len(missing))
+            predictions, versions = self._call(cells[missing])
+            for i, prediction, version in zip(missing, predictions, versions):
+                self.cache.put(cells[i], prediction, model_version=version)
+                cached[i] = (prediction, version)
+        return np.stack([prediction for prediction, _ in cached]), [version for _, version in cached]
+
+    def _call(self, inputs):
+        # One forward pass -> (predictions, model version of each row)
+        if self.versioned:
+            predictions, version = self.predict_fn(inputs)
+        else:
+            version = self.cache.model_version if self.cache is not None else None
+            predictions = self.predict_fn(inputs)
+        versions = version if isinstance(version, list) else [version] * len(inputs)
+        return np.asarray(predictions), versions
+
+    def set_predict_fn(self, predict_fn, model_version=None):
+        # Swap in a reloaded model; its cache entries start from scratch
+        self.predict_fn = predict_fn
+        if self.cache is not None and model_version is not None:
+            self.cache.set_model_version(model_version)
+
+    def _collect(self):
+        # Block for the first item, then keep filling the batch until it is
+        # full or the max wait since the first item has elapsed. With several
+        # batching threads only one fills a batch at a time.
+        with self._collect_lock:
+            return self._fill([self._queue.get()])
+
+    def _fill(self, batch):
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                self.queue_wait_ms.observe((started - enqueued) * 1000.0)
+            self.batch_sizes.observe(len(batch))
+
+            try:
+                inputs = np.stack([cell for cell, _, _ in batch])
+                predictions, versions = self._call(inputs)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for i, (cell, future, _) in enumerate(batch):
+                if self.cache is not None:
+                    self.cache.put(cell, predictions[i], model_version=versions[i])
+                future.set_result((predictions[i], versions[i]))
+
+    def stats(self):
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'concurrency': self.concurrency,
+            'queue_depth': self._queue.qsize(),
+            'batch_size': self.batch_sizes.snapshot(),
+            'queue_wait_ms': self.queue_wait_ms.snapshot(),
+            'cache': self.cache.stats() if self.cache is not None else None,
+        }
@@ -0,0 +1,306 @@
+# Pool of inference server processes, one model replica each, fed through
+# shared memory. Keeps model.predict off the Flask process's GIL and cores.
+#
+# The client (the Flask process) owns one shared-memory block holding a
+# ring of slots; a slot is an input batch (capacity x 50 x 50 x 3 float32)
+# plus its output rows. predict_versioned() takes a free slot, copies the
+# preprocessed batch into it and sends only (slot, rows) down the least
+# busy worker's pipe; the worker predicts straight from the shared input,
+# writes the probabilities back into the slot and replies with the model
+# version. No arrays are pickled.
+#
+# Workers are started with the spawn method (a fork of a threaded web
+# process is not safe), load and warm up the model themselves and follow
+# MODEL_REGISTRY activations like the app does. A worker that dies fails
+# the batches it held and is restarted. Run one replica per core; set
+# OMP_NUM_THREADS=1 (or the runtime's equivalent) so they don't
+# oversubscribe the cores between them.
+import atexit
+import importlib.util
+import multiprocessing
+import sys
+import threading
+import time
+import queue
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+import numpy as np
+
+from calibration import CLASS_NAMES
+from inference import Histogram, WAIT_MS_BUCKETS
+from preprocess import CELL_SHAPE
+
+DEFAULT_SLOT_CAPACITY = 64
+
+# Slots per worker: one being predicted, one being filled
+DEFAULT_SLOTS_PER_WORKER = 2
+
+# How often the collector checks for dead workers when no replies arrive
+MONITOR_INTERVAL = 1.0
+
+
+def _slot_arrays(buf, slots, capacity, outputs):
+    # (inputs, outputs) views over the shared block
+    inputs = np.ndarray((slots, capacity) + CELL_SHAPE, dtype=np.float32, buffer=buf)
+    out = np.ndarray((slots, capacity, outputs), dtype=np.float32, buffer=buf, offset=inputs.nbytes)
+    return inputs, out
+
+
+def _serve(conn, shm_name, slots, capacity, outputs, path, backend, version, registry_root, poll):
+    # Worker process: load the model, then answer predict / reload messages
+    from model_loader import LazyModel
+    from model_registry import ModelRegistry, RegistryWatcher
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    inputs, out = _slot_arrays(shm.buf, slots, capacity, outputs)
+    model = LazyModel(path, backend=backend, version=version)
+    if registry_root:
+        RegistryWatcher(ModelRegistry(registry_root), model, poll).start()
+    try:
+        model.warm_up()
+        conn.send(('version', model.version, None))
+    except Exception as e:
+        conn.send(('version', None, '%s: %s' % (type(e).__name__, e)))
+    try:
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                break
+            if message is None:
+                break
+            if message[0] == 'reload':
+                try:
+                    model.reload()
+                    conn.send(('version', model.version, None))
+                except Exception as e:
+                    conn.send(('version', model.version, '%s: %s' % (type(e).__name__, e)))
+                continue
+            _, slot, n = message
+            try:
+                predictions, model_version = model.predict_versioned(inputs[slot, :n])
+                out[slot, :n] = predictions
+                conn.send(('done', slot, model_version, None))
+            except Exception as e:
+                conn.send(('done', slot, None, '%s: %s' % (type(e).__name__, e)))
+    finally:
+        del inputs, out
+        shm.close()
+
+
+def _start_without_main(process):
+    # A spawned process first re-runs the parent's __main__ script, i.e.
+    # all of app.py's start-up under `python app.py`. Present this module
+    # as __main__ while starting a worker, so the worker only imports
+    # inference_pool and the model code.
+    if __name__ == '__main__':
+        process.start()
+        return
+    main = sys.modules['__main__']
+    spec = getattr(main, '__spec__', None)
+    main.__spec__ = importlib.util.find_spec(__name__)
+    try:
+        process.start()
+    finally:
+        main.__spec__ = spec
+
+
+class InferencePool:
+    # Thin client for the worker pool. predict_versioned has the same
+    # signature as LazyModel.predict_versioned, so it drops into
+    # InferenceEngine; give the engine one dispatch thread per worker so
+    # every replica has a batch to work on. on_version(version) runs
+    # whenever the version the pool serves changes.
+    def __init__(self, path, backend='keras', version=None, workers=1, registry_root=None, poll=5.0,
+                 capacity=DEFAULT_SLOT_CAPACITY, slots=None, outputs=len(CLASS_NAMES), on_version=None):
+        self.path = path
+        self.backend = backend
+        self.version = version
+        self.workers = workers
+        self.registry_root = registry_root
+        self.poll = poll
+        self.capacity = capacity
+        self.slots = slots or workers * DEFAULT_SLOTS_PER_WORKER
+        self.outputs = outputs
+        self.on_version = on_version
+        self.slot_wait_ms = Histogram(WAIT_MS_BUCKETS)
+        self.batches = 0
+        self.restarts = 0
+        self.serving_version = None
+        self._context = multiprocessing.get_context('spawn')
+        self._shm = None
+        self._free = queue.Queue()
+        self._workers = []
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._started = False
+        self._closed = False
+
+    def start(self):
+        # Create the shared ring and start the workers; called on first use
+        with self._lock:
+            if self._started:
+                return self
+            inputs_bytes = self.slots * self.capacity * int(np.prod(CELL_SHAPE)) * 4
+            self._shm = shared_memory.SharedMemory(create=True,
+                                                   size=inputs_bytes + self.slots * self.capacity * self.outputs * 4)
+            self._inputs, self._outputs = _slot_arrays(self._shm.buf, self.slots, self.capacity, self.outputs)
+            for slot in range(self.slots):
+                self._free.put(slot)
+            self._workers = [self._spawn() for _ in range(self.workers)]
+            self._started = True
+        threading.Thread(target=self._collect, name='inference-pool', daemon=True).start()
+        atexit.register(self.close)
+        return self
+
+    def _spawn(self):
+        conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_serve, name='inference-worker', daemon=True,
+            args=(child_conn, self._shm.name, self.slots, self.capacity, self.outputs,
+                  self.path, self.backend, self.version, self.registry_root, self.poll))
+        _start_without_main(process)
+        child_conn.close()
+        return {'process': process, 'conn': conn, 'send_lock': threading.Lock(), 'in_flight': set(),
+                'version': None, 'error': None, 'batches': 0}
+
+    def predict(self, batch):
+        return self.predict_versioned(batch)[0]
+
+    def predict_versioned(self, batch):
+        # (predictions, model version). Batches over `capacity` rows are
+        # split over several slots, all sent to the same worker; if that
+        # worker swaps models between two chunks, the version is a list
+        # with one entry per row (InferenceEngine accepts either).
+        self.start()
+        batch = np.asarray(batch, dtype=np.float32)
+        if not len(batch):
+            raise ValueError('Empty batch')
+        with self._lock:
+            worker = min(self._workers, key=lambda w: len(w['in_flight']))
+        futures = [self._submit(batch[i:i + self.capacity], worker) for i in range(0, len(batch), self.capacity)]
+        results = [future.result() for future in futures]
+        predictions = np.concatenate([rows for rows, _ in results])
+        if len(set(version for _, version in results)) == 1:
+            return predictions, results[0][1]
+        return predictions, [version for rows, version in results for _ in range(len(rows))]
+
+    def _submit(self, chunk, worker):
+        # Copy one chunk into a free slot and hand it to `worker`
+        started = time.perf_counter()
+        slot = self._free.get()
+        self.slot_wait_ms.observe((time.perf_counter() - started) * 1000.0)
+        n = len(chunk)
+        self._inputs[slot, :n] = chunk
+        future = Future()
+        with self._lock:
+            if self._closed:
+                self._free.put(slot)
+                raise RuntimeError('The inference pool is closed')
+            worker['in_flight'].add(slot)
+            self._pending[slot] = (future, n, worker)
+        try:
+            with worker['send_lock']:
+                worker['conn'].send(('predict', slot, n))
+        except (OSError, ValueError) as e:
+            self._fail(worker, e)
+        return future
+
+    def _finish(self, worker, slot, version, error):
+        with self._lock:
+            entry = self._pending.pop(slot, None)
+            worker['in_flight'].discard(slot)
+        if entry is None:
+            return
+        future, n, _ = entry
+        if error is None:
+            future.set_result((self._outputs[slot, :n].copy(), version))
+        else:
+            future.set_exception(RuntimeError(error))
+        self._free.put(slot)
+
+    def _fail(self, worker, error):
+        # Fail every batch a dead worker held and give their slots back
+        for slot in list(worker['in_flight']):
+            self._finish(worker, slot, None, 'Inference worker exited: %s' % error)
+
+    def _seen(self, worker, version, error):
+        # The pool serves the version a worker last switched to, so a
+        # rollback to an earlier version is reported like any other swap;
+        # replies from workers still on an older version change nothing
+        previous = worker['version']
+        worker['version'], worker['error'] = version, error
+        if version is None or version == previous or version == self.serving_version:
+            return
+        self.serving_version = version
+        if self.on_version is not None:
+            self.on_version(version)
+
+    def _collect(self):
+        # Replies from every worker, plus restarting the ones that died
+        while not self._closed:
+            by_conn = {w['conn']: w for w in self._workers}
+            for conn in wait(list(by_conn), timeout=MONITOR_INTERVAL):
+                worker = by_conn[conn]
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    continue
+                if message[0] == 'done':
+                    worker['batches'] += 1
+                    self.batches += 1
+                    self._finish(worker, *message[1:])
+                    self._seen(worker, message[2], None)
+                else:
+                    self._seen(worker, message[1], message[2])
+            for i, worker in enumerate(self._workers):
+                if not worker['process'].is_alive() and not self._closed:
+                    self._fail(worker, 'exit code %s' % worker['process'].exitcode)
+                    worker['conn'].close()
+                    with self._lock:
+                        self._workers[i] = self._spawn()
+                    self.restarts += 1
+
+    def reload(self):
+        # Every worker reloads its artefact in place (load + warm up, then swap)
+        self.start()
+        for worker in self._workers:
+            with worker['send_lock']:
+                worker['conn'].send(('reload',))
+
+    def close(self):
+        with self._lock:
+            if self._closed or not self._started:
+                self._closed = True
+                return
+            self._closed = True
+        for worker in self._workers:
+            try:
+                with worker['send_lock']:
+                    worker['conn'].send(None)
+            except (OSError, ValueError):
+                pass
+        for worker in self._workers:
+            worker['process'].join(timeout=5)
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+            self._fail(worker, 'pool closed')
+        del self._inputs, self._outputs
+        self._shm.close()
+        self._shm.unlink()
+
+    def stats(self):
+        return {
+            'workers': [{'pid': w['process'].pid, 'alive': w['process'].is_alive(), 'version': w['version'],
+                         'error': w['error'], 'in_flight': len(w['in_flight']), 'batches': w['batches']}
+                        for w in self._workers],
+            'slots': self.slots,
+            'free_slots': self._free.qsize(),
+            'slot_capacity': self.capacity,
+            'serving_version': self.serving_version,
+            'batches': self.batches,
+            'restarts': self.restarts,
+            'slot_wait_ms': self.slot_wait_ms.snapshot(),
+        }
@@ -0,0 +1,182 @@
+# Durable job queue in a SQLite file, standing in for an external broker.
+#
+# The web process enqueues jobs (a kind, a JSON params dict and an
+# optional binary payload) and reads their status; worker processes claim
+# queued jobs in batches, run them and store a JSON result. A claim is a
+# lease: a job whose worker died is handed out again once the lease runs
+# out, up to max_attempts times. Every call opens its own short-lived
+# connection, so the queue object can be shared by threads and used on
+# both sides of a fork.
+import json
+import os
+import socket
+import sqlite3
+import time
+
+DEFAULT_QUEUE_DB = 'prediction_jobs.db'
+
+# Kind of the single-cell prediction jobs app.py enqueues and
+# prediction_worker.py runs
+JOB_KIND = 'predict'
+DEFAULT_LEASE_SECONDS = 60.0
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Finished jobs are kept this long for status polling, then purged
+DEFAULT_RETENTION_SECONDS = 24 * 3600
+
+STATUSES = ('queued', 'running', 'done', 'failed')
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        params TEXT,
+        payload BLOB,
+        result TEXT,
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        worker TEXT,
+        created REAL NOT NULL,
+        started REAL,
+        finished REAL,
+        lease_until REAL
+    )""",
+    # claim(): oldest queued job first
+    "CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created)",
+]
+
+JOB_COLUMNS = 'id, kind, status, params, result, error, attempts, worker, created, started, finished'
+
+
+def worker_name():
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+class JobQueue:
+    def __init__(self, path=DEFAULT_QUEUE_DB, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, timeout=30.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        with self._connect() as conn:
+            for sql in SCHEMA:
+                conn.execute(sql)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def enqueue(self, kind, params=None, payload=None, job_id=None):
+        job_id = job_id or os.urandom(8).hex()
+        conn = self._connect()
+        try:
+            conn.execute("INSERT INTO jobs (id, kind, params, payload, created) VALUES (?, ?, ?, ?, ?)",
+                         (job_id, kind, json.dumps(params or {}), payload, time.time()))
+        finally:
+            conn.close()
+        return job_id
+
+    def get(self, job_id):
+        # Status dict (without the payload), or None
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT %s FROM jobs WHERE id = ?' % JOB_COLUMNS, (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = self._job(row)
+            if job['status'] == 'queued':
+                job['position'] = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created < ?",
+                                               (job['created'],)).fetchone()[0]
+            return job
+        finally:
+            conn.close()
+
+    def _job(self, row):
+        job = dict(zip([c.strip() for c in JOB_COLUMNS.split(',')], row))
+        job['params'] = json.loads(job['params']) if job['params'] else {}
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def claim(self, limit=1, kinds=None, worker=None):
+        # Lease up to `limit` jobs, oldest first: queued ones, and running
+        # ones whose lease expired. Returns status dicts plus 'payload'.
+        now = time.time()
+        worker = worker or worker_name()
+        kind_filter = ''
+        params = [now]
+        if kinds:
+            kind_filter = ' AND kind IN (%s)' % ', '.join('?' for _ in kinds)
+            params += list(kinds)
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # Jobs whose lease ran out too often are failed instead of retried
+            conn.execute("""UPDATE jobs SET status = 'failed', finished = ?, payload = NULL,
+                                            error = COALESCE(error, 'worker lost')
+                             WHERE status = 'running' AND lease_until < ? AND attempts >= ?""",
+                         (now, now, self.max_attempts))
+            rows = conn.execute(
+                """SELECT %s, payload FROM jobs
+                    WHERE (status = 'queued' OR (status = 'running' AND lease_until < ?))%s
+                    ORDER BY created LIMIT ?""" % (JOB_COLUMNS, kind_filter), params + [limit]).fetchall()
+            conn.executemany("""UPDATE jobs SET status = 'running', worker = ?, started = ?, lease_until = ?,
+                                                attempts = attempts + 1 WHERE id = ?""",
+                             [(worker, now, now + self.lease_seconds, row[0]) for row in rows])
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        jobs = []
+        for row in rows:
+            job = self._job(row[:-1])
+            job['payload'] = row[-1]
+            job['status'] = 'running'
+            job['attempts'] += 1
+            jobs.append(job)
+        return jobs
+
+    def finish(self, results):
+        # Store results for a batch of claimed jobs in one transaction:
+        # [(job_id, result dict, error or None)]; the payload is dropped
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany("""UPDATE jobs SET status = ?, result = ?, error = ?, finished = ?, payload = NULL,
+                                                lease_until = NULL WHERE id = ? AND status = 'running'""",
+                             [('failed' if error else 'done', json.dumps(result) if result is not None else None,
+                               error, now, job_id) for job_id, result, error in results])
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def purge(self, retention=DEFAULT_RETENTION_SECONDS):
+        # Drop finished jobs older than `retention` seconds; returns how many
+        conn = self._connect()
+        try:
+            return conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished < ?",
+                                (time.time() - retention,)).rowcount
+        finally:
+            conn.close()
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+            oldest = conn.execute("SELECT MIN(created) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        finally:
+            conn.close()
+        stats = {status: counts.get(status, 0) for status in STATUSES}
+        stats['oldest_queued_seconds'] = time.time() - oldest if oldest is not None else None
+        return stats
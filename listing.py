@@ -0,0 +1,202 @@
+from flask import request
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+SEARCH_FIELDS = ('name', 'insurance', 'result')
+
+
+class Listing:
+    # One paginated listing: a base SELECT, the integer column the keyset
+    # seeks on, and the columns each search field filters on. When a join
+    # repeats the key (one row per joined row), tiebreak / tiebreak_name
+    # is a second integer expression / column making (key, tiebreak)
+    # unique; pages then seek on both. joined_column is a NOT NULL-able
+    # column of a LEFT JOINed table whose name / result columns are
+    # searched (see search_clause).
+    def __init__(self, select, key, key_name, name_columns, insurance_column, result_column,
+                 joined_column=None, tiebreak=None, tiebreak_name=None):
+        self.select = select
+        self.key = key
+        self.key_name = key_name
+        self.tiebreak = tiebreak
+        self.tiebreak_name = tiebreak_name
+        self.name_columns = name_columns
+        self.insurance_column = insurance_column
+        self.result_column = result_column
+        self.joined_column = joined_column
+
+
+# patient, patient2, patient3
+PATIENTS = Listing("SELECT * FROM patients",
+                   key='patientid', key_name='patientid',
+                   name_columns=('fname', 'lname'),
+                   insurance_column='insurance',
+                   result_column='Result')
+
+# patient1: every recommendation with its patient (columns as patients.*, reco.*).
+# A recommendation joins every patient with its insurance number, so rows
+# are keyed by (reco.UserID, patientid); 0 stands for "no patient" (patient
+# ids are rowids, assigned from 1).
+RECOMMENDATIONS = Listing("""SELECT patients.*, reco.* FROM reco
+                             LEFT JOIN patients ON patients.insurance = reco.insurance""",
+                          key='reco.UserID', key_name='UserID',
+                          name_columns=('patients.fname', 'patients.lname'),
+                          insurance_column='reco.insurance',
+                          result_column='patients.Result',
+                          joined_column='patients.insurance',
+                          tiebreak='IFNULL(patients.patientid, 0)', tiebreak_name='patientid')
+
+
+class Page:
+    # `rows` is a list for a normal page, or a lazily iterated cursor for a
+    # full export (all=True), which streaming.render_listing streams
+    def __init__(self, rows, page_size, next_after, prev_before, field, q, all=False):
+        self.rows = rows
+        self.page_size = page_size
+        self.next_after = next_after
+        self.prev_before = prev_before
+        self.field = field
+        self.q = q
+        self.all = all
+
+    @property
+    def next_arg(self):
+        # next_after / prev_before as the after= / before= query value
+        return format_key(self.next_after)
+
+    @property
+    def prev_arg(self):
+        return format_key(self.prev_before)
+
+    def materialize(self):
+        self.rows = list(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def format_key(value):
+    # Inverse of _key_arg: "12" or "12,5"
+    if value is None:
+        return None
+    return ','.join(str(v) for v in value) if isinstance(value, tuple) else str(value)
+
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_clause(listing, field, q):
+    # Every filter is served by an index from migrations.py: insurance is
+    # an equality seek, name and result are case-insensitive prefix matches
+    # ("Infected" also finds slide summaries, like the dashboard counts)
+    if not q or field not in SEARCH_FIELDS:
+        return [], []
+    if field == 'insurance':
+        return ['%s = ?' % listing.insurance_column], [q]
+    pattern = _escape_like(q) + '%'
+    if field == 'result':
+        where, params = ["%s LIKE ? ESCAPE '\\'" % listing.result_column], [pattern]
+    else:
+        clause = ' OR '.join("%s LIKE ? ESCAPE '\\'" % column for column in listing.name_columns)
+        where, params = ['(%s)' % clause], [pattern] * len(listing.name_columns)
+    if listing.joined_column:
+        # Rows without a joined row never match anyway; saying so lets SQLite
+        # treat the LEFT JOIN as an inner join and start from the searched
+        # table's index instead of scanning the outer one
+        where.insert(0, '%s IS NOT NULL' % listing.joined_column)
+    return where, params
+
+
+def _order_by(listing, direction='ASC'):
+    keys = (listing.key, listing.tiebreak) if listing.tiebreak else (listing.key,)
+    return ', '.join('%s %s' % (key, direction) for key in keys)
+
+
+def _seek(listing, op, value):
+    # WHERE clause past a page key: an int, or a (key, tiebreak) pair for
+    # listings with a tiebreak. A bare int there seeks past the whole key.
+    if listing.tiebreak and isinstance(value, tuple):
+        return '(%s, %s) %s (?, ?)' % (listing.key, listing.tiebreak, op), list(value)
+    return '%s %s ?' % (listing.key, op), [value[0] if isinstance(value, tuple) else value]
+
+
+def _page_key(listing, row):
+    if listing.tiebreak:
+        return row[listing.key_name], row[listing.tiebreak_name] or 0
+    return row[listing.key_name]
+
+
+def fetch_page(conn, listing, after=None, before=None, page_size=DEFAULT_PAGE_SIZE, field=None, q=None):
+    # Keyset (seek) pagination: the page after `after` or before `before`,
+    # ordered by the listing key. Cost depends on the page size, not on
+    # how deep into the table the page is.
+    page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+    where, params = search_clause(listing, field, q)
+
+    backwards = before is not None
+    if backwards or after is not None:
+        clause, values = _seek(listing, '<' if backwards else '>', before if backwards else after)
+        where.append(clause)
+        params.extend(values)
+
+    sql = listing.select
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY %s LIMIT ?' % _order_by(listing, 'DESC' if backwards else 'ASC')
+    params.append(page_size + 1)
+
+    rows = conn.execute(sql, params).fetchall()
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = after is not None, more
+
+    next_after = _page_key(listing, rows[-1]) if rows and has_next else None
+    prev_before = _page_key(listing, rows[0]) if rows and has_prev else None
+    return Page(rows, page_size, next_after, prev_before, field, q)
+
+
+def fetch_all(conn, listing, field=None, q=None):
+    # Unpaginated export in key order, left as an open cursor so rows are
+    # only read from SQLite as the template consumes them
+    where, params = search_clause(listing, field, q)
+    sql = listing.select
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY %s' % _order_by(listing)
+    return Page(conn.execute(sql, params), None, None, None, field, q, all=True)
+
+
+def _int_arg(name):
+    value = request.args.get(name, '')
+    return int(value) if value.lstrip('-').isdigit() else None
+
+
+def _key_arg(name):
+    # Page key from the query string: "12", or "12,5" for (key, tiebreak)
+    parts = request.args.get(name, '').split(',')
+    if not all(part.lstrip('-').isdigit() for part in parts) or len(parts) > 2:
+        return None
+    values = tuple(int(part) for part in parts)
+    return values if len(values) == 2 else values[0]
+
+
+def page_from_request(conn, listing):
+    # Read after / before / size / field / q from the query string;
+    # all=1 asks for the full unpaginated export instead
+    if request.args.get('all') == '1':
+        return fetch_all(conn, listing, field=request.args.get('field'), q=request.args.get('q', '').strip())
+    return fetch_page(conn, listing,
+                      after=_key_arg('after'),
+                      before=_key_arg('before'),
+                      page_size=_int_arg('size') or DEFAULT_PAGE_SIZE,
+                      field=request.args.get('field'),
+                      q=request.args.get('q', '').strip())
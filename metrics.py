@@ -0,0 +1,268 @@
+# In-process metrics in the Prometheus text format, served on /metrics.
+#
+# Counters and histograms are plain dicts of label values -> numbers
+# behind one lock per metric, so recording costs a perf_counter() pair, a
+# bisect and a dict update. Every web process keeps its own numbers; with
+# several processes, scrape each of them (Prometheus sums them up).
+#
+# What the app records:
+#   malaria_http_requests_total{route, method, status}
+#   malaria_http_request_duration_seconds{route}    until the response is returned
+#   malaria_stage_duration_seconds{stage}           upload, decode, resize, normalise,
+#                                                   predict, render, db_write
+#   malaria_predictions_total{route, result}
+#   malaria_db_query_duration_seconds{operation}    every execute on a database.connect() connection
+# plus the inference engine's batching and cache figures.
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, request, before_render_template, template_rendered
+
+# Seconds; covers a cached SELECT up to a slow slide scan
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = ['%s="%s"' % (name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s counter' % self.name]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append('%s%s %s' % (self.name, _labels(self.labelnames, labels), _number(value)))
+        return lines
+
+
+class Histogram:
+    # Prometheus histogram: per label set, a count per bucket (made
+    # cumulative on render), the sum and the count
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def time(self, *labels):
+        return Timer(self, labels)
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        with self._lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        for labels, (counts, total) in items:
+            lines.extend(histogram_lines(self.name, self.labelnames, labels, self.buckets, counts, total))
+        return lines
+
+
+def histogram_lines(name, labelnames, labels, buckets, counts, total):
+    # _bucket / _sum / _count lines from per-bucket (non-cumulative) counts,
+    # the last one being the +Inf overflow
+    lines = []
+    running = 0
+    for bound, count in zip(tuple(buckets) + (float('inf'),), counts):
+        running += count
+        lines.append('%s_bucket%s %d' % (name, _labels(labelnames, labels, 'le="%s"' % _number(bound)), running))
+    lines.append('%s_sum%s %s' % (name, _labels(labelnames, labels), _number(float(total))))
+    lines.append('%s_count%s %d' % (name, _labels(labelnames, labels), running))
+    return lines
+
+
+class Timer:
+    # Context manager observing the time spent in its block
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect):
+        # collect() returns more exposition lines, computed at scrape time
+        self.collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collect in self.collectors:
+            lines.extend(collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter('malaria_http_requests_total', 'HTTP requests handled',
+                            ('route', 'method', 'status'))
+REQUEST_SECONDS = REGISTRY.histogram('malaria_http_request_duration_seconds',
+                                     'Time from the start of a request until its response is returned',
+                                     ('route',))
+STAGE_SECONDS = REGISTRY.histogram('malaria_stage_duration_seconds', 'Time spent in each stage of a prediction',
+                                   ('stage',))
+PREDICTIONS = REGISTRY.counter('malaria_predictions_total', 'Predictions made, by route and result',
+                               ('route', 'result'))
+DB_QUERY_SECONDS = REGISTRY.histogram('malaria_db_query_duration_seconds', 'Time spent executing SQL statements',
+                                      ('operation',))
+
+
+def stage(name):
+    # with stage('decode'): ...
+    return Timer(STAGE_SECONDS, (name,))
+
+
+def sql_operation(sql):
+    # First keyword of a statement: SELECT, INSERT, UPDATE, PRAGMA, ...
+    words = sql.lstrip().split(None, 1)
+    return words[0].upper() if words else ''
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, sql_operation(sql))
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, sql_operation(sql))
+
+
+class TimedConnection(sqlite3.Connection):
+    # sqlite3.connect(factory=TimedConnection): every statement, through a
+    # cursor or the connection's execute shortcuts, lands in DB_QUERY_SECONDS
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def engine_collector(engine):
+    # Batching and cache figures of an inference.InferenceEngine
+    def collect():
+        stats = engine.stats()
+        lines = ['# HELP malaria_inference_queue_depth Cells waiting for a batch',
+                 '# TYPE malaria_inference_queue_depth gauge',
+                 'malaria_inference_queue_depth %d' % stats['queue_depth']]
+        for name, help, histogram in (
+                ('malaria_inference_batch_size', 'Cells per forward pass', engine.batch_sizes),
+                ('malaria_inference_queue_wait_milliseconds', 'Time cells waited for a batch', engine.queue_wait_ms)):
+            snapshot = histogram.snapshot()
+            lines += ['# HELP %s %s' % (name, help), '# TYPE %s histogram' % name]
+            lines += histogram_lines(name, (), (), histogram.buckets, list(snapshot['buckets'].values()),
+                                     snapshot['sum'])
+        cache = stats['cache']
+        if cache is not None:
+            lines += ['# HELP malaria_prediction_cache_lookups_total Prediction cache lookups',
+                      '# TYPE malaria_prediction_cache_lookups_total counter',
+                      'malaria_prediction_cache_lookups_total{outcome="hit"} %d' % cache['hits'],
+                      'malaria_prediction_cache_lookups_total{outcome="miss"} %d' % cache['misses']]
+        return lines
+    return collect
+
+
+def init_app(app):
+    # Request counters and durations, upload parsing and template render time
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+        # Parse multipart uploads here so their transfer and parsing are the upload stage
+        if request.mimetype == 'multipart/form-data':
+            with stage('upload'):
+                request.files
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('metrics_started', None)
+        route = request.endpoint or 'unmatched'
+        REQUESTS.inc(route, request.method, str(response.status_code))
+        if started is not None:
+            REQUEST_SECONDS.observe(time.perf_counter() - started, route)
+        return response
+
+    def render_started(sender, template, context, **extra):
+        g.metrics_render_started = time.perf_counter()
+
+    def render_finished(sender, template, context, **extra):
+        started = g.pop('metrics_render_started', None)
+        if started is not None:
+            STAGE_SECONDS.observe(time.perf_counter() - started, 'render')
+
+    before_render_template.connect(render_started, app, weak=False)
+    template_rendered.connect(render_finished, app, weak=False)
+
+
+def metrics_response(registry=REGISTRY):
+    return Response(registry.render(), content_type=CONTENT_TYPE)
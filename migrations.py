@@ -0,0 +1,260 @@
+# Versioned schema migrations for malaria_management.db.
+#
+# The applied version is kept in PRAGMA user_version. Each migration runs
+# in its own transaction and bumps the version, so a failed upgrade leaves
+# the database at the last good version. Append new migrations to the end
+# of MIGRATIONS; never edit one that has shipped.
+#
+# Usage: python migrations.py [path/to/database.db]
+import sqlite3
+import sys
+
+
+def _result_class(column):
+    # 'Infected' / 'Uninfected' for single-cell and slide-summary results
+    # ("Infected (22/150 cells infected, ...)"), NULL for anything else
+    return ("(CASE WHEN {0} LIKE 'Infected%' THEN 'Infected' "
+            "WHEN {0} LIKE 'Uninfected%' THEN 'Uninfected' END)").format(column)
+
+
+def _record_daily(column):
+    return """INSERT OR IGNORE INTO daily_results VALUES (date('now', 'localtime'), {0}, 0);
+            UPDATE daily_results SET n = n + 1
+             WHERE day = date('now', 'localtime') AND result = {0};""".format(_result_class(column))
+
+
+def _count_triggers(table):
+    return [
+        """CREATE TRIGGER IF NOT EXISTS {0}_count_insert AFTER INSERT ON {0} BEGIN
+            UPDATE table_counts SET n = n + 1 WHERE name = '{0}';
+        END""".format(table),
+        """CREATE TRIGGER IF NOT EXISTS {0}_count_delete AFTER DELETE ON {0} BEGIN
+            UPDATE table_counts SET n = n - 1 WHERE name = '{0}';
+        END""".format(table),
+    ]
+
+
+MIGRATIONS = [
+    (1, 'baseline schema', [
+        """CREATE TABLE IF NOT EXISTS patients (
+            patientid INTEGER PRIMARY KEY,
+            fname TEXT,
+            lname TEXT,
+            insurance TEXT,
+            phone TEXT,
+            Result TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS Doctors (
+            DoctorID INTEGER PRIMARY KEY,
+            fname TEXT,
+            lname TEXT,
+            insurance TEXT,
+            phone TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS office (
+            UserID INTEGER PRIMARY KEY AUTOINCREMENT,
+            fname TEXT NOT NULL,
+            lname TEXT NOT NULL,
+            insurance TEXT,
+            phone TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS Users (
+            UserID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Username TEXT NOT NULL,
+            Password TEXT NOT NULL,
+            UserType TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS lab (
+            UserID INTEGER PRIMARY KEY AUTOINCREMENT,
+            fname TEXT NOT NULL,
+            lname TEXT NOT NULL,
+            insurance TEXT,
+            phone TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS reco (
+            UserID INTEGER PRIMARY KEY AUTOINCREMENT,
+            insurance TEXT NOT NULL,
+            reco TEXT NOT NULL
+        )""",
+    ]),
+    (2, 'indexes for insurance joins/updates and case-insensitive login', [
+        # patient1 / print_patient1 join and addpatient3's UPDATE ... WHERE insurance = ?
+        "CREATE INDEX IF NOT EXISTS idx_patients_insurance ON patients(insurance)",
+        "CREATE INDEX IF NOT EXISTS idx_reco_insurance ON reco(insurance)",
+        # is_valid_user: WHERE Username = ? COLLATE NOCASE
+        "CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON Users(Username COLLATE NOCASE)",
+    ]),
+    (3, 'indexes for patient list search', [
+        # listing.search_clause: result equality and case-insensitive name prefix
+        "CREATE INDEX IF NOT EXISTS idx_patients_result ON patients(Result)",
+        "CREATE INDEX IF NOT EXISTS idx_patients_fname_nocase ON patients(fname COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_patients_lname_nocase ON patients(lname COLLATE NOCASE)",
+    ]),
+    (4, 'trigger-maintained dashboard counters', [
+        # Row counts per table, plus current patients per result class
+        # ('patients:Infected', 'patients:Uninfected'); read by stats.py
+        """CREATE TABLE IF NOT EXISTS table_counts (
+            name TEXT PRIMARY KEY,
+            n INTEGER NOT NULL
+        ) WITHOUT ROWID""",
+        # Results recorded per local day and class. patients has no date
+        # column, so history starts when this migration is applied.
+        """CREATE TABLE IF NOT EXISTS daily_results (
+            day TEXT NOT NULL,
+            result TEXT NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (day, result)
+        ) WITHOUT ROWID""",
+        "INSERT OR REPLACE INTO table_counts VALUES ('patients', (SELECT COUNT(*) FROM patients))",
+        "INSERT OR REPLACE INTO table_counts VALUES ('Doctors', (SELECT COUNT(*) FROM Doctors))",
+        "INSERT OR REPLACE INTO table_counts VALUES ('lab', (SELECT COUNT(*) FROM lab))",
+        "INSERT OR REPLACE INTO table_counts VALUES ('office', (SELECT COUNT(*) FROM office))",
+        "INSERT OR REPLACE INTO table_counts VALUES ('patients:Infected', 0)",
+        "INSERT OR REPLACE INTO table_counts VALUES ('patients:Uninfected', 0)",
+        """UPDATE table_counts SET n = (SELECT COUNT(*) FROM patients
+                                       WHERE %s = substr(table_counts.name, 10))
+           WHERE name LIKE 'patients:%%'""" % _result_class('Result'),
+    ] + _count_triggers('Doctors') + _count_triggers('lab') + _count_triggers('office') + [
+        """CREATE TRIGGER IF NOT EXISTS patients_count_insert AFTER INSERT ON patients BEGIN
+            UPDATE table_counts SET n = n + 1 WHERE name = 'patients';
+            UPDATE table_counts SET n = n + 1 WHERE name = 'patients:' || %s;
+        END""" % _result_class('NEW.Result'),
+        """CREATE TRIGGER IF NOT EXISTS patients_count_delete AFTER DELETE ON patients BEGIN
+            UPDATE table_counts SET n = n - 1 WHERE name = 'patients';
+            UPDATE table_counts SET n = n - 1 WHERE name = 'patients:' || %s;
+        END""" % _result_class('OLD.Result'),
+        """CREATE TRIGGER IF NOT EXISTS patients_count_update AFTER UPDATE OF Result ON patients
+           WHEN NEW.Result IS NOT OLD.Result BEGIN
+            UPDATE table_counts SET n = n - 1 WHERE name = 'patients:' || %s;
+            UPDATE table_counts SET n = n + 1 WHERE name = 'patients:' || %s;
+        END""" % (_result_class('OLD.Result'), _result_class('NEW.Result')),
+        """CREATE TRIGGER IF NOT EXISTS patients_daily_insert AFTER INSERT ON patients
+           WHEN %s IS NOT NULL BEGIN
+            %s
+        END""" % (_result_class('NEW.Result'), _record_daily('NEW.Result')),
+        """CREATE TRIGGER IF NOT EXISTS patients_daily_update AFTER UPDATE OF Result ON patients
+           WHEN NEW.Result IS NOT OLD.Result AND %s IS NOT NULL BEGIN
+            %s
+        END""" % (_result_class('NEW.Result'), _record_daily('NEW.Result')),
+    ]),
+    (5, 'registration and result dates for bulk export', [
+        # Side table rather than new patients columns: patient1.html and
+        # the print routes read patients.*, reco.* by position. Rows that
+        # predate this migration have no dates.
+        """CREATE TABLE IF NOT EXISTS patient_dates (
+            patientid INTEGER PRIMARY KEY,
+            registered TEXT,
+            result_date TEXT
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_patient_dates_result_date ON patient_dates(result_date)",
+        """CREATE TRIGGER IF NOT EXISTS patients_dates_insert AFTER INSERT ON patients BEGIN
+            INSERT OR REPLACE INTO patient_dates VALUES (
+                NEW.patientid, date('now', 'localtime'),
+                CASE WHEN NEW.Result <> '' THEN date('now', 'localtime') END);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS patients_dates_update AFTER UPDATE OF Result ON patients
+           WHEN NEW.Result IS NOT OLD.Result BEGIN
+            INSERT OR IGNORE INTO patient_dates (patientid) VALUES (NEW.patientid);
+            UPDATE patient_dates SET result_date = date('now', 'localtime') WHERE patientid = NEW.patientid;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS patients_dates_delete AFTER DELETE ON patients BEGIN
+            DELETE FROM patient_dates WHERE patientid = OLD.patientid;
+        END""",
+    ]),
+    (6, 'stored prediction scores for threshold sweeps and ROC', [
+        # One row per single-cell prediction (prediction_log.py). p_infected
+        # is the raw model output for Parasitized, score the calibrated
+        # value `result` was decided on. insurance is filled in when the
+        # result is saved against a patient; label holds a confirmed
+        # diagnosis (1 infected, 0 uninfected) when one is recorded.
+        """CREATE TABLE IF NOT EXISTS predictions (
+            predictionid TEXT PRIMARY KEY,
+            created TEXT NOT NULL DEFAULT (datetime('now', 'localtime')),
+            route TEXT,
+            model_version TEXT,
+            p_infected REAL,
+            score REAL,
+            threshold REAL,
+            calibration TEXT,
+            result TEXT,
+            tta_variants INTEGER,
+            tta_variance REAL,
+            insurance TEXT,
+            label INTEGER CHECK (label IN (0, 1))
+        ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS idx_predictions_model_score ON predictions(model_version, score)",
+        "CREATE INDEX IF NOT EXISTS idx_predictions_insurance ON predictions(insurance)",
+    ]),
+    (7, 'case-insensitive result index for prefix search', [
+        # listing.search_clause matches results by prefix ("Infected" finds
+        # slide summaries too); LIKE can only seek a NOCASE index
+        "DROP INDEX IF EXISTS idx_patients_result",
+        "CREATE INDEX IF NOT EXISTS idx_patients_result_nocase ON patients(Result COLLATE NOCASE)",
+    ]),
+    (8, 'result dates only for actual results', [
+        # Migration 5 dated any non-empty Result, including the 'No results'
+        # placeholder. Only Infected / Uninfected results get a date now.
+        "DROP TRIGGER IF EXISTS patients_dates_insert",
+        "DROP TRIGGER IF EXISTS patients_dates_update",
+        """CREATE TRIGGER patients_dates_insert AFTER INSERT ON patients BEGIN
+            INSERT OR REPLACE INTO patient_dates VALUES (
+                NEW.patientid, date('now', 'localtime'),
+                CASE WHEN %s IS NOT NULL THEN date('now', 'localtime') END);
+        END""" % _result_class('NEW.Result'),
+        """CREATE TRIGGER patients_dates_update AFTER UPDATE OF Result ON patients
+           WHEN NEW.Result IS NOT OLD.Result BEGIN
+            INSERT OR IGNORE INTO patient_dates (patientid) VALUES (NEW.patientid);
+            UPDATE patient_dates
+               SET result_date = CASE WHEN %s IS NOT NULL THEN date('now', 'localtime') END
+             WHERE patientid = NEW.patientid;
+        END""" % _result_class('NEW.Result'),
+        """UPDATE patient_dates SET result_date = NULL
+            WHERE patientid IN (SELECT patientid FROM patients WHERE %s IS NULL)""" % _result_class('Result'),
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, target=LATEST_VERSION):
+    # Apply every pending migration up to `target`; returns the versions applied
+    applied = []
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        for version, description, statements in MIGRATIONS:
+            if version <= current_version(conn) or version > target:
+                continue
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for sql in statements:
+                    conn.execute(sql)
+                conn.execute('PRAGMA user_version = %d' % version)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            applied.append(version)
+    finally:
+        conn.isolation_level = isolation_level
+    return applied
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else 'malaria_management.db'
+    conn = sqlite3.connect(path)
+    before = current_version(conn)
+    applied = migrate(conn)
+    conn.close()
+    if applied:
+        print('%s: migrated from version %d to %d' % (path, before, applied[-1]))
+    else:
+        print('%s: already at version %d' % (path, before))
+
+
+if __name__ == '__main__':
+    main()
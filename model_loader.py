@@ -0,0 +1,105 @@
+import hashlib
+import threading
+
+import numpy as np
+
+from backends import load_backend
+from preprocess import CELL_SHAPE
+
+
+def model_version_for(path):
+    # Content hash of a model artefact, so retraining in place changes the version
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(block)
+    return hasher.hexdigest()[:16]
+
+
+class LazyModel:
+    # Model that is only imported and loaded on first use (or by an
+    # explicit warm_up()), so routes that never predict don't pay for
+    # TensorFlow or any other runtime. `backend` is one of the names in
+    # backends.BACKENDS. on_load(lazy_model) runs after every (re)load.
+    #
+    # The loaded model and its version are held as one (model, version)
+    # pair and replaced as a whole, so a swap to another artefact never
+    # blocks predictions and every prediction knows which version made it.
+    def __init__(self, path, backend='keras', on_load=None, version=None):
+        self.path = path
+        self.backend = backend
+        self.on_load = on_load
+        self.pinned_version = version
+        self.swapping = None
+        self._active = None
+        self._lock = threading.Lock()
+        self._swap_lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._active is not None
+
+    @property
+    def version(self):
+        active = self._active
+        return active[1] if active is not None else None
+
+    def _load(self, path, backend, version=None):
+        return load_backend(backend, path), version or model_version_for(path)
+
+    def get_active(self):
+        # (model, version), loading on first use
+        active = self._active
+        if active is None:
+            with self._lock:
+                if self._active is None:
+                    self._active = self._load(self.path, self.backend, self.pinned_version)
+                    if self.on_load is not None:
+                        self.on_load(self)
+                active = self._active
+        return active
+
+    def get(self):
+        return self.get_active()[0]
+
+    def predict(self, batch):
+        return self.get().predict(batch)
+
+    def predict_versioned(self, batch):
+        # (predictions, version of the model that produced them)
+        model, version = self.get_active()
+        return model.predict(batch), version
+
+    def warm_up(self):
+        # Load the model and run one dummy batch so the first real request
+        # doesn't pay for graph tracing either
+        self.predict(np.zeros((1,) + CELL_SHAPE, dtype=np.float32))
+
+    def swap_to(self, path, backend=None, version=None):
+        # Load and warm up another artefact while the current one keeps
+        # serving, then switch to it in a single assignment. Requests that
+        # already hold the old model finish on it. One swap at a time.
+        backend = backend or self.backend
+        with self._swap_lock:
+            self.swapping = version or path
+            try:
+                model, version = self._load(path, backend, version)
+                model.predict(np.zeros((1,) + CELL_SHAPE, dtype=np.float32))
+                with self._lock:
+                    self.path, self.backend, self.pinned_version = path, backend, version
+                    self._active = (model, version)
+            finally:
+                self.swapping = None
+        if self.on_load is not None:
+            self.on_load(self)
+        return version
+
+    def swap_in_background(self, path, backend=None, version=None):
+        thread = threading.Thread(target=self.swap_to, args=(path, backend, version),
+                                  name='model-swap', daemon=True)
+        thread.start()
+        return thread
+
+    def reload(self):
+        # Load the artefact at self.path again and swap it in
+        return self.swap_to(self.path, self.backend, self.pinned_version)
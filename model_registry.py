@@ -0,0 +1,164 @@
+# Versioned model registry on disk, and the watcher that hot-swaps the
+# serving model when the active version changes.
+#
+# Usage:
+#   python model_registry.py publish models/my_model.h5 --backend keras --note "retrained May"
+#   python model_registry.py publish models/my_model_int8.tflite --backend tflite --activate
+#   python model_registry.py list
+#   python model_registry.py activate 20240501-101500-3f2a9c1d
+#
+# Layout:
+#   <root>/<version>/model.<ext>       the artefact, never modified once published
+#   <root>/<version>/metadata.json     version, backend, file, sha256, created, ...
+#   <root>/CURRENT                     the active version, replaced atomically
+#
+# Every app process started with MODEL_REGISTRY=<root> serves CURRENT and
+# polls it; activating a version rolls it out to all workers without a
+# restart (see LazyModel.swap_to).
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from backends import BACKENDS
+from model_loader import model_version_for
+
+DEFAULT_REGISTRY = 'models/registry'
+DEFAULT_POLL_SECONDS = 5.0
+
+
+class ModelRegistry:
+    def __init__(self, root=DEFAULT_REGISTRY):
+        self.root = root
+
+    def versions(self):
+        # Oldest first; version names start with the publish time
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.exists(os.path.join(self.root, name, 'metadata.json')))
+
+    def metadata(self, version):
+        with open(os.path.join(self.root, version, 'metadata.json')) as f:
+            return json.load(f)
+
+    def artefact(self, version):
+        # (path, backend) of a published version
+        meta = self.metadata(version)
+        return os.path.join(self.root, version, meta['file']), meta['backend']
+
+    def current(self):
+        try:
+            with open(os.path.join(self.root, 'CURRENT')) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def publish(self, path, backend, metadata=None, activate=False):
+        # Copy an artefact in under a new version directory. The directory
+        # only appears (renamed into place) once it is complete.
+        if backend not in BACKENDS:
+            raise ValueError('Unknown model backend %r, expected one of %s' % (backend, ', '.join(sorted(BACKENDS))))
+        sha = model_version_for(path)
+        version = '%s-%s' % (time.strftime('%Y%m%d-%H%M%S'), sha[:8])
+        os.makedirs(self.root, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix='.publish-', dir=self.root)
+        try:
+            filename = 'model' + os.path.splitext(path)[1]
+            shutil.copyfile(path, os.path.join(staging, filename))
+            meta = dict(metadata or {}, version=version, backend=backend, file=filename, sha256=sha,
+                        source=os.path.abspath(path), created=time.strftime('%Y-%m-%dT%H:%M:%S'))
+            with open(os.path.join(staging, 'metadata.json'), 'w') as f:
+                json.dump(meta, f, indent=2, sort_keys=True)
+            os.rename(staging, os.path.join(self.root, version))
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        if activate:
+            self.activate(version)
+        return version
+
+    def activate(self, version):
+        if version not in self.versions():
+            raise ValueError('No published model version %r in %s' % (version, self.root))
+        fd, tmp = tempfile.mkstemp(prefix='.CURRENT-', dir=self.root)
+        with os.fdopen(fd, 'w') as f:
+            f.write(version + '\n')
+        os.replace(tmp, os.path.join(self.root, 'CURRENT'))
+
+
+class RegistryWatcher:
+    # Background thread that follows the registry's CURRENT version and
+    # hot-swaps `model` (a LazyModel) to it. Loading and warm-up happen on
+    # this thread; requests keep using the old model until the switch.
+    def __init__(self, registry, model, interval=DEFAULT_POLL_SECONDS):
+        self.registry = registry
+        self.model = model
+        self.interval = interval
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self):
+        # One poll; returns the version swapped to, or None
+        version = self.registry.current()
+        if version is None or version == self.model.pinned_version:
+            return None
+        try:
+            path, backend = self.registry.artefact(version)
+            self.model.swap_to(path, backend, version)
+            self.last_error = None
+            return version
+        except Exception as e:
+            # Keep serving the old version; retried on the next poll
+            self.last_error = '%s: %s' % (version, e)
+            return None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='model-registry-watcher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Publish, list and activate versioned model artefacts')
+    parser.add_argument('--registry', default=os.environ.get('MODEL_REGISTRY', DEFAULT_REGISTRY))
+    commands = parser.add_subparsers(dest='command', required=True)
+    publish = commands.add_parser('publish')
+    publish.add_argument('path')
+    publish.add_argument('--backend', choices=sorted(BACKENDS), default='keras')
+    publish.add_argument('--note', default=None)
+    publish.add_argument('--activate', action='store_true')
+    commands.add_parser('list')
+    activate = commands.add_parser('activate')
+    activate.add_argument('version')
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.registry)
+    if args.command == 'publish':
+        version = registry.publish(args.path, args.backend, {'note': args.note} if args.note else None,
+                                   activate=args.activate)
+        print('%s%s' % (version, ' (active)' if args.activate else ''))
+    elif args.command == 'activate':
+        registry.activate(args.version)
+        print('%s is now active' % args.version)
+    else:
+        current = registry.current()
+        for version in registry.versions():
+            meta = registry.metadata(version)
+            print('%s %-28s %-7s %s' % ('*' if version == current else ' ', version, meta['backend'], meta.get('note', '')))
+
+
+if __name__ == '__main__':
+    main()
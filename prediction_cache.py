@@ -0,0 +1,125 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_MAX_ENTRIES = 4096
+
+
+def pixel_key(cell):
+    # Hash of the preprocessed pixels (float32, C order)
+    cell = np.ascontiguousarray(cell, dtype=np.float32)
+    return hashlib.blake2b(cell.tobytes(), digest_size=16).hexdigest()
+
+
+class PredictionCache:
+    # Two-tier prediction cache: a bounded in-process LRU in front of an
+    # optional SQLite file that survives restarts. Entries are keyed by
+    # pixel hash plus model version, so a reload never serves stale rows.
+    # Cached predictions are read-only arrays shared by every hit: a caller
+    # that wants to modify one must copy it first.
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, db_path=None, model_version=''):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.model_version = model_version
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if db_path:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS prediction_cache (
+                                  key TEXT PRIMARY KEY,
+                                  model_version TEXT NOT NULL,
+                                  prediction BLOB NOT NULL,
+                                  created REAL NOT NULL)""")
+            self._conn.commit()
+
+    def get(self, cell):
+        found = self.lookup(cell)
+        return found[0] if found is not None else None
+
+    def lookup(self, cell):
+        # (prediction, model version) for a hit, None for a miss
+        digest = pixel_key(cell)
+        with self._lock:
+            version = self.model_version
+            key = '%s:%s' % (version, digest)
+            prediction = self._entries.get(key)
+            if prediction is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return prediction, version
+
+            if self._conn is not None:
+                row = self._conn.execute("SELECT prediction FROM prediction_cache WHERE key = ?",
+                                         (key,)).fetchone()
+                if row is not None:
+                    prediction = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, prediction)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return prediction, version
+
+            self.misses += 1
+            return None
+
+    def put(self, cell, prediction, model_version=None):
+        # model_version is the version the prediction was computed with; a
+        # result that finishes after a reload is dropped instead of cached
+        digest = pixel_key(cell)
+        prediction = np.array(prediction, dtype=np.float32)
+        with self._lock:
+            if model_version is not None and model_version != self.model_version:
+                return
+            key = '%s:%s' % (self.model_version, digest)
+            self._remember(key, prediction)
+            if self._conn is not None:
+                self._conn.execute("INSERT OR REPLACE INTO prediction_cache VALUES (?, ?, ?, ?)",
+                                   (key, self.model_version, prediction.tobytes(), time.time()))
+                self._conn.commit()
+
+    def _remember(self, key, prediction):
+        prediction.setflags(write=False)
+        self._entries[key] = prediction
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def set_model_version(self, version):
+        # Called on model (re)load: drops every entry from other versions
+        with self._lock:
+            if version == self.model_version:
+                return
+            self.model_version = version
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM prediction_cache WHERE model_version != ?", (version,))
+                self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM prediction_cache")
+                self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'model_version': self.model_version,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'persistent': self._conn is not None,
+            }
@@ -0,0 +1,152 @@
+# Every single-cell prediction the app makes, stored in the predictions
+# table (migration 6) with its raw and calibrated scores, so a new decision
+# threshold or ROC analysis is a batch query instead of re-scoring images.
+#
+# Usage:
+#   python prediction_log.py roc [--db malaria_management.db] [--model-version V] [--column p_infected]
+#   python prediction_log.py sweep 0.3 0.4 0.5 0.6 [--model-version V]
+#
+# Ground truth is the row's `label` when one has been recorded
+# (POST /predictions/<id>/label), otherwise the Result saved for the
+# patient the prediction was attached to (matched by insurance number).
+# The latter is usually the model's own suggestion, so it measures
+# agreement with the saved diagnosis rather than accuracy.
+import argparse
+import os
+import sqlite3
+
+# Columns a sweep can score on: the calibrated score the result was
+# decided on, or the raw model probability (to try a new calibration)
+SCORE_COLUMNS = ('score', 'p_infected')
+
+# With async predictions (prediction_worker.py) the patient form can be
+# saved before the worker has stored the scores, so either side may create
+# the row: INSERT_SQL and ATTACH_PENDING_SQL are upserts
+INSERT_SQL = """INSERT INTO predictions (predictionid, route, model_version, p_infected, score, threshold,
+                                         calibration, result, tta_variants, tta_variance)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (predictionid) DO UPDATE SET
+                    route = excluded.route, model_version = excluded.model_version,
+                    p_infected = excluded.p_infected, score = excluded.score, threshold = excluded.threshold,
+                    calibration = excluded.calibration, result = excluded.result,
+                    tta_variants = excluded.tta_variants, tta_variance = excluded.tta_variance"""
+
+ATTACH_SQL = "UPDATE predictions SET insurance = ? WHERE predictionid = ?"
+
+# Only for ids of jobs still in the prediction queue, so a made-up
+# prediction_id from the patient form never creates a row
+ATTACH_PENDING_SQL = """INSERT INTO predictions (insurance, predictionid) VALUES (?, ?)
+                        ON CONFLICT (predictionid) DO UPDATE SET insurance = excluded.insurance"""
+
+LABEL_SQL = "UPDATE predictions SET label = ? WHERE predictionid = ?"
+
+# (score, infected) for every prediction with a known outcome
+LABELLED_SQL = """
+    SELECT {column} AS s, infected FROM (
+        SELECT p.{column}, COALESCE(p.label,
+            (SELECT CASE WHEN Result LIKE 'Infected%' THEN 1 WHEN Result LIKE 'Uninfected%' THEN 0 END
+               FROM patients WHERE insurance = p.insurance ORDER BY patientid DESC LIMIT 1)) AS infected
+          FROM predictions p
+         WHERE (:model_version IS NULL OR p.model_version = :model_version)
+    ) WHERE infected IS NOT NULL AND {column} IS NOT NULL"""
+
+# Infected / uninfected counts per distinct score, highest first. ROC
+# points and threshold sweeps are running sums over these rows.
+SCORE_COUNTS_SQL = """
+    SELECT s, SUM(infected), SUM(1 - infected) FROM ({labelled}) GROUP BY s ORDER BY s DESC"""
+
+
+def new_prediction_id():
+    return os.urandom(8).hex()
+
+
+def prediction_row(prediction_id, route, prediction):
+    # INSERT_SQL parameters for a calibration.prediction_result dict
+    tta = prediction.get('tta') or {}
+    return (prediction_id, route, prediction['model_version'], prediction['probabilities']['Parasitized'],
+            prediction['score'], prediction['threshold'], prediction['calibration'], prediction['result'],
+            tta.get('variants'), tta.get('variance'))
+
+
+def _labelled(column):
+    if column not in SCORE_COLUMNS:
+        raise ValueError('Unknown score column %r, expected one of %s' % (column, ', '.join(SCORE_COLUMNS)))
+    return LABELLED_SQL.format(column=column)
+
+
+def score_counts(conn, model_version=None, column='score'):
+    # [(score, infected, uninfected)], highest score first
+    return conn.execute(SCORE_COUNTS_SQL.format(labelled=_labelled(column)),
+                        {'model_version': model_version}).fetchall()
+
+
+def roc(conn, model_version=None, column='score'):
+    # {'points': [{threshold, tpr, fpr}], 'auc', 'positives', 'negatives'};
+    # a point's rates are for calling Infected above its threshold
+    counts = score_counts(conn, model_version, column)
+    positives = sum(pos for _, pos, _ in counts)
+    negatives = sum(neg for _, _, neg in counts)
+    if not positives or not negatives:
+        return {'points': [], 'auc': None, 'positives': positives, 'negatives': negatives}
+    points = []
+    tp = fp = 0
+    auc = 0.0
+    for s, pos, neg in counts:
+        points.append({'threshold': s, 'tpr': tp / positives, 'fpr': fp / negatives})
+        auc += neg * (tp + pos / 2.0)
+        tp += pos
+        fp += neg
+    points.append({'threshold': None, 'tpr': 1.0, 'fpr': 1.0})
+    return {'points': points, 'auc': auc / (positives * negatives), 'positives': positives, 'negatives': negatives}
+
+
+def sweep(conn, thresholds, model_version=None, column='score'):
+    # Confusion counts and rates at each threshold
+    counts = score_counts(conn, model_version, column)
+    positives = sum(pos for _, pos, _ in counts)
+    negatives = sum(neg for _, _, neg in counts)
+    results = []
+    for t in sorted(float(t) for t in thresholds):
+        tp = sum(pos for s, pos, _ in counts if s > t)
+        fp = sum(neg for s, _, neg in counts if s > t)
+        tn, fn = negatives - fp, positives - tp
+        results.append({
+            'threshold': t, 'tp': tp, 'fp': fp, 'tn': tn, 'fn': fn,
+            'sensitivity': tp / positives if positives else None,
+            'specificity': tn / negatives if negatives else None,
+            'precision': tp / (tp + fp) if tp + fp else None,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Threshold sweeps and ROC over stored predictions')
+    parser.add_argument('--db', default=os.environ.get('MALARIA_DB', 'malaria_management.db'))
+    parser.add_argument('--model-version', default=None)
+    parser.add_argument('--column', choices=SCORE_COLUMNS, default='score')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('roc')
+    sweep_parser = commands.add_parser('sweep')
+    sweep_parser.add_argument('thresholds', nargs='+', type=float)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    if args.command == 'roc':
+        curve = roc(conn, args.model_version, args.column)
+        print('%d infected, %d uninfected, AUC %s' % (
+            curve['positives'] or 0, curve['negatives'] or 0,
+            '%.4f' % curve['auc'] if curve['auc'] is not None else '-'))
+        for point in curve['points'][:-1]:
+            print('  > %.4f  tpr %.4f  fpr %.4f' % (point['threshold'], point['tpr'], point['fpr']))
+    else:
+        print('threshold     tp     fp     tn     fn  sensitivity  specificity')
+        for row in sweep(conn, args.thresholds, args.model_version, args.column):
+            print('%9.4f %6d %6d %6d %6d  %11s  %11s' % (
+                row['threshold'], row['tp'], row['fp'], row['tn'], row['fn'],
+                '%.4f' % row['sensitivity'] if row['sensitivity'] is not None else '-',
+                '%.4f' % row['specificity'] if row['specificity'] is not None else '-'))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+# Worker process pool for queued predictions (see job_queue.py and the
+# async mode of the prediction routes in app.py).
+#
+# Usage:
+#   python prediction_worker.py
+#   python prediction_worker.py --workers 4 --batch-size 32 --queue prediction_jobs.db
+#
+# Each worker process loads its own copy of the model, chosen from the
+# same environment as the app (MODEL_REGISTRY, or MODEL_BACKEND /
+# MODEL_VARIANT / MODEL_PATH, with CALIBRATION_PATH and PREDICT_THRESHOLD),
+# and follows registry activations. It claims up to --batch-size queued
+# uploads at a time, decodes them, scores the batch in one forward pass
+# (one per TTA setting present) and stores each result both on the job
+# and in the predictions table of MALARIA_DB. The parent process restarts
+# workers that die and purges old finished jobs.
+import argparse
+import os
+import signal
+import sys
+import time
+from multiprocessing import Process
+
+import numpy as np
+
+from backends import default_model_path
+from calibration import DEFAULT_THRESHOLD, Calibrations, prediction_result
+from database import connect
+from migrations import migrate
+from job_queue import DEFAULT_QUEUE_DB, DEFAULT_RETENTION_SECONDS, JOB_KIND, JobQueue, worker_name
+from model_loader import LazyModel
+from model_registry import DEFAULT_POLL_SECONDS, ModelRegistry, RegistryWatcher
+from prediction_log import INSERT_SQL, prediction_row
+from preprocess import CELL_SHAPE, preprocess_bytes
+from tta import predict_tta, tta_summary
+
+DEFAULT_BATCH_SIZE = 32
+
+# Idle workers check the queue this often
+DEFAULT_POLL_INTERVAL = 0.05
+
+PURGE_INTERVAL = 600
+
+
+def serving_model():
+    # (LazyModel, Calibrations) picked the way app.py picks them
+    registry_root = os.environ.get('MODEL_REGISTRY')
+    registry = ModelRegistry(registry_root) if registry_root else None
+    backend = os.environ.get('MODEL_BACKEND', 'keras')
+    path = os.environ.get('MODEL_PATH', default_model_path(backend, os.environ.get('MODEL_VARIANT', 'float32')))
+    version = None
+    if registry is not None and registry.current():
+        version = registry.current()
+        path, backend = registry.artefact(version)
+    calibrations = Calibrations(os.environ.get('CALIBRATION_PATH', 'models/calibration.json'), registry_root)
+    model = LazyModel(path, backend=backend, version=version, on_load=lambda m: calibrations.clear())
+    if registry is not None:
+        RegistryWatcher(registry, model, float(os.environ.get('MODEL_REGISTRY_POLL', DEFAULT_POLL_SECONDS))).start()
+    return model, calibrations
+
+
+def versioned_batch(model):
+    # predict_batch for tta.predict_tta: (predictions, version of each row)
+    def predict(batch):
+        predictions, version = model.predict_versioned(batch)
+        return predictions, [version] * len(batch)
+    return predict
+
+
+def run_batch(jobs, model, calibrations, threshold, buffer):
+    # [(job_id, result, error)] for a batch of claimed jobs
+    outcomes = {}
+    groups = {}
+    for i, job in enumerate(jobs):
+        try:
+            preprocess_bytes(job['payload'], out=buffer[i])
+        except Exception:
+            outcomes[job['id']] = (None, 'Unreadable image')
+            continue
+        groups.setdefault(job['params'].get('tta') or 0, []).append(i)
+
+    for variants, rows in groups.items():
+        try:
+            if variants:
+                mean, variance, versions = predict_tta(versioned_batch(model), buffer[rows], variants)
+                scored = [(mean[k], versions[k], tta_summary(mean[k], variance[k], variants))
+                          for k in range(len(rows))]
+            else:
+                predictions, version = model.predict_versioned(buffer[rows])
+                scored = [(prediction, version, None) for prediction in np.asarray(predictions)]
+        except Exception as e:
+            for i in rows:
+                outcomes[jobs[i]['id']] = (None, '%s: %s' % (type(e).__name__, e))
+            continue
+        for i, (probabilities, version, tta) in zip(rows, scored):
+            outcomes[jobs[i]['id']] = (
+                prediction_result(probabilities, version, calibrations.get(version), threshold, tta), None)
+    return [(job['id'],) + outcomes[job['id']] for job in jobs]
+
+
+def work(queue_path, database_path, batch_size, poll_interval):
+    # One worker process: claim, score, store, repeat
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    queue = JobQueue(queue_path)
+    model, calibrations = serving_model()
+    threshold = float(os.environ.get('PREDICT_THRESHOLD', DEFAULT_THRESHOLD))
+    conn = connect(database_path)
+    # The predictions table may not exist yet if the app has not run
+    migrate(conn)
+    buffer = np.empty((batch_size,) + CELL_SHAPE, dtype=np.float32)
+    name = worker_name()
+    while not stopping:
+        jobs = queue.claim(batch_size, kinds=(JOB_KIND,), worker=name)
+        if not jobs:
+            time.sleep(poll_interval)
+            continue
+        results = run_batch(jobs, model, calibrations, threshold, buffer)
+        # Scores go to the predictions table first: a job reported done
+        # always has its row there for the patient form to link to
+        rows = [prediction_row(job_id, job['params'].get('route'), dict(result, prediction_id=job_id))
+                for job, (job_id, result, _) in zip(jobs, results) if result is not None]
+        if rows:
+            with conn:
+                conn.executemany(INSERT_SQL, rows)
+        queue.finish(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run queued predictions on a pool of worker processes')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--queue', default=os.environ.get('PREDICTION_QUEUE_DB', DEFAULT_QUEUE_DB))
+    parser.add_argument('--db', default=os.environ.get('MALARIA_DB', 'malaria_management.db'))
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL)
+    parser.add_argument('--retention', type=float, default=DEFAULT_RETENTION_SECONDS,
+                        help='seconds finished jobs are kept for status polling')
+    args = parser.parse_args()
+
+    queue = JobQueue(args.queue)
+    worker_args = (args.queue, args.db, args.batch_size, args.poll_interval)
+    workers = []
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    signal.signal(signal.SIGINT, lambda *_: stopping.append(True))
+    print('%d prediction workers on %s' % (args.workers, args.queue))
+    last_purge = 0.0
+    while not stopping:
+        for worker in [w for w in workers if not w.is_alive()]:
+            worker.join()
+            workers.remove(worker)
+        while len(workers) < args.workers:
+            worker = Process(target=work, args=worker_args, name='prediction-worker', daemon=True)
+            worker.start()
+            workers.append(worker)
+        if time.time() - last_purge > PURGE_INTERVAL:
+            queue.purge(args.retention)
+            last_purge = time.time()
+        time.sleep(0.5)
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.join()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+import io
+import threading
+
+import numpy as np
+from PIL import Image
+
+from metrics import stage
+
+# Input size the CNN was trained on (see Notebook_Malaria_cell.ipynb)
+IMAGE_SIZE = (50, 50)
+CELL_SHAPE = IMAGE_SIZE + (3,)
+
+# uint8 -> float32 lookup table, identical to (x / 255.0).astype('float32')
+_SCALE_LUT = (np.arange(256) / 255.0).astype(np.float32)
+
+# One reusable output buffer per request thread
+_local = threading.local()
+
+
+def _thread_buffer():
+    buf = getattr(_local, 'buffer', None)
+    if buf is None:
+        buf = _local.buffer = np.empty(CELL_SHAPE, dtype=np.float32)
+    return buf
+
+
+def decode_image(data):
+    # Decode an image from raw bytes or a file-like stream without touching disk
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = io.BytesIO(data)
+    img = Image.open(data)
+    img.load()
+    return img
+
+
+def resize_cell(img):
+    # RGB conversion and resize to the CNN input size, as a 50x50x3 uint8
+    # array. Shared by serving and build_dataset.py so both see the same pixels.
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    if img.size != IMAGE_SIZE:
+        img = img.resize(IMAGE_SIZE)
+    return np.asarray(img, dtype=np.uint8)
+
+
+def scale_cells(cells, out=None):
+    # uint8 pixels (any shape) -> float32 in [0, 1], bit-identical to /255.0
+    return np.take(_SCALE_LUT, cells, out=out)
+
+
+def preprocess_image(img, out=None):
+    # resize_cell plus /255 normalisation written straight into `out` (a
+    # 50x50x3 float32 array). Matches the old
+    # np.array(img.resize((50, 50))) / 255.0 path for RGB images.
+    if out is None:
+        out = np.empty(CELL_SHAPE, dtype=np.float32)
+    return scale_cells(resize_cell(img), out=out)
+
+
+def preprocess_bytes(data, out=None):
+    return preprocess_image(decode_image(data), out=out)
+
+
+def preprocess_upload(file, out=None):
+    # Preprocess a werkzeug FileStorage from request.files. Without `out`
+    # the result lives in a per-thread buffer that is reused by the next
+    # call on the same thread, so copy it if it has to outlive the request.
+    # Each step is timed as a stage on /metrics.
+    if out is None:
+        out = _thread_buffer()
+    with stage('decode'):
+        img = decode_image(file.stream.read())
+    with stage('resize'):
+        pixels = resize_cell(img)
+    with stage('normalise'):
+        return scale_cells(pixels, out=out)
@@ -0,0 +1,266 @@
+# Opt-in request profiling, for pages that are only slow in production.
+#
+# ProfilingMiddleware wraps the app's WSGI callable. A request is profiled
+# when any of these holds:
+#   - it is picked at random with probability PROFILE_SAMPLE_RATE (0 = off),
+#   - it carries the PROFILE_HEADER header (X-Profile) set to PROFILE_TOKEN
+#     (header profiling is off while no token is configured),
+#   - an admin asked for the next N requests on /admin/profiles.
+# The profile runs on the thread serving the request and covers the whole
+# response, including a streamed body, but not work handed to other
+# threads (the inference engine, the DB writer) or processes.
+#
+# Profiles are stored in PROFILE_DIR with the route, status and latency:
+#   <id>.pstats             cProfile (PROFILER=cprofile, the default)
+#   <id>.speedscope.json    pyinstrument (PROFILER=pyinstrument), opens in speedscope.app
+#   <id>.json               metadata
+# Only the newest PROFILE_KEEP profiles are kept. Sampling settings and
+# admin toggles are per process.
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import tempfile
+import threading
+import time
+
+from werkzeug.exceptions import HTTPException
+
+DEFAULT_PROFILE_DIR = 'profiles'
+DEFAULT_PROFILE_KEEP = 200
+DEFAULT_PROFILE_HEADER = 'X-Profile'
+
+# Paths never profiled, so looking at profiles doesn't use up the admin's
+# "next N requests"
+DEFAULT_EXCLUDE = ('/admin/profiles', '/metrics')
+
+# Orders pstats_text accepts
+PSTATS_SORTS = ('cumulative', 'tottime', 'ncalls')
+
+
+class CProfileSession:
+    name = 'cprofile'
+    extension = '.pstats'
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def save(self, path):
+        self.profile.dump_stats(path)
+
+
+class PyinstrumentSession:
+    # Sampling profiler; pyinstrument is only imported when selected
+    name = 'pyinstrument'
+    extension = '.speedscope.json'
+
+    def __init__(self):
+        from pyinstrument import Profiler
+        self.profiler = Profiler(async_mode='disabled')
+
+    def start(self):
+        self.profiler.start()
+
+    def stop(self):
+        self.profiler.stop()
+
+    def save(self, path):
+        from pyinstrument.renderers import SpeedscopeRenderer
+        with open(path, 'w') as f:
+            f.write(self.profiler.output(SpeedscopeRenderer()))
+
+
+PROFILERS = {
+    'cprofile': CProfileSession,
+    'pyinstrument': PyinstrumentSession,
+}
+
+
+def check_profiler(name):
+    if name not in PROFILERS:
+        raise ValueError('Unknown profiler %r, expected one of %s' % (name, ', '.join(sorted(PROFILERS))))
+    return name
+
+
+def pstats_text(path, sort='cumulative', limit=60):
+    # The top of a .pstats file as pstats prints it
+    out = io.StringIO()
+    stats = pstats.Stats(path, stream=out)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+class ProfileStore:
+    # Profiles plus a JSON metadata file each, in one directory. The
+    # metadata is written last, so a listed profile is always complete.
+    def __init__(self, directory=DEFAULT_PROFILE_DIR, keep=DEFAULT_PROFILE_KEEP):
+        self.directory = directory
+        self.keep = keep
+
+    def save(self, session, meta):
+        os.makedirs(self.directory, exist_ok=True)
+        now = time.time()
+        profile_id = '%s-%06d-%s' % (time.strftime('%Y%m%d-%H%M%S', time.localtime(now)), int(now % 1 * 1e6),
+                                     os.urandom(2).hex())
+        meta = dict(meta, id=profile_id, profiler=session.name, file=profile_id + session.extension)
+        session.save(os.path.join(self.directory, meta['file']))
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(meta, f, sort_keys=True)
+        os.replace(tmp, os.path.join(self.directory, profile_id + '.json'))
+        self.prune()
+        return meta
+
+    def _ids(self):
+        # Oldest first; ids start with the capture time
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith('.json')
+                      and not name.endswith('.speedscope.json'))
+
+    def get(self, profile_id):
+        try:
+            with open(os.path.join(self.directory, os.path.basename(profile_id) + '.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def path(self, meta):
+        return os.path.join(self.directory, meta['file'])
+
+    def slowest(self, limit=50, route=None):
+        profiles = [meta for meta in (self.get(profile_id) for profile_id in self._ids()) if meta is not None]
+        if route:
+            profiles = [meta for meta in profiles if meta['route'] == route]
+        return sorted(profiles, key=lambda meta: meta['duration_ms'], reverse=True)[:limit]
+
+    def prune(self):
+        ids = self._ids()
+        for profile_id in ids[:max(0, len(ids) - self.keep)]:
+            meta = self.get(profile_id)
+            for name in ([meta['file']] if meta else []) + [profile_id + '.json']:
+                try:
+                    os.unlink(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+
+class ProfiledBody:
+    # Response iterable that stops the profile once the server has sent
+    # the whole body and closed it
+    def __init__(self, body, finish):
+        self.body = body
+        self.finish = finish
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.finish()
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, store, sample_rate=0.0, header=DEFAULT_PROFILE_HEADER, token=None,
+                 profiler='cprofile', exclude=DEFAULT_EXCLUDE):
+        self.wsgi_app = app.wsgi_app
+        self.url_map = app.url_map
+        self.store = store
+        self.sample_rate = sample_rate
+        self.header_key = 'HTTP_' + header.upper().replace('-', '_')
+        self.token = token
+        self.profiler = check_profiler(profiler)
+        self.exclude = tuple(exclude)
+        self.remaining = 0
+        self.captured = 0
+        self.errors = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def profile_next(self, count):
+        # Admin toggle: profile the next `count` requests (0 cancels)
+        with self._lock:
+            self.remaining = max(0, int(count))
+
+    def _reason(self, environ):
+        if environ.get('PATH_INFO', '').startswith(self.exclude):
+            return None
+        if self.token and environ.get(self.header_key) == self.token:
+            return 'header'
+        if self.remaining:
+            with self._lock:
+                if self.remaining:
+                    self.remaining -= 1
+                    return 'admin'
+        if self.sample_rate and random.random() < self.sample_rate:
+            return 'sample'
+        return None
+
+    def _route(self, environ):
+        try:
+            return self.url_map.bind_to_environ(environ).match()[0]
+        except HTTPException:
+            return 'unmatched'
+
+    def __call__(self, environ, start_response):
+        reason = self._reason(environ)
+        if reason is None:
+            return self.wsgi_app(environ, start_response)
+        try:
+            session = PROFILERS[self.profiler]()
+            session.start()
+        except Exception as e:
+            # e.g. pyinstrument missing, or another profiler already active
+            self.errors += 1
+            self.last_error = '%s: %s' % (type(e).__name__, e)
+            return self.wsgi_app(environ, start_response)
+
+        started = time.perf_counter()
+        status = []
+
+        def capture_status(status_line, headers, exc_info=None):
+            status[:] = [status_line]
+            return start_response(status_line, headers, exc_info)
+
+        def finish():
+            session.stop()
+            duration_ms = (time.perf_counter() - started) * 1000.0
+            query = environ.get('QUERY_STRING')
+            meta = {
+                'route': self._route(environ),
+                'method': environ.get('REQUEST_METHOD'),
+                'path': environ.get('PATH_INFO', '') + ('?' + query if query else ''),
+                'status': int(status[0].split(None, 1)[0]) if status else None,
+                'duration_ms': round(duration_ms, 3),
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'reason': reason,
+            }
+            try:
+                self.store.save(session, meta)
+                self.captured += 1
+            except Exception as e:
+                self.errors += 1
+                self.last_error = '%s: %s' % (type(e).__name__, e)
+
+        try:
+            body = self.wsgi_app(environ, capture_status)
+        except Exception:
+            finish()
+            raise
+        return ProfiledBody(body, finish)
+
+    def stats(self):
+        return {'sample_rate': self.sample_rate, 'remaining': self.remaining, 'header_enabled': bool(self.token),
+                'profiler': self.profiler, 'captured': self.captured, 'errors': self.errors,
+                'last_error': self.last_error}
@@ -0,0 +1,123 @@
+# Post-training quantization of the malaria CNN, with an accuracy vs
+# latency report.
+#
+# Usage:
+#   python quantize_model.py --cells Cells.npy --labels labels.npy
+#   python quantize_model.py --model candidate.h5 --out-dir build/
+#
+# Exports <model>.tflite, <model>_float16.tflite and <model>_int8.tflite
+# next to --model (or into --out-dir) and writes quantization_report.md
+# there, comparing the three through the same TFLite interpreter. For the
+# default models/my_model.h5 these are the files MODEL_BACKEND=tflite
+# MODEL_VARIANT=float32/float16/int8 serves.
+# Cells.npy / labels.npy are the uint8 arrays saved by the notebook
+# (labels: 0 = Parasitized, 1 = Uninfected).
+import argparse
+import os
+import time
+
+import numpy as np
+
+from backends import TFLiteBackend
+from convert_model import export_tflite, load_keras_model
+
+
+def split_indices(n, calibration_size, eval_size, seed):
+    # Disjoint calibration and evaluation samples, shuffled by index only
+    order = np.random.default_rng(seed).permutation(n)
+    return order[:calibration_size], order[calibration_size:calibration_size + eval_size]
+
+
+def representative_dataset(cells, indices):
+    def generator():
+        for i in indices:
+            yield [cells[i:i + 1].astype(np.float32) / 255.0]
+    return generator
+
+
+def evaluate(predict, images, labels, batch_size=256):
+    from sklearn.metrics import auc, roc_curve
+    probs = np.concatenate([predict(images[i:i + batch_size]) for i in range(0, len(images), batch_size)])
+    accuracy = float(np.mean(probs.argmax(axis=1) == labels))
+    # Infected (Parasitized, label 0) is the positive class, scored by index 0
+    fpr, tpr, _ = roc_curve(labels == 0, probs[:, 0])
+    return accuracy, float(auc(fpr, tpr))
+
+
+def latency_ms(predict, images, runs):
+    # Median single-image CPU latency
+    predict(images[:1])
+    timings = []
+    for i in range(runs):
+        cell = images[i % len(images):i % len(images) + 1]
+        start = time.perf_counter()
+        predict(cell)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings) * 1000.0)
+
+
+def write_report(rows, path, args):
+    lines = [
+        '# Quantization report',
+        '',
+        'Evaluated on %d held-out cells from `%s`; int8 calibrated on %d other cells.'
+        % (args.eval_size, args.cells, args.calibration_size),
+        '',
+        '| variant | file | size (KB) | accuracy | ROC AUC | latency (ms/img) |',
+        '|---|---|---:|---:|---:|---:|',
+    ]
+    for row in rows:
+        lines.append('| %(variant)s | `%(path)s` | %(size_kb).1f | %(accuracy).4f | %(auc).4f | %(latency_ms).3f |' % row)
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    print('\n'.join(lines))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build float32/float16/int8 TFLite variants and compare them')
+    parser.add_argument('--model', default='models/my_model.h5')
+    parser.add_argument('--out-dir', default=None, help='defaults to the directory of --model')
+    parser.add_argument('--cells', default='Cells.npy')
+    parser.add_argument('--labels', default='labels.npy')
+    parser.add_argument('--calibration-size', type=int, default=500)
+    parser.add_argument('--eval-size', type=int, default=2000)
+    parser.add_argument('--latency-runs', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--report', default=None, help='defaults to <out-dir>/quantization_report.md')
+    args = parser.parse_args()
+    out_dir = args.out_dir or os.path.dirname(args.model) or '.'
+    stem = os.path.splitext(os.path.basename(args.model))[0]
+    os.makedirs(out_dir, exist_ok=True)
+
+    cells = np.load(args.cells, mmap_mode='r')
+    labels = np.load(args.labels)
+    calibration, held_out = split_indices(len(cells), args.calibration_size, args.eval_size, args.seed)
+    eval_images = cells[np.sort(held_out)].astype(np.float32) / 255.0
+    eval_labels = labels[np.sort(held_out)]
+
+    # All three are timed through TFLiteBackend, so the latency column
+    # compares quantizations rather than Keras against TFLite
+    model = load_keras_model(args.model)
+    variants = []
+    for variant in ['float32', 'float16', 'int8']:
+        path = os.path.join(out_dir, '%s%s.tflite' % (stem, '' if variant == 'float32' else '_' + variant))
+        export_tflite(model, path, quantization=None if variant == 'float32' else variant,
+                      representative_dataset=representative_dataset(cells, calibration))
+        variants.append((variant, path, TFLiteBackend(path).predict))
+
+    rows = []
+    for variant, path, predict in variants:
+        accuracy, roc_auc = evaluate(predict, eval_images, eval_labels)
+        rows.append({
+            'variant': variant,
+            'path': path,
+            'size_kb': os.path.getsize(path) / 1024.0,
+            'accuracy': accuracy,
+            'auc': roc_auc,
+            'latency_ms': latency_ms(predict, eval_images, args.latency_runs),
+        })
+    write_report(rows, args.report or os.path.join(out_dir, 'quantization_report.md'), args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,397 @@
+import glob
+import hashlib
+import itertools
+from array import array
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+# Default report-job settings, overridable through app.config
+DEFAULT_REPORT_DIR = 'reports'
+DEFAULT_REPORT_WORKERS = 2
+DEFAULT_REPORT_MAX_PENDING = 64
+# Finished jobs remembered for status polling
+DEFAULT_JOB_HISTORY = 1024
+# Bytes gathered before a chunk of a bulk export is handed to the client
+DEFAULT_EXPORT_CHUNK = 64 * 1024
+
+REPORT_FIELDS = (
+    ('Patient ID', 'patientid'),
+    ('First Name', 'fname'),
+    ('Last Name', 'lname'),
+    ('Insurance', 'insurance'),
+    ('Contact Number', 'phone'),
+    ('Result', 'Result'),
+    ('Recommendation', 'reco'),
+    ('Result Date', 'result_date'),
+)
+
+
+class ReportQueueFull(Exception):
+    pass
+
+
+def report_lines(patient):
+    # Recommendation / result date are only shown for rows that have them
+    # (joined with reco / patient_dates). Works on dicts and sqlite3.Row.
+    keys = patient.keys()
+    return [f"{label}: {patient[key]}" for label, key in REPORT_FIELDS if key in keys]
+
+
+def draw_patient(c, patient):
+    # One patient per page, same layout as the original per-route PDFs
+    y = 750
+    for line in report_lines(patient):
+        c.drawString(100, y, line)
+        y -= 20
+
+
+def render_patient_pdf(patient, path):
+    c = canvas.Canvas(path, pagesize=letter)
+    draw_patient(c, patient)
+    c.save()
+    return path
+
+
+def report_layout(patient):
+    # Which REPORT_FIELDS the row has, as a hex bitmask: the print routes
+    # pass the plain patient row or the row joined with reco
+    keys = patient.keys()
+    return '%02x' % sum(1 << i for i, (_, key) in enumerate(REPORT_FIELDS) if key in keys)
+
+
+def row_version(patient):
+    # Layout plus a hash of every column the report shows; any edit gives
+    # a new version
+    keys = patient.keys()
+    data = repr([(key, patient[key] if key in keys else None) for _, key in REPORT_FIELDS]).encode('utf-8')
+    return '%s-%s' % (report_layout(patient), hashlib.blake2b(data, digest_size=8).hexdigest())
+
+
+class ReportStore:
+    # Rendered PDFs on disk, one file per (patient id, row version), so an
+    # unchanged report is never rendered twice. Rendering a new version
+    # deletes the patient's older ones of the same layout, so the directory
+    # holds at most one PDF per patient and layout. Callers serialise
+    # renders of one patient (ReportJobs does), or a prune could remove a
+    # PDF another render is about to use.
+    def __init__(self, directory=DEFAULT_REPORT_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, patient_id, version):
+        return os.path.join(self.directory, 'patient_%s_%s.pdf' % (patient_id, version))
+
+    def get(self, patient_id, version):
+        path = self.path_for(patient_id, version)
+        return path if os.path.exists(path) else None
+
+    def render(self, patient):
+        # Render to a temp file and rename, so a concurrent job or reader
+        # never sees a half-written PDF
+        path = self.path_for(patient['patientid'], row_version(patient))
+        fd, tmp = tempfile.mkstemp(suffix='.pdf', dir=self.directory)
+        os.close(fd)
+        try:
+            render_patient_pdf(patient, tmp)
+            os.replace(tmp, path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+        self.prune(patient['patientid'], report_layout(patient), keep=path)
+        return path
+
+    def prune(self, patient_id, layout, keep=None):
+        # Remove the patient's superseded reports of one layout (all of
+        # them without `keep`)
+        pattern = os.path.join(glob.escape(self.directory),
+                               'patient_%s_%s-*.pdf' % (glob.escape(str(patient_id)), layout))
+        for old in glob.glob(pattern):
+            if old == keep:
+                continue
+            try:
+                os.unlink(old)
+            except FileNotFoundError:
+                pass
+
+
+class LprSpooler:
+    # Sends each PDF to the system print queue
+    def __init__(self, command='lpr'):
+        self.command = command
+
+    def print_file(self, path):
+        subprocess.run([self.command, path], check=True)
+
+
+class LocalSpooler:
+    # Stand-in printer: copies each PDF into a spool directory
+    def __init__(self, directory):
+        self.directory = directory
+        self.printed = []
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def print_file(self, path):
+        with self._lock:
+            target = os.path.join(self.directory, '%d_%s' % (len(self.printed), os.path.basename(path)))
+            self.printed.append(target)
+        shutil.copyfile(path, target)
+
+
+SPOOLERS = ('lpr', 'local')
+
+
+def make_spooler(name, report_dir=DEFAULT_REPORT_DIR):
+    if name == 'lpr':
+        return LprSpooler()
+    if name == 'local':
+        return LocalSpooler(os.path.join(report_dir, 'spool'))
+    raise ValueError('Unknown report spooler %r, expected one of %s' % (name, ', '.join(SPOOLERS)))
+
+
+class ReportJob:
+    def __init__(self, job_id, patient_id, version, print_report):
+        self.id = job_id
+        self.patient_id = patient_id
+        self.version = version
+        self.print_report = print_report
+        self.status = 'queued'
+        self.cached = False
+        self.path = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'patient_id': self.patient_id,
+            'version': self.version,
+            'status': self.status,
+            'cached': self.cached,
+            'print': self.print_report,
+            'error': self.error,
+            'created': self.created,
+            'finished': self.finished,
+        }
+
+
+class ReportJobs:
+    # Renders (and optionally prints) patient reports on a bounded thread
+    # pool. Requests get a job id back straight away and can poll it. Jobs
+    # for the same patient run one at a time, so rendering a new version
+    # never prunes a PDF another job is still printing.
+    def __init__(self, store, spooler, max_workers=DEFAULT_REPORT_WORKERS,
+                 max_pending=DEFAULT_REPORT_MAX_PENDING, history=DEFAULT_JOB_HISTORY):
+        self.store = store
+        self.spooler = spooler
+        self.max_pending = max_pending
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='report')
+        self._jobs = OrderedDict()
+        # patient id -> [lock, jobs holding or waiting for it]
+        self._patient_locks = {}
+        self._pending = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.rendered = 0
+        self.cache_hits = 0
+        self.failed = 0
+
+    def submit(self, patient, print_report=True):
+        # `patient` is a plain dict of the row (copied, the request's
+        # cursor is gone by the time the job runs)
+        patient = dict(patient)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise ReportQueueFull('%d report jobs already pending' % self._pending)
+            self._pending += 1
+            job = ReportJob('%d-%s' % (next(self._ids), os.urandom(4).hex()),
+                            patient['patientid'], row_version(patient), print_report)
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.history:
+                self._jobs.popitem(last=False)
+        self._executor.submit(self._run, job, patient)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _acquire_patient(self, patient_id):
+        with self._lock:
+            entry = self._patient_locks.setdefault(patient_id, [threading.Lock(), 0])
+            entry[1] += 1
+        entry[0].acquire()
+
+    def _release_patient(self, patient_id):
+        with self._lock:
+            entry = self._patient_locks[patient_id]
+            entry[0].release()
+            entry[1] -= 1
+            if not entry[1]:
+                del self._patient_locks[patient_id]
+
+    def _run(self, job, patient):
+        self._acquire_patient(job.patient_id)
+        try:
+            job.status = 'rendering'
+            path = self.store.get(job.patient_id, job.version)
+            if path is not None:
+                job.cached = True
+                with self._lock:
+                    self.cache_hits += 1
+            else:
+                path = self.store.render(patient)
+                with self._lock:
+                    self.rendered += 1
+            job.path = path
+            if job.print_report:
+                job.status = 'printing'
+                self.spooler.print_file(path)
+            job.status = 'done'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            with self._lock:
+                self.failed += 1
+        finally:
+            self._release_patient(job.patient_id)
+            job.finished = time.time()
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': self._pending,
+                'max_pending': self.max_pending,
+                'rendered': self.rendered,
+                'cache_hits': self.cache_hits,
+                'failed': self.failed,
+            }
+
+
+def _pdf_string(text):
+    text = text.encode('latin-1', 'replace')
+    return b'(' + text.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+class PdfStreamWriter:
+    # Minimal text-only PDF writer that emits each page as soon as it is
+    # drawn, in the same layout as draw_patient (Helvetica 12 at x=100,
+    # from y=750 down in 20pt steps). reportlab keeps every page of a
+    # document in memory until save(); this only keeps one xref offset
+    # (8 bytes) per object.
+    #
+    # Objects: 1 catalog, 2 page tree, 3 font, then content/page pairs.
+    FIRST_PAGE_OBJECT = 4
+
+    def __init__(self, pagesize=letter):
+        self.pagesize = pagesize
+        self.position = 0
+        self.offsets = array('Q', [0, 0, 0])
+        self.pages = 0
+
+    def _emit(self, data):
+        self.position += len(data)
+        return data
+
+    def _object(self, number, body):
+        self.offsets[number - 1] = self.position
+        return self._emit(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+
+    def begin(self):
+        return self._emit(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n') + self._object(
+            3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+
+    def page(self, lines):
+        content = [b'BT /F1 12 Tf 100 750 Td 20 TL']
+        content.extend(_pdf_string(line) + b" '" if i else _pdf_string(line) + b' Tj' for i, line in enumerate(lines))
+        content.append(b'ET')
+        content = b'\n'.join(content)
+        number = self.FIRST_PAGE_OBJECT + 2 * self.pages
+        self.offsets.extend((0, 0))
+        self.pages += 1
+        return self._object(number, b'<< /Length %d >>\nstream\n' % len(content) + content + b'\nendstream') + \
+            self._object(number + 1, b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Contents %d 0 R '
+                         b'/Resources << /Font << /F1 3 0 R >> >> >>' % (self.pagesize[0], self.pagesize[1], number))
+
+    def finish(self):
+        # Yields the page tree, catalog, xref table and trailer in pieces
+        # so a large document's /Kids array is never built in one string
+        self.offsets[1] = self.position
+        yield self._emit(b'2 0 obj\n<< /Type /Pages /Count %d /Kids [' % self.pages)
+        for start in range(0, self.pages, 4096):
+            yield self._emit(b''.join(b'%d 0 R ' % (self.FIRST_PAGE_OBJECT + 2 * i + 1)
+                                      for i in range(start, min(start + 4096, self.pages))))
+        yield self._emit(b'] >>\nendobj\n')
+        yield self._object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        xref = self.position
+        count = len(self.offsets) + 1
+        yield b'xref\n0 %d\n0000000000 65535 f \n' % count
+        for start in range(0, len(self.offsets), 4096):
+            yield b''.join(b'%010d 00000 n \n' % offset for offset in self.offsets[start:start + 4096])
+        yield b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (count, xref)
+
+
+def iter_patients_pdf(rows, chunk_size=DEFAULT_EXPORT_CHUNK):
+    # One pass over `rows` (e.g. an open cursor), one page per patient,
+    # yielded in chunks of about `chunk_size` bytes
+    writer = PdfStreamWriter()
+    buffer = [writer.begin()]
+    buffered = len(buffer[0])
+    for row in rows:
+        page = writer.page(report_lines(row))
+        buffer.append(page)
+        buffered += len(page)
+        if buffered >= chunk_size:
+            yield b''.join(buffer)
+            buffer, buffered = [], 0
+    for part in writer.finish():
+        buffer.append(part)
+        buffered += len(part)
+        if buffered >= chunk_size:
+            yield b''.join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def export_patients(conn, date_from=None, date_to=None, result=None, insurances=()):
+    # Open cursor over the patients matching the filter. Dates filter on
+    # the day the result was recorded (patient_dates, migration 5); result
+    # is a class prefix, so 'Infected' also matches slide-scan summaries.
+    where, params = [], []
+    if date_from:
+        where.append('patient_dates.result_date >= ?')
+        params.append(date_from)
+    if date_to:
+        where.append('patient_dates.result_date <= ?')
+        params.append(date_to)
+    if result:
+        where.append("patients.Result LIKE ? ESCAPE '\\'")
+        params.append(result.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+    if insurances:
+        where.append('patients.insurance IN (%s)' % ', '.join('?' * len(insurances)))
+        params.extend(insurances)
+    sql = """SELECT patients.*, patient_dates.result_date FROM patients
+             LEFT JOIN patient_dates ON patient_dates.patientid = patients.patientid"""
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    # With a date range, walk idx_patient_dates_result_date in order
+    # instead of sorting the whole match in a temp b-tree
+    if date_from or date_to:
+        sql += ' ORDER BY patient_dates.result_date, patient_dates.patientid'
+    else:
+        sql += ' ORDER BY patients.patientid'
+    return conn.execute(sql, params)
@@ -0,0 +1,153 @@
+import os
+import zipfile
+
+import numpy as np
+
+from calibration import DEFAULT_THRESHOLD, INFECTED, classify
+from preprocess import CELL_SHAPE, preprocess_bytes
+from tta import check_variants, predict_tta, tta_summary
+
+# Number of cells preprocessed and scored per forward pass. The chunk
+# buffer is reused, so memory stays flat however many cells a slide has.
+DEFAULT_CHUNK_SIZE = 64
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+
+# Upload limits, so a small ZIP can't expand into gigabytes (a zip bomb)
+# or millions of members. Cell crops are a few KB each.
+DEFAULT_MAX_CELLS = 20000
+DEFAULT_MAX_CELL_BYTES = 4 * 1024 * 1024
+
+
+class SlideTooLarge(ValueError):
+    pass
+
+
+def _is_image_name(name):
+    base = os.path.basename(name)
+    if not base or base.startswith('.') or name.startswith('__MACOSX/'):
+        return False
+    return '.' in base and base.rsplit('.', 1)[1].lower() in IMAGE_EXTENSIONS
+
+
+def _read_limited(stream, name, max_bytes):
+    # Never reads more than max_bytes + 1, whatever a ZIP header claims
+    data = stream.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise SlideTooLarge('%s is larger than %d bytes' % (name, max_bytes))
+    return data
+
+
+def iter_uploaded_cells(files, max_cells=DEFAULT_MAX_CELLS, max_cell_bytes=DEFAULT_MAX_CELL_BYTES):
+    # Yield (name, bytes) for every cell image in a list of uploads. ZIP
+    # archives are opened in place and their members read one at a time.
+    # Raises SlideTooLarge past max_cells images (or ZIP members) or for
+    # an image over max_cell_bytes.
+    count = 0
+    for file in files:
+        if not file or not file.filename:
+            continue
+        if file.filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(file.stream) as archive:
+                members = archive.infolist()
+                if len(members) > max_cells:
+                    raise SlideTooLarge('%s has %d members, the limit is %d' % (file.filename, len(members),
+                                                                                 max_cells))
+                for info in members:
+                    if info.is_dir() or not _is_image_name(info.filename):
+                        continue
+                    if info.file_size > max_cell_bytes:
+                        raise SlideTooLarge('%s is larger than %d bytes' % (info.filename, max_cell_bytes))
+                    count += 1
+                    if count > max_cells:
+                        raise SlideTooLarge('More than %d cell images' % max_cells)
+                    with archive.open(info) as member:
+                        yield info.filename, _read_limited(member, info.filename, max_cell_bytes)
+        elif _is_image_name(file.filename):
+            count += 1
+            if count > max_cells:
+                raise SlideTooLarge('More than %d cell images' % max_cells)
+            yield file.filename, _read_limited(file.stream, file.filename, max_cell_bytes)
+
+
+def scan_slide(cells, predict_batch, chunk_size=DEFAULT_CHUNK_SIZE, versioned=False, tta=None,
+               threshold=DEFAULT_THRESHOLD, calibrate=None):
+    # Stream (name, bytes) pairs through decode -> preprocess -> batched
+    # predict in fixed-size chunks. Returns per-cell results and a summary.
+    # With versioned=True, predict_batch returns (predictions, versions)
+    # (InferenceEngine.predict_batch_versioned) and each cell records the
+    # model version that scored it. tta=n scores the first n flips /
+    # rotations of every cell (see tta.py) in the same forward pass and
+    # adds their variance to each cell. Cells are Infected when their
+    # score, calibrate(predictions, versions) or else the raw infected
+    # probability, is above `threshold`.
+    buffer = np.empty((chunk_size,) + CELL_SHAPE, dtype=np.float32)
+    tta_buffer = np.empty((chunk_size * check_variants(tta),) + CELL_SHAPE, dtype=np.float32) if tta else None
+    pending = []
+    results = []
+
+    def predict_versioned(batch):
+        if versioned:
+            return predict_batch(batch)
+        return predict_batch(batch), [None] * len(batch)
+
+    def flush():
+        batch = buffer[:len(pending)]
+        if tta:
+            predictions, variances, versions = predict_tta(predict_versioned, batch, tta, out=tta_buffer)
+        else:
+            (predictions, versions), variances = predict_versioned(batch), None
+        if calibrate is not None:
+            scores = calibrate(predictions, versions)
+        else:
+            scores = np.asarray(predictions)[:, INFECTED]
+        for i, (entry, prediction) in enumerate(zip(pending, predictions)):
+            entry['score'] = float(scores[i])
+            entry['result'] = classify(scores[i], threshold)
+            if variances is not None:
+                entry['tta'] = tta_summary(prediction, variances[i], tta)
+            if versions[i] is not None:
+                entry['model_version'] = versions[i]
+        del pending[:]
+
+    for name, data in cells:
+        entry = {'name': name}
+        results.append(entry)
+        try:
+            preprocess_bytes(data, out=buffer[len(pending)])
+        except Exception:
+            entry['error'] = 'Unreadable image'
+            continue
+        pending.append(entry)
+        if len(pending) == chunk_size:
+            flush()
+    if pending:
+        flush()
+
+    summary = summarize(results)
+    summary['tta'] = tta or None
+    return results, summary
+
+
+def summarize(results):
+    scored = [r for r in results if 'result' in r]
+    infected = sum(1 for r in scored if r['result'] == 'Infected')
+    total = len(scored)
+    fraction = infected / total if total else 0.0
+    versions = sorted({r['model_version'] for r in scored if r.get('model_version')})
+    return {
+        'cells': total,
+        'skipped': len(results) - total,
+        'infected': infected,
+        'uninfected': total - infected,
+        'infected_fraction': fraction,
+        'parasitaemia_percent': round(fraction * 100.0, 2),
+        'result': 'Infected' if infected else 'Uninfected',
+        'model_version': ', '.join(versions) or None,
+    }
+
+
+def summary_text(summary):
+    # Compact form stored in patients.Result
+    return '%s (%d/%d cells infected, %.2f%% parasitaemia)' % (
+        summary['result'], summary['infected'], summary['cells'], summary['parasitaemia_percent'])
@@ -0,0 +1,84 @@
+import threading
+import time
+
+# Seconds a dashboard snapshot is reused before re-reading the counters
+DEFAULT_STATS_TTL = 2.0
+# Days of infected / uninfected history shown on the dashboard
+DEFAULT_STATS_DAYS = 7
+
+RESULT_CLASSES = ('Infected', 'Uninfected')
+
+
+def read_counts(conn):
+    # Primary-key reads of the trigger-maintained table_counts rows
+    # (migration 4), so the cost does not grow with the registry
+    counts = {'patients': 0, 'Doctors': 0, 'lab': 0, 'office': 0}
+    counts.update({'patients:' + result: 0 for result in RESULT_CLASSES})
+    for name, n in conn.execute('SELECT name, n FROM table_counts'):
+        counts[name] = n
+    return counts
+
+
+def read_daily(conn, days=DEFAULT_STATS_DAYS):
+    # Newest first: [{'day': 'YYYY-MM-DD', 'Infected': n, 'Uninfected': n}, ...]
+    rows = conn.execute("""SELECT day, result, n FROM daily_results
+                           WHERE day > date('now', 'localtime', ?)
+                           ORDER BY day DESC""", ('-%d days' % days,))
+    daily = {}
+    for day, result, n in rows:
+        entry = daily.setdefault(day, dict({'day': day}, **{r: 0 for r in RESULT_CLASSES}))
+        entry[result] = n
+    return list(daily.values())
+
+
+def read_stats(conn, days=DEFAULT_STATS_DAYS):
+    counts = read_counts(conn)
+    return {
+        'patients': counts['patients'],
+        'doctors': counts['Doctors'],
+        'lab': counts['lab'],
+        'office': counts['office'],
+        'infected': counts['patients:Infected'],
+        'uninfected': counts['patients:Uninfected'],
+        'daily': read_daily(conn, days),
+    }
+
+
+class StatsCache:
+    # Short-TTL snapshot in front of read_stats so a burst of dashboard
+    # loads costs one round of counter reads. Writes made through the app
+    # call invalidate(); anything else shows up within `ttl` seconds.
+    def __init__(self, ttl=DEFAULT_STATS_TTL, days=DEFAULT_STATS_DAYS):
+        self.ttl = ttl
+        self.days = days
+        self._lock = threading.Lock()
+        self._value = None
+        self._expires = 0.0
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, conn):
+        now = time.monotonic()
+        with self._lock:
+            if self._value is not None and now < self._expires:
+                self.hits += 1
+                return self._value
+            self.misses += 1
+            generation = self._generation
+        value = read_stats(conn, self.days)
+        with self._lock:
+            # Don't keep a snapshot that an invalidate() overtook mid-read
+            if generation == self._generation:
+                self._value = value
+                self._expires = now + self.ttl
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses}
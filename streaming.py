@@ -0,0 +1,53 @@
+from flask import Response, current_app, render_template, stream_with_context
+
+from database import detach_db, get_pool
+
+# Rendered template chunks gathered per write; 1 would flush after every
+# row, which costs more in WSGI overhead than it saves in latency
+DEFAULT_STREAM_BUFFER = 64
+
+
+def stream_template(template_name, **context):
+    # Render lazily: rows are pulled from the DB cursor and written to the
+    # client while the rest of the page is still being produced
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    stream = template.stream(**context)
+    buffer_size = app.config.get('STREAM_BUFFER', DEFAULT_STREAM_BUFFER)
+    if buffer_size > 1:
+        stream.enable_buffering(buffer_size)
+
+    return stream_response(stream, mimetype='text/html')
+
+
+def stream_response(chunks, **kwargs):
+    # The request ends before the stream does, so keep the DB connection out
+    # of the pool until the last chunk has been produced (or the client leaves)
+    app = current_app._get_current_object()
+    conn = detach_db()
+
+    def generate():
+        try:
+            for chunk in chunks:
+                yield chunk
+        finally:
+            if conn is not None:
+                get_pool(app).release(conn)
+
+    return Response(stream_with_context(generate()), **kwargs)
+
+
+def render_listing(template_name, rows_name, rows, **context):
+    # `rows` is a lazily iterated cursor (or a listing.Page wrapping one).
+    # With STREAM_TEMPLATES on (the default) the page is streamed row by
+    # row; otherwise everything is fetched and rendered in memory first.
+    if current_app.config.get('STREAM_TEMPLATES', True):
+        context[rows_name] = rows
+        return stream_template(template_name, **context)
+    if hasattr(rows, 'materialize'):
+        rows.materialize()
+    else:
+        rows = list(rows)
+    context[rows_name] = rows
+    return render_template(template_name, **context)
@@ -0,0 +1,219 @@
+# Train the malaria CNN from the arrays built by build_dataset.py.
+#
+# Usage:
+#   python train.py --cells Cells.npy --labels labels.npy
+#   python train.py --input generator --epochs 20 --batch-size 32
+#   python train.py --intra-op-threads 32 --inter-op-threads 2 --precision auto
+#
+# Same model, loss, optimizer and 90/10 split as
+# Notebook_Malaria_cell.ipynb, but the data is streamed from the
+# memory-mapped uint8 arrays (see train_pipeline.py) instead of being
+# loaded and converted to float32 up front. Writes the best epoch's
+# weights as a float32 models/my_model.h5, which the app serves with
+# MODEL_BACKEND=keras.
+#
+# Runs are reproducible for a given --seed, and resumable: the model,
+# optimizer, epoch and early-stopping state are checkpointed after every
+# epoch under --checkpoint-dir, and rerunning the same command carries on
+# from the latest checkpoint. Per-epoch wall time and samples/sec are
+# printed and appended to --log.
+import argparse
+import csv
+import os
+import time
+
+from preprocess import CELL_SHAPE
+from train_pipeline import (DEFAULT_BATCH_SIZE, DEFAULT_VAL_FRACTION, NUM_CLASSES, epoch_generator,
+                            open_dataset, split_indices, tf_dataset)
+
+INPUTS = ['tf.data', 'generator']
+PRECISIONS = ['auto', 'float32', 'mixed_bfloat16', 'mixed_float16']
+
+# /proc/cpuinfo flags for native bfloat16 matmuls (AVX512-BF16, AMX)
+BF16_CPU_FLAGS = ('avx512_bf16', 'amx_bf16')
+
+
+def build_model(output_dtype=None):
+    # `output_dtype='float32'` keeps the softmax in float32 under a mixed
+    # precision policy; the layers are otherwise the notebook's
+    from tensorflow.keras.layers import Conv2D, Dense, Dropout, Flatten, MaxPooling2D
+    from tensorflow.keras.models import Sequential
+    model = Sequential()
+    model.add(Conv2D(filters=32, kernel_size=2, padding='same', activation='relu', input_shape=CELL_SHAPE))
+    model.add(MaxPooling2D(pool_size=2))
+    model.add(Dropout(0.2))
+    model.add(Conv2D(filters=32, kernel_size=2, padding='same', activation='relu'))
+    model.add(MaxPooling2D(pool_size=2))
+    model.add(Dropout(0.2))
+    model.add(Conv2D(filters=32, kernel_size=2, padding='same', activation='relu'))
+    model.add(MaxPooling2D(pool_size=2))
+    model.add(Dropout(0.2))
+    model.add(Flatten())
+    model.add(Dense(512, activation='relu'))
+    model.add(Dropout(0.4))
+    if output_dtype:
+        model.add(Dense(NUM_CLASSES, activation='softmax', dtype=output_dtype))
+    else:
+        model.add(Dense(NUM_CLASSES, activation='softmax'))
+    model.compile(loss='binary_crossentropy', optimizer='adam', metrics=['accuracy'])
+    return model
+
+
+def cpu_flags():
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    return set(line.split(':', 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+
+def resolve_precision(precision):
+    # auto: bfloat16 only where the CPU does it natively; emulated bf16 and
+    # float16 on CPU are slower than float32
+    if precision != 'auto':
+        return precision
+    return 'mixed_bfloat16' if cpu_flags() & set(BF16_CPU_FLAGS) else 'float32'
+
+
+def configure_tensorflow(intra_op_threads, inter_op_threads, precision, seed, deterministic):
+    # Must run before TensorFlow executes its first op
+    if intra_op_threads:
+        os.environ.setdefault('OMP_NUM_THREADS', str(intra_op_threads))
+    import tensorflow as tf
+    if intra_op_threads:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    if inter_op_threads:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    tf.keras.utils.set_random_seed(seed)
+    if deterministic:
+        tf.config.experimental.enable_op_determinism()
+    if precision != 'float32':
+        tf.keras.mixed_precision.set_global_policy(precision)
+    return tf
+
+
+def make_inputs(cells, labels, train_idx, val_idx, batch_size, seed, input_kind):
+    # (train, validation, fit kwargs) for model.fit. `seed` is the shuffle
+    # seed of the first epoch run; later epochs use seed + 1, seed + 2, ...
+    if input_kind == 'tf.data':
+        return (tf_dataset(cells, labels, train_idx, batch_size, shuffle=True, seed=seed),
+                tf_dataset(cells, labels, val_idx, batch_size, shuffle=False), {})
+    steps = (len(train_idx) + batch_size - 1) // batch_size
+    val_steps = (len(val_idx) + batch_size - 1) // batch_size
+    train = epoch_generator(cells, labels, train_idx, batch_size, shuffle=True, seed=seed)
+    val = epoch_generator(cells, labels, val_idx, batch_size, shuffle=False)
+
+    def repeat(generator):
+        while True:
+            yield from generator()
+    return repeat(train), repeat(val), {'steps_per_epoch': steps, 'validation_steps': val_steps}
+
+
+def training_callback(tf, manager, state, best_weights_path, patience, samples, log_path):
+    # Per-epoch bookkeeping in one place: timing / throughput log, best
+    # weights, early stopping (patience on val_loss, like the notebook)
+    # and the checkpoint that makes all of it resumable
+    class TrainingState(tf.keras.callbacks.Callback):
+        def on_epoch_begin(self, epoch, logs=None):
+            self.started = time.perf_counter()
+
+        def on_epoch_end(self, epoch, logs=None):
+            logs = logs or {}
+            seconds = time.perf_counter() - self.started
+            val_loss = logs.get('val_loss', float('inf'))
+            if val_loss < float(state['best'].numpy()):
+                state['best'].assign(val_loss)
+                state['wait'].assign(0)
+                self.model.save_weights(best_weights_path)
+            else:
+                state['wait'].assign_add(1)
+                if int(state['wait'].numpy()) >= patience:
+                    self.model.stop_training = True
+            state['epoch'].assign(epoch + 1)
+            manager.save(checkpoint_number=epoch + 1)
+
+            row = {'epoch': epoch + 1, 'seconds': round(seconds, 3), 'samples_per_s': round(samples / seconds, 1)}
+            row.update({k: round(float(v), 5) for k, v in sorted(logs.items())})
+            print('epoch %d: %.1fs, %.0f samples/s, %s' % (
+                epoch + 1, seconds, samples / seconds,
+                ', '.join('%s=%.4f' % (k, float(v)) for k, v in sorted(logs.items()))))
+            new_file = not os.path.exists(log_path)
+            with open(log_path, 'a', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=list(row))
+                if new_file:
+                    writer.writeheader()
+                writer.writerow(row)
+    return TrainingState()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the malaria CNN from Cells.npy / labels.npy')
+    parser.add_argument('--cells', default='Cells.npy')
+    parser.add_argument('--labels', default='labels.npy')
+    parser.add_argument('--out', default='models/my_model.h5')
+    parser.add_argument('--checkpoint-dir', default='checkpoints')
+    parser.add_argument('--log', default=None, help='per-epoch CSV (default: <checkpoint-dir>/training_log.csv)')
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--val-fraction', type=float, default=DEFAULT_VAL_FRACTION)
+    parser.add_argument('--patience', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--input', choices=INPUTS, default='tf.data')
+    parser.add_argument('--intra-op-threads', type=int, default=os.cpu_count(),
+                        help='threads inside one op, e.g. a convolution (default: one per CPU)')
+    parser.add_argument('--inter-op-threads', type=int, default=2,
+                        help='ops run concurrently; this model is a single chain, so keep it small')
+    parser.add_argument('--precision', choices=PRECISIONS, default='auto')
+    parser.add_argument('--deterministic', action='store_true', help='bit-reproducible ops (slower)')
+    args = parser.parse_args()
+
+    precision = resolve_precision(args.precision)
+    tf = configure_tensorflow(args.intra_op_threads, args.inter_op_threads, precision, args.seed, args.deterministic)
+    print('threads: intra-op %s, inter-op %s; precision: %s' % (args.intra_op_threads, args.inter_op_threads, precision))
+
+    cells, labels = open_dataset(args.cells, args.labels)
+    train_idx, val_idx = split_indices(len(cells), args.val_fraction, args.seed)
+
+    model = build_model(output_dtype='float32' if precision != 'float32' else None)
+    state = {
+        'epoch': tf.Variable(0, dtype=tf.int64),
+        'best': tf.Variable(float('inf'), dtype=tf.float64),
+        'wait': tf.Variable(0, dtype=tf.int64),
+    }
+    os.makedirs(args.checkpoint_dir, exist_ok=True)
+    checkpoint = tf.train.Checkpoint(model=model, optimizer=model.optimizer, **state)
+    manager = tf.train.CheckpointManager(checkpoint, args.checkpoint_dir, max_to_keep=3)
+    if manager.latest_checkpoint:
+        checkpoint.restore(manager.latest_checkpoint)
+        print('resuming from %s (epoch %d)' % (manager.latest_checkpoint, int(state['epoch'].numpy())))
+    initial_epoch = int(state['epoch'].numpy())
+    if initial_epoch and int(state['wait'].numpy()) >= args.patience:
+        print('stopped early before the interruption, nothing left to train')
+        initial_epoch = args.epochs
+
+    best_weights_path = os.path.join(args.checkpoint_dir, 'best.weights.h5')
+    if initial_epoch < args.epochs:
+        train, val, fit_kwargs = make_inputs(cells, labels, train_idx, val_idx, args.batch_size,
+                                             args.seed + initial_epoch, args.input)
+        callback = training_callback(tf, manager, state, best_weights_path, args.patience, len(train_idx),
+                                     args.log or os.path.join(args.checkpoint_dir, 'training_log.csv'))
+        model.fit(train, validation_data=val, epochs=args.epochs, initial_epoch=initial_epoch,
+                  callbacks=[callback], verbose=2, **fit_kwargs)
+
+    # Serve the best epoch as a plain float32 model whatever the training
+    # precision was (variables are float32 under mixed precision too)
+    if os.path.exists(best_weights_path):
+        model.load_weights(best_weights_path)
+    tf.keras.mixed_precision.set_global_policy('float32')
+    final = build_model()
+    final.set_weights(model.get_weights())
+    os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+    final.save(args.out)
+    print('model -> %s' % args.out)
+
+
+if __name__ == '__main__':
+    main()
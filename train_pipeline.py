@@ -0,0 +1,114 @@
+# Training input pipeline over the uint8 arrays from build_dataset.py.
+#
+# Cells.npy is opened with mmap_mode='r' and never loaded whole: shuffling
+# permutes an index array, each batch is gathered from the map and
+# normalised to float32 on its own, and batches are produced ahead of the
+# training step (tf.data prefetch, or a background thread). Peak memory is
+# a few batches plus whatever pages the OS keeps cached, so the dataset
+# can be larger than RAM.
+import queue
+import threading
+
+import numpy as np
+
+from preprocess import CELL_SHAPE, scale_cells
+
+NUM_CLASSES = 2
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_VAL_FRACTION = 0.1
+DEFAULT_PREFETCH = 4
+
+
+def open_dataset(cells_path='Cells.npy', labels_path='labels.npy'):
+    cells = np.load(cells_path, mmap_mode='r')
+    labels = np.load(labels_path, mmap_mode='r')
+    if cells.shape[0] != labels.shape[0] or cells.shape[1:] != CELL_SHAPE:
+        raise ValueError('%s %r does not match %s %r' % (cells_path, cells.shape, labels_path, labels.shape))
+    return cells, labels
+
+
+def split_indices(n, val_fraction=DEFAULT_VAL_FRACTION, seed=0):
+    # Shuffled once, then the first val_fraction held out like the
+    # notebook's x_test. Each side is sorted so reads follow the file.
+    order = np.random.default_rng(seed).permutation(n)
+    n_val = int(val_fraction * n)
+    return np.sort(order[n_val:]), np.sort(order[:n_val])
+
+
+def load_batch(cells, labels, indices):
+    # Gather one batch from the map (sorted, so the reads move forward
+    # through the file) and normalise it: float32 /255 images, one-hot labels
+    indices = np.sort(indices)
+    x = scale_cells(np.take(cells, indices, axis=0))
+    y = np.eye(NUM_CLASSES, dtype=np.float32)[np.take(labels, indices)]
+    return x, y
+
+
+def iter_batches(cells, labels, indices, batch_size=DEFAULT_BATCH_SIZE, seed=None):
+    # One epoch of (x, y) batches; with a seed the order is shuffled by
+    # permuting `indices`, never the data
+    if seed is not None:
+        indices = np.random.default_rng(seed).permutation(indices)
+    for start in range(0, len(indices), batch_size):
+        yield load_batch(cells, labels, indices[start:start + batch_size])
+
+
+def prefetch(iterable, depth=DEFAULT_PREFETCH):
+    # Produce items on a background thread, up to `depth` ahead. NumPy
+    # releases the GIL while copying pages out of the map, so loading
+    # overlaps with the training step.
+    items = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                items.put(item)
+        except Exception as e:
+            items.put(e)
+        items.put(done)
+
+    thread = threading.Thread(target=produce, name='train-prefetch', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        while thread.is_alive():
+            try:
+                items.get_nowait()
+            except queue.Empty:
+                thread.join(0.01)
+
+
+def epoch_generator(cells, labels, indices, batch_size=DEFAULT_BATCH_SIZE, shuffle=True, seed=0,
+                    depth=DEFAULT_PREFETCH):
+    # Callable returning a fresh, prefetched epoch each time it is called,
+    # with a new shuffle order per epoch (seed, seed + 1, ...)
+    epochs = iter(range(seed, 2 ** 31))
+
+    def generator():
+        epoch_seed = next(epochs) if shuffle else None
+        return prefetch(iter_batches(cells, labels, indices, batch_size, epoch_seed), depth)
+    return generator
+
+
+def tf_dataset(cells, labels, indices, batch_size=DEFAULT_BATCH_SIZE, shuffle=True, seed=0):
+    # tf.data wrapper around epoch_generator; tf.data re-invokes the
+    # generator every epoch and prefetches on its own threads
+    import tensorflow as tf
+    generator = epoch_generator(cells, labels, indices, batch_size, shuffle, seed, depth=1)
+    dataset = tf.data.Dataset.from_generator(generator, output_signature=(
+        tf.TensorSpec(shape=(None,) + CELL_SHAPE, dtype=tf.float32),
+        tf.TensorSpec(shape=(None, NUM_CLASSES), dtype=tf.float32)))
+    steps = (len(indices) + batch_size - 1) // batch_size
+    return dataset.apply(tf.data.experimental.assert_cardinality(steps)).prefetch(tf.data.AUTOTUNE)
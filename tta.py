@@ -0,0 +1,72 @@
+# Test-time augmentation: score the flips and rotations of a cell together
+# and report the mean probability and how much the variants disagree.
+#
+# A cell crop has no preferred orientation, so the 8 symmetries of the
+# square (4 rotations, each optionally mirrored) are all valid views of it.
+# All variants of all cells go through the model as one batch, which costs
+# far less than one forward pass per variant (see benchmarks/bench_tta.py).
+import numpy as np
+
+from preprocess import CELL_SHAPE
+
+# (name, transform) in the order variants are generated; a request for n
+# variants uses the first n. Transforms act on a batch (N x H x W x C) and
+# return views.
+TTA_TRANSFORMS = (
+    ('identity', lambda b: b),
+    ('flip_lr', lambda b: b[:, :, ::-1]),
+    ('flip_ud', lambda b: b[:, ::-1]),
+    ('rot180', lambda b: b[:, ::-1, ::-1]),
+    ('rot90', lambda b: np.rot90(b, 1, axes=(1, 2))),
+    ('rot270', lambda b: np.rot90(b, 3, axes=(1, 2))),
+    ('transpose', lambda b: b.transpose(0, 2, 1, 3)),
+    ('transverse', lambda b: b[:, ::-1, ::-1].transpose(0, 2, 1, 3)),
+)
+MAX_TTA_VARIANTS = len(TTA_TRANSFORMS)
+DEFAULT_TTA_VARIANTS = MAX_TTA_VARIANTS
+
+
+def check_variants(n):
+    if not 1 <= n <= MAX_TTA_VARIANTS:
+        raise ValueError('TTA variants must be between 1 and %d, got %r' % (MAX_TTA_VARIANTS, n))
+    return n
+
+
+def augment(cells, n=DEFAULT_TTA_VARIANTS, out=None):
+    # (N x 50 x 50 x 3) cells -> (N * n x 50 x 50 x 3), the n variants of
+    # each cell next to each other. A single 50x50x3 cell is a batch of one.
+    cells = np.asarray(cells, dtype=np.float32)
+    if cells.shape == CELL_SHAPE:
+        cells = cells[np.newaxis]
+    check_variants(n)
+    if out is None:
+        out = np.empty((len(cells) * n,) + CELL_SHAPE, dtype=np.float32)
+    grouped = out[:len(cells) * n].reshape((len(cells), n) + CELL_SHAPE)
+    for k, (_, transform) in enumerate(TTA_TRANSFORMS[:n]):
+        grouped[:, k] = transform(cells)
+    return out[:len(cells) * n]
+
+
+def reduce_variants(predictions, n=DEFAULT_TTA_VARIANTS):
+    # (N * n x classes) predictions from augment()'s batch -> (mean, variance)
+    # per cell: mean is N x classes, variance (of the infected probability,
+    # index 0) is N
+    predictions = np.asarray(predictions, dtype=np.float64)
+    grouped = predictions.reshape((-1, n) + predictions.shape[1:])
+    return grouped.mean(axis=1), grouped[:, :, 0].var(axis=1)
+
+
+def predict_tta(predict_batch, cells, n=DEFAULT_TTA_VARIANTS, out=None):
+    # One forward pass over every variant of `cells` with predict_batch
+    # (e.g. InferenceEngine.predict_batch_versioned) -> (mean, variance,
+    # versions), versions being the model version of each cell's variants
+    predictions, versions = predict_batch(augment(cells, n, out=out))
+    mean, variance = reduce_variants(predictions, n)
+    versions = [', '.join(sorted({v for v in versions[i:i + n] if v})) or None for i in range(0, len(versions), n)]
+    return mean, variance, versions
+
+
+def tta_summary(mean, variance, n):
+    # JSON-friendly result for one cell
+    return {'variants': n, 'score': float(mean[0]), 'variance': float(variance),
+            'std': float(np.sqrt(variance))}